@@ -71,6 +71,19 @@ class TypeEnum(str, Enum):
     AIRandom = "AIRandom"          # AI随机匹配
 
 
+class DeliveryEnum(str, Enum):
+    """生成图片返回方式枚举 """
+    Base64 = "Base64"  # 直接返回 Base64 数据
+    Url = "Url"        # 保存到服务端，返回图片地址
+
+
+class PriorityEnum(str, Enum):
+    """生图排队优先级枚举（按优先级从高到低）"""
+    VIP = "VIP"        # 贵宾通道
+    Retry = "Retry"    # 失败后重试
+    Normal = "Normal"  # 普通
+
+
 class ClothesCategory(str, Enum):
     """服装类别枚举 """
     MaleTop = "MaleTop"        # 男上装
@@ -1,9 +1,11 @@
 """
 公共异常类
 """
-from typing import Any, Optional
+from typing import Any, Optional, Union
 from enum import Enum
 from fastapi import status as http_status
+from utils.flight_recorder import note_error
+from utils.metrics import metrics
 
 
 class ErrorCode(Enum):
@@ -13,6 +15,7 @@ class ErrorCode(Enum):
     SYSTEM_ERROR = (10000, "系统错误")
     NETWORK_ERROR = (10001, "网络错误")
     TIMEOUT_ERROR = (10002, "请求超时")
+    SERVICE_BUSY = (10003, "服务繁忙")
     
     PARAM_ERROR = (20000, "参数错误")
     PARAM_MISSING = (20001, "缺少必要参数")
@@ -41,6 +44,7 @@ class ErrorCode(Enum):
     RESOURCE_NOT_FOUND = (60001, "资源不存在")
     RESOURCE_ALREADY_EXISTS = (60002, "资源已存在")
     OPERATION_NOT_ALLOWED = (60003, "操作不允许")
+    IDEMPOTENCY_KEY_CONFLICT = (60004, "幂等键已用于不同的请求")
     
     def __init__(self, code: int, message: str):
         self.code = code
@@ -175,3 +179,49 @@ class ResourceNotFoundException(CommonException):
             error_code=error_code
         )
 
+
+class ConflictException(CommonException):
+    """资源冲突异常"""
+    def __init__(self, message: str = "资源冲突", data: Any = None, error_code: ErrorCode = ErrorCode.RESOURCE_ALREADY_EXISTS):
+        super().__init__(
+            success=False,
+            status=http_status.HTTP_409_CONFLICT,
+            message=message,
+            data=data,
+            error_code=error_code
+        )
+
+
+class ServiceBusyException(CommonException):
+    """服务繁忙异常（资源不足，稍后重试）"""
+    def __init__(self, message: str = "服务繁忙，请稍后重试", data: Any = None, error_code: ErrorCode = ErrorCode.SERVICE_BUSY):
+        super().__init__(
+            success=False,
+            status=http_status.HTTP_503_SERVICE_UNAVAILABLE,
+            message=message,
+            data=data,
+            error_code=error_code
+        )
+
+
+error_counter = metrics.counter("journey_errors_total", "按错误码统计返回给客户端的错误数")
+# 所有错误码都预先导出为 0，便于按错误码配置告警
+for _error_code in ErrorCode:
+    if _error_code is not ErrorCode.SUCCESS:
+        error_counter.inc(0, code=str(_error_code.code), name=_error_code.name)
+
+
+def record_error(error: Union[Exception, ErrorCode]) -> ErrorCode:
+    """
+    按错误码计数：自定义异常使用其错误码，其他异常计为系统错误
+    在错误返回给客户端的位置调用（错误响应、failed 事件），异常被包装后重新抛出时不重复计数
+    """
+    if isinstance(error, ErrorCode):
+        error_code = error
+    elif isinstance(error, CommonException):
+        error_code = error.error_code
+    else:
+        error_code = ErrorCode.SYSTEM_ERROR
+    error_counter.inc(code=str(error_code.code), name=error_code.name)
+    note_error(error_code.code, error_code.name, None if isinstance(error, ErrorCode) else str(error))
+    return error_code
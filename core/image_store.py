@@ -0,0 +1,105 @@
+import base64
+import hashlib
+import os
+import re
+import uuid
+from pathlib import Path
+from typing import Tuple
+from setting import settings
+
+# 生成图片的本地持久化工具函数
+# 图片按内容哈希命名，同一张图片只写一次，文件内容永不变化，可以放心长期缓存
+
+# 保存文件名格式：<sha256>.<扩展名>
+SAVED_IMAGE_NAME_PATTERN = re.compile(r'^([0-9a-f]{64})\.(png|jpeg)$')
+
+MIME_TYPE_MAPPING = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+}
+
+
+def get_saved_dir() -> Path:
+    """
+    获取生成图片的保存目录（SAVED_DIR 未配置时使用 utils/pictures/saved/）
+    """
+    saved_dir = settings.SAVED_DIR or os.getenv("SAVED_DIR")
+    if not saved_dir:
+        saved_dir = Path(__file__).parent.parent / "utils" / "pictures" / "saved"
+    saved_dir = Path(saved_dir)
+    saved_dir.mkdir(parents=True, exist_ok=True)
+    return saved_dir
+
+
+def decode_data_url(data_url: str) -> Tuple[str, bytes]:
+    """
+    解析 data URL，返回 (扩展名, 图片字节)
+
+    Raises:
+        ValueError: 格式不正确或不支持的图片格式
+    """
+    header, sep, base64_data = data_url.partition(',')
+    if not sep:
+        # 没有 data URL 前缀时按上游默认的 PNG 处理
+        header, base64_data = "data:image/png;base64", data_url
+
+    match = re.match(r'^data:image/([a-z]+);base64$', header, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"图片 data URL 格式不正确: {header[:50]}")
+
+    ext = match.group(1).lower()
+    if ext == "jpg":
+        ext = "jpeg"
+    if ext not in MIME_TYPE_MAPPING:
+        raise ValueError(f"不支持的图片格式: {ext}，仅支持: jpeg、png")
+
+    return ext, base64.b64decode(base64_data)
+
+
+def save_image(data_url: str) -> str:
+    """
+    将 Base64 图片按内容哈希写入保存目录（已存在则跳过），返回文件名
+
+    写入先落到临时文件再原子替换，并发写同一张图片也不会读到半个文件；
+    临时文件名带随机后缀，同一进程的多个线程同时保存同一张图片时各写各的临时文件
+
+    Args:
+        data_url: 图片 Base64 编码（格式：data:image/<format>;base64,<base64_data>）
+
+    Returns:
+        str: 保存的文件名（格式：<sha256>.<扩展名>）
+    """
+    ext, image_bytes = decode_data_url(data_url)
+    image_name = f"{hashlib.sha256(image_bytes).hexdigest()}.{ext}"
+
+    image_path = get_saved_dir() / image_name
+    if not image_path.exists():
+        tmp_path = image_path.with_name(f".{image_name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, image_path)
+
+    return image_name
+
+
+def get_saved_image_path(image_name: str) -> Path:
+    """
+    根据文件名获取已保存图片的路径
+
+    Raises:
+        FileNotFoundError: 文件名不合法或文件不存在
+    """
+    if not SAVED_IMAGE_NAME_PATTERN.match(image_name):
+        raise FileNotFoundError(f"图片不存在: {image_name}")
+
+    image_path = get_saved_dir() / image_name
+    if not image_path.is_file():
+        raise FileNotFoundError(f"图片不存在: {image_name}")
+    return image_path
+
+
+def get_image_url(image_name: str) -> str:
+    """
+    拼接图片访问地址（IMAGE_URL_PREFIX 可配置为 CDN 或完整域名）
+    """
+    return f"{settings.IMAGE_URL_PREFIX.rstrip('/')}/{image_name}"
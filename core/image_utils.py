@@ -1,24 +1,38 @@
 import re
 import os
+import logging
+import string
 from setting import settings
 import base64
-from typing import Union, List, Tuple
+from typing import TYPE_CHECKING, Dict, Union, List, Tuple
 from io import BytesIO
 from pathlib import Path
-from PIL import Image
+
+if TYPE_CHECKING:
+    from PIL import Image
 
 # 本地服装素材图片对应和处理图片的工具函数
+# PIL 在用到时才导入（服务启动预热时由 preload_image_codecs 在线程池中提前加载），导入本模块没有额外开销
+
+logger = logging.getLogger(__name__)
+
+DATA_URL_PREFIX_PATTERN = re.compile(r'^data:image/(png|jpg|jpeg);base64,', re.IGNORECASE)
+BASE64_ALPHABET = (string.ascii_letters + string.digits + "+/=").encode("ascii")
+
+# 输入图片大小上限（字节），与接口文档“最大大小 ≤ 10MB”一致
+MAX_INPUT_IMAGE_BYTES = 10 * 1024 * 1024
 
 def is_valid_base64_image(data: str) -> bool:
     """
     验证是否为有效的Base64图片格式
     格式：data:image/<format>;base64,<base64_data>
     """
-    base64_pattern = re.compile(
-        r'^data:image/(png|jpg|jpeg);base64,([A-Za-z0-9+/=]+)$',
-        re.IGNORECASE
-    )
-    return base64_pattern.match(data) is not None
+    match = DATA_URL_PREFIX_PATTERN.match(data)
+    if match is None:
+        return False
+    # 正文有数 MB，正则逐字符匹配约 20ms；删除合法字符后为空即全部合法，快一个数量级
+    body = data[match.end():]
+    return bool(body) and body.isascii() and not body.encode("ascii").translate(None, BASE64_ALPHABET)
 
 
 def validate_image_format(image_input: str) -> Tuple[bool, str]:
@@ -65,7 +79,15 @@ def normalize_image_input(image_input: str) -> str:
     return image_input
 
 
-def decode_base64_image(base64_string: str) -> Image.Image:
+def preload_image_codecs():
+    """
+    导入 PIL 并注册 JPEG/PNG 等解码插件（可重复调用），避免首个请求时再加载
+    """
+    from PIL import Image
+    Image.preinit()
+
+
+def decode_base64_image(base64_string: str) -> "Image.Image":
     """
     解码 Base64 字符串为 PIL Image 对象
     
@@ -89,12 +111,79 @@ def decode_base64_image(base64_string: str) -> Image.Image:
         image_bytes = base64.b64decode(base64_data)
         
         # 转换为 PIL Image
+        from PIL import Image
         image = Image.open(BytesIO(image_bytes))
         return image
     except Exception as e:
         raise ValueError(f"Base64 图片解码失败: {e}")
 
 
+def create_thumbnail_base64(base64_string: str, max_size: int = 256, quality: int = 70) -> str:
+    """
+    生成 JPEG 缩略图，用于流式接口的预览推送
+
+    Args:
+        base64_string: 原图 Base64 编码（格式：data:image/<format>;base64,<base64_data>）
+        max_size: 缩略图最长边（px）
+        quality: JPEG 压缩质量
+
+    Returns:
+        str: 缩略图 Base64 编码（格式：data:image/jpeg;base64,...）
+
+    Raises:
+        ValueError: 解码失败时抛出异常
+    """
+    image = decode_base64_image(base64_string)
+
+    # draft 让 JPEG 在解码阶段直接按比例缩小，PNG 无影响
+    image.draft('RGB', (max_size, max_size))
+    image.thumbnail((max_size, max_size))
+
+    # JPEG 不支持透明通道
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    output_buffer = BytesIO()
+    image.save(output_buffer, format='JPEG', quality=quality)
+    thumbnail_data = base64.b64encode(output_buffer.getvalue()).decode('utf-8')
+    return f"data:image/jpeg;base64,{thumbnail_data}"
+
+
+def normalize_portrait_image(image_bytes: bytes, max_size: int = 2048, quality: int = 90) -> str:
+    """
+    标准化用户上传的人像：按 EXIF 方向摆正、最长边缩放到 max_size 以内、统一转为 JPEG
+
+    Args:
+        image_bytes: 上传的原始图片字节
+        max_size: 最长边（px）
+        quality: JPEG 压缩质量
+
+    Returns:
+        str: 标准化后的 Base64 编码（格式：data:image/jpeg;base64,...）
+
+    Raises:
+        ValueError: 解码失败时抛出异常
+    """
+    from PIL import Image, ImageOps
+    try:
+        image = Image.open(BytesIO(image_bytes))
+        image.draft('RGB', (max_size, max_size))
+        image = ImageOps.exif_transpose(image)
+    except Exception as e:
+        raise ValueError(f"图片解码失败: {e}")
+
+    image.thumbnail((max_size, max_size))
+
+    # JPEG 不支持透明通道
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    output_buffer = BytesIO()
+    image.save(output_buffer, format='JPEG', quality=quality)
+    portrait_data = base64.b64encode(output_buffer.getvalue()).decode('utf-8')
+    return f"data:image/jpeg;base64,{portrait_data}"
+
+
 def validate_image_constraints(base64_string: str) -> Tuple[bool, str]:
     """
     验证图片是否满足所有约束条件
@@ -123,10 +212,11 @@ def validate_image_constraints(base64_string: str) -> Tuple[bool, str]:
         image_bytes = base64.b64decode(base64_data)
         file_size_mb = len(image_bytes) / (1024 * 1024)
         
-        if file_size_mb > 10:
-            return False, f"图片大小超过限制，当前大小: {file_size_mb:.2f}MB，最大允许: 10MB"
+        if len(image_bytes) > MAX_INPUT_IMAGE_BYTES:
+            return False, f"图片大小超过限制，当前大小: {file_size_mb:.2f}MB，最大允许: {MAX_INPUT_IMAGE_BYTES // (1024 * 1024)}MB"
         
         # 2. 解码图片
+        from PIL import Image
         image = Image.open(BytesIO(image_bytes))
         
         # 3. 检查图片格式
@@ -230,6 +320,49 @@ CLOTHES_STYLE_MAPPING = {
 }
 
 
+# 服装素材缓存：文件路径 -> Base64，素材在运行期间不变，启动时预加载，各请求共享同一份字符串
+_clothes_image_cache: Dict[Path, str] = {}
+
+
+def get_clothes_dir() -> Path:
+    """
+    获取服装图片根目录，默认 utils/pictures/clothes/
+    """
+    clothes_dir = settings.CLOTHES_DIR or os.getenv("CLOTHES_DIR")
+    if not clothes_dir:
+        return Path(__file__).parent.parent / "utils" / "pictures" / "clothes"
+    return Path(clothes_dir)
+
+
+def load_clothes_file(file_path: Path) -> str:
+    """
+    加载服装素材图片（带缓存）
+    """
+    cached = _clothes_image_cache.get(file_path)
+    if cached is None:
+        cached = load_local_image_to_base64(file_path)
+        _clothes_image_cache[file_path] = cached
+    return cached
+
+
+def preload_clothes_images() -> int:
+    """
+    预加载映射表中的全部服装素材，返回已缓存的素材数量
+    缺失或格式不支持的素材只记录警告，不影响启动（请求选到时仍按原逻辑报错）
+    """
+    clothes_dir = get_clothes_dir()
+    for style_id, filename in CLOTHES_STYLE_MAPPING.items():
+        gender_dir = "male" if style_id.startswith("male_") else "female"
+        file_path = clothes_dir / gender_dir / filename
+        if file_path in _clothes_image_cache:
+            continue
+        try:
+            load_clothes_file(file_path)
+        except (FileNotFoundError, ValueError) as e:
+            logger.warning(f"预加载服装素材失败: style_id={style_id}, {e}")
+    return len(_clothes_image_cache)
+
+
 def load_clothes_image(sex: int, upper_style_id: str = None, lower_style_id: str = None, dress_id: str = None) -> List[str]:
     """
     根据性别和样式ID加载服装图片
@@ -259,13 +392,7 @@ def load_clothes_image(sex: int, upper_style_id: str = None, lower_style_id: str
         >>> load_clothes_image(sex=1, dress_id="female_dress_01")
         ['data:image/jpeg;base64,...']
     """
-    # 获取服装图片根目录
-    # 图片存放在 utils/pictures/clothes/ 目录下
-    clothes_dir = settings.CLOTHES_DIR or os.getenv("CLOTHES_DIR")
-    if not clothes_dir:
-        clothes_dir = Path(__file__).parent.parent / "utils" / "pictures" / "clothes"
-    else:
-        clothes_dir = Path(clothes_dir)  # 转换为 Path 对象
+    clothes_dir = get_clothes_dir()
     
     # 标准化性别参数（支持字符串 "Male"/"Female" 和整数 0/1）
     if sex in ["Male", 0]:
@@ -295,7 +422,7 @@ def load_clothes_image(sex: int, upper_style_id: str = None, lower_style_id: str
         
         filename = CLOTHES_STYLE_MAPPING[dress_id]
         dress_file = gender_dir / filename
-        result.append(load_local_image_to_base64(dress_file))
+        result.append(load_clothes_file(dress_file))
     
     # 加载上装+下装
     if upper_style_id is not None and lower_style_id is not None:
@@ -312,8 +439,8 @@ def load_clothes_image(sex: int, upper_style_id: str = None, lower_style_id: str
         upper_file = gender_dir / upper_filename
         lower_file = gender_dir / lower_filename
         
-        result.append(load_local_image_to_base64(upper_file))
-        result.append(load_local_image_to_base64(lower_file))
+        result.append(load_clothes_file(upper_file))
+        result.append(load_clothes_file(lower_file))
     
     return result
 
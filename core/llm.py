@@ -4,11 +4,12 @@ from typing import Union
 import time
 import logging
 import os
-from typing import Optional, List
-from openai import OpenAI, AsyncOpenAI
+from typing import TYPE_CHECKING, Optional, List
 from pydantic import BaseModel
 from core.image_utils import prepare_image_list_for_api
 from setting import settings
+from utils.flight_recorder import note_size, note_upstream_event
+from utils.tracing import propagation_headers, record_stage, trace_stage
 from core.exceptions import (
     ErrorCode, 
     LLMException, 
@@ -19,8 +20,27 @@ from core.exceptions import (
 ) 
 
 
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
 logger = logging.getLogger(__name__)
 
+# openai SDK 导入时会加载全部类型定义（约 0.5s，httpx 随之导入），延迟到用到时才导入；
+# 服务启动预热时在线程池中调用 load_openai 提前导入，首个请求不会在事件循环中导入
+_openai = None
+
+
+def load_openai():
+    """
+    导入并返回 openai 模块（可重复调用）
+    """
+    global _openai
+    if _openai is None:
+        import openai
+        _openai = openai
+    return _openai
+
+
 class LLMConf(BaseModel):
     """
     大模型配置
@@ -31,6 +51,69 @@ class LLMConf(BaseModel):
     stream_timeout: Optional[int] = None
     post_timeout: Optional[int] = None
 
+# 生图上游共享客户端：进程内复用连接池，避免每次请求重新建立 TCP/TLS 连接
+_image_client: Optional["AsyncOpenAI"] = None
+_image_client_key: Optional[tuple] = None
+
+
+def get_image_client(base_url: str, api_key: str) -> "AsyncOpenAI":
+    """
+    获取生图上游共享客户端，配置变化时重新创建
+    """
+    global _image_client, _image_client_key
+    key = (base_url, api_key)
+    if _image_client is None or _image_client_key != key:
+        openai = load_openai()
+        import httpx
+        _image_client = openai.AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            timeout=settings.UPSTREAM_TIMEOUT_SECONDS,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.UPSTREAM_MAX_CONNECTIONS
+                )
+            )
+        )
+        _image_client_key = key
+        logger.info(f"创建生图上游共享客户端: base_url={base_url}, 最大连接数={settings.UPSTREAM_MAX_CONNECTIONS}")
+    return _image_client
+
+
+async def warm_up_image_client() -> bool:
+    """
+    预热生图上游连接：提前完成 DNS 解析和 TCP/TLS 握手，连接保留在连接池中
+    上游返回任何状态码都算预热成功，未配置或连接失败时返回 False（不影响启动）
+    """
+    base_url = settings.LLM_URL or os.getenv('LLM_URL')
+    api_key = settings.LLM_API_KEY or os.getenv('LLM_API_KEY')
+    if not base_url or not api_key:
+        return False
+    client = get_image_client(base_url, api_key)
+    import httpx
+    try:
+        await client.get("/models", cast_to=httpx.Response, options={"timeout": 5.0, "max_retries": 0})
+    except load_openai().APIStatusError:
+        # 上游返回了错误状态码（如 404），说明连接已经建立
+        pass
+    except Exception as e:
+        logger.warning(f"生图上游连接预热失败: {e}")
+        return False
+    return True
+
+
+async def close_image_client():
+    """
+    关闭生图上游共享客户端（服务停机时调用）
+    """
+    global _image_client, _image_client_key
+    if _image_client is not None:
+        await _image_client.close()
+        _image_client = None
+        _image_client_key = None
+
+
 class LLMModel:
     """
     LLM 模型调用类，基于 OpenAI 实现
@@ -56,8 +139,19 @@ class LLMModel:
         # 确保 api_key 有效：优先使用配置中的 api_key，如果为 None 或空字符串则尝试从环境变量获取
         api_key = (conf.api_key or "").strip() or os.getenv("OPENAI_API_KEY", "").strip()
 
+        self._api_key = api_key
+        self._headers = headers
+        self._client: Optional["AsyncOpenAI"] = None
 
-        self.client = AsyncOpenAI(base_url=conf.url, api_key=api_key, timeout=30.0, default_headers=headers)
+    @property
+    def client(self) -> "AsyncOpenAI":
+        """
+        文本对话客户端，首次使用时才创建
+        生图使用进程内共享的客户端（get_image_client），每个请求都创建客户端会在事件循环中同步初始化连接池和 SSL 上下文
+        """
+        if self._client is None:
+            self._client = load_openai().AsyncOpenAI(base_url=self.conf.url, api_key=self._api_key, timeout=30.0, default_headers=self._headers)
+        return self._client
 
     async def generate(
         self, prompt: str, model_name: str, stream: bool = False, **kwargs
@@ -109,8 +203,7 @@ class LLMModel:
         except Exception as e:
             elapsed_time = time.time() - start_time
             error_msg = f"LLM 生成失败, 模型: {model_name}, 耗时: {elapsed_time:.2f}s, 错误: {str(e)}"
-            logger.error(error_msg)
-            logger.error(e, error_msg)
+            logger.error(error_msg, exc_info=True)
             raise
 
     async def chat(
@@ -162,8 +255,7 @@ class LLMModel:
         except Exception as e:
             elapsed_time = time.time() - start_time
             error_msg = f"LLM 对话失败, 模型: {model_name}, 耗时: {elapsed_time:.2f}s, 错误: {str(e)}"
-            logger.error(error_msg)
-            logger.error(e, error_msg)
+            logger.error(error_msg, exc_info=True)
             raise
 
     async def create_picture_by_seed_ream(self, InputImageList: List[str], SystemPrompt: str):
@@ -206,56 +298,53 @@ class LLMModel:
                     error_code=ErrorCode.PARAM_MISSING
                 )
             
-            logger.info(f"  Base URL: {base_url}")
-            logger.info(f"  API Key: {'已配置' if api_key else '未配置'}")
-            logger.info(f"  Model ID: {model_id}")
+            logger.debug(f"调用豆包生图接口: base_url={base_url}, model_id={model_id}, 输入图片 {len(InputImageList)} 张")
             
-            # 创建 OpenAI 客户端
-            try:
-                client = OpenAI(
-                    base_url=base_url, 
-                    api_key=api_key,
-                    timeout=120.0,  # 图片生成可能需要较长时间
-                )
-                logger.info(" OpenAI 客户端创建成功")
-            except Exception as e:
-                logger.error(f"创建 OpenAI 客户端失败: {e}")
-                raise 
+            # 使用进程内共享的异步客户端（连接池已在启动时预热）
+            client = get_image_client(base_url, api_key)
         
+            # 上游耗时统计：建立连接、首张图片、图片间隔、上游总耗时
+            # 生成器挂起（等待下游写出）的时间不计入，只统计上游本身
+            upstream_start = time.perf_counter()
+            upstream_start_ns = time.time_ns()
+            note_size("upstream_input_bytes", sum(len(image) for image in InputImageList))
+            
             # 使用 OpenAI SDK 的 images.generate 接口
-            # 豆包特有参数通过 extra_body 传递
-            stream = client.images.generate(
-                model=model_id,
-                prompt=SystemPrompt,
-                size="2K",
-                response_format="b64_json",  # 使用 b64_json 格式接收 Base64 数据
-                stream=True,
-                extra_body={
-                    "image": prepared_images,  # 输入图片
-                    "watermark": False,
-                    "sequential_image_generation": "auto",
-                    "sequential_image_generation_options": {
-                        "max_images": 4
+            # 豆包特有参数通过 extra_body 传递，请求ID 和 traceparent 通过请求头传递
+            with trace_stage("upstream_connect", model=model_id) as span:
+                stream = await client.images.generate(
+                    model=model_id,
+                    prompt=SystemPrompt,
+                    size="2K",
+                    response_format="b64_json",  # 使用 b64_json 格式接收 Base64 数据
+                    stream=True,
+                    extra_headers=propagation_headers(span),
+                    extra_body={
+                        "image": prepared_images,  # 输入图片
+                        "watermark": False,
+                        "sequential_image_generation": "auto",
+                        "sequential_image_generation_options": {
+                            "max_images": 4
+                        }
                     }
-                }
-            )
+                )
             
             # 流式返回图片数据 - 直接 yield，不再收集到列表
             logger.info("开始接收流式响应...")
             event_count = 0
-            for event in stream:
+            image_count = 0
+            paused_seconds = 0.0
+            last_image_at = upstream_start
+            async for event in stream:
                 event_count += 1
                 if event is None:
-                    logger.debug(f"Event {event_count}: None")
                     continue
                 
-                # 打印事件的完整结构用于调试
-                logger.info(f"Event {event_count}: type={type(event).__name__}")
-                logger.debug(f"Event {event_count} attributes: {dir(event)}")
-                
-                # OpenAI SDK 的流式响应结构
+                # OpenAI SDK 的流式响应结构（逐事件日志限流，避免高并发时刷屏）
                 event_type = getattr(event, 'type', None)
-                logger.info(f"Event {event_count}: event_type={event_type}")
+                logger.info(f"上游事件 {event_count}: type={event_type}", extra={"rate_limit": "upstream_event"})
+                b64_json = getattr(event, 'b64_json', None)
+                note_upstream_event(event_type, len(b64_json) if isinstance(b64_json, str) else None)
                 
                 if event_type == "image_generation.partial_failed":
                     error = getattr(event, 'error', None)
@@ -269,9 +358,18 @@ class LLMModel:
                         base64_data = event.b64_json
                         if not base64_data.startswith('data:image'):
                             base64_data = f"data:image/png;base64,{base64_data}"
-                        logger.info(f"收到一张图片，size={len(base64_data)}")
+                        logger.info(f"收到一张图片，size={len(base64_data)}", extra={"rate_limit": "upstream_image"})
+                        received_at = time.perf_counter()
+                        record_stage(
+                            "upstream_first_image" if image_count == 0 else "upstream_image_gap",
+                            received_at - last_image_at,
+                            index=image_count
+                        )
+                        image_count += 1
                         # 直接返回一张
                         yield base64_data
+                        last_image_at = time.perf_counter()
+                        paused_seconds += last_image_at - received_at
                     elif hasattr(event, 'url') and event.url:
                         # URL 模式
                         size = getattr(event, 'size', 'unknown')
@@ -294,6 +392,13 @@ class LLMModel:
                     elif hasattr(event, 'data'):
                         logger.info(f"Found data in event: {type(event.data)}")
             
+            record_stage(
+                "upstream_total",
+                time.perf_counter() - upstream_start - paused_seconds,
+                start_ns=upstream_start_ns,
+                images=image_count,
+                paused_seconds=round(paused_seconds, 3)
+            )
             logger.info(f"流式响应结束，共收到 {event_count} 个事件")
             
         except (ParamException, AuthException, LLMException, NetworkException, TimeoutException) as e:
@@ -367,4 +472,5 @@ class LLMModel:
         """
         关闭客户端连接
         """
-        await self.client.close()
+        if self._client is not None:
+            await self._client.close()
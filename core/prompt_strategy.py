@@ -1,9 +1,12 @@
+import logging
 from abc import ABC, abstractmethod
 from typing import Dict, Any
 from core.prompt import BASE_PROMPT_TEMPLATE, CITY_SCENES, CLOTHING_TEMPLATES
 from core.enum import ModeEnum, StyleEnum, MaterialEnum, ColorEnum, TypeEnum, CityEnum
 from model.createPictureReq import CreatePictureRequest
 
+logger = logging.getLogger(__name__)
+
 
 class PromptStrategy(ABC):
     """提示词生成策略基类"""
@@ -145,3 +148,19 @@ def generate_prompt_by_request(request_dto: CreatePictureRequest) -> str:
     """
     strategy = PromptStrategyFactory.get_strategy(request_dto.mode)
     return strategy.generate_prompt(request_dto)
+
+
+def preload_prompt_tables() -> int:
+    """
+    启动时检查提示词表：每个城市都应有场景描述，缺失的城市会退化为通用描述，只记录警告
+
+    Returns:
+        int: 有场景描述的城市数量
+    """
+    missing = [city.name for city in CityEnum if city.name not in CITY_SCENES]
+    if missing:
+        logger.warning(f"以下城市缺少场景描述，将使用通用描述: {missing}")
+    for template_name in ("easy_mode", "master_mode"):
+        if template_name not in CLOTHING_TEMPLATES:
+            logger.warning(f"缺少服装提示词模板: {template_name}")
+    return len(CityEnum) - len(missing)
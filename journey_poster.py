@@ -1,27 +1,44 @@
 # 提供 fastapi接口
-from fastapi import FastAPI, HTTPException, Request, status as http_status, UploadFile, Form, File
+import time
+_IMPORT_STARTED_AT = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request, status as http_status, UploadFile, Form, File, Header, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse, Response
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any
 from contextlib import asynccontextmanager
 import logging
 from datetime import datetime
-import uvicorn
 import asyncio
 import json
 import base64
-from setting import settings, ENV
+import hmac
+from setting import settings, ENV, init_runtime
 from core.llm import LLMModel
 from core.llm import LLMConf
 from model.createPictureReq import CreatePictureRequest
-from model.createPictureResp import CreatePictureResponse
-from service.generation_Image import DoubaoImages
+from model.createPictureResp import CreatePictureResponse, ImageItem
+from service.generation_Image import DoubaoImages, iter_timed_event_chunks
 from model.createPictureResp import ImageStreamEvent, StreamStatusEnum
-from core.exceptions import CommonException, ParamException
+from service.job_manager import job_manager
+from service.batch_manager import batch_manager
+from service.lifecycle import lifecycle
+from core.enum import PriorityEnum
+from core.exceptions import CommonException, ParamException, ResourceNotFoundException, AuthException, ConflictException, ErrorCode, record_error
+from core.image_store import get_saved_image_path, MIME_TYPE_MAPPING
+from service.admission import admission
+from utils.metrics import metrics
+from utils.flight_recorder import flight_recorder, note_attempt
+from utils.memory_tracker import memory_tracker
+from utils.loop_monitor import LoopBlockedError, loop_monitor
+from utils.profiler import ProfilerBusyError, cpu_profiler, memory_profiler
+from utils.tracing import SPAN_KIND_SERVER, new_request_id, record_stage, request_id_var, tracer
+from starlette.datastructures import Headers, MutableHeaders
 
-# 初始化日志
+# 初始化日志等进程级运行环境（只在服务入口调用一次）
+init_runtime()
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
@@ -47,6 +64,9 @@ async def lifespan(app: FastAPI):
         else:
             logger.warning("火山豆包配置不完整，请检查环境变量")
         
+        # 预加载素材和提示词表、预热上游连接、恢复未完成的批量任务，完成后才标记为就绪
+        await lifecycle.start()
+        
         logger.info("Journey Poster 服务启动完成")
         
         # 运行应用
@@ -57,12 +77,14 @@ async def lifespan(app: FastAPI):
         logger.info("Journey Poster 服务正在关闭")
         
         try:
-            # 清理资源
+            # 停止准入、等待进行中的生成结束，再关闭连接池和线程池
             logger.info("清理服务资源")
-            
-            # 这里可以添加需要清理的资源，比如关闭数据库连接、清理缓存等
+            await lifecycle.stop()
             
             logger.info("Journey Poster 服务关闭完成")
+        except LoopBlockedError:
+            # 事件循环监控严格模式（CI）：让测试失败
+            raise
         except Exception as e:
             logger.error(f"服务关闭时出错: {e}")
 
@@ -100,16 +122,6 @@ async def process_response(data: Dict[str, Any], status: int = 200, success: boo
 
 # CommonException 已移至 core.exceptions 模块，避免循环导入
 
-# CORS 中间件配置
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["X-Request-ID", "X-Process-Time"]
-)
-
 # 异常处理中间件
 @app.middleware("http")
 async def exception_middleware(request: Request, call_next):
@@ -124,6 +136,7 @@ async def exception_middleware(request: Request, call_next):
                 "type": error["type"]
             })
         logger.error(f"参数验证错误: {str(e)}")
+        record_error(ErrorCode.PARAM_INVALID)
         return JSONResponse(
             status_code=http_status.HTTP_422_UNPROCESSABLE_ENTITY,
             content={
@@ -135,6 +148,7 @@ async def exception_middleware(request: Request, call_next):
         )
     except HTTPException as e:
         logger.error(f"HTTP异常: {e.status_code} - {e.detail}")
+        record_error(ErrorCode.PARAM_ERROR if e.status_code < 500 else ErrorCode.SYSTEM_ERROR)
         return JSONResponse(
             status_code=e.status_code,
             content={
@@ -146,6 +160,7 @@ async def exception_middleware(request: Request, call_next):
         )
     except CommonException as e:
         logger.error(f"自定义异常: {e.status} - {e.message}")
+        record_error(e)
         return JSONResponse(
             status_code=e.status,
             content={
@@ -157,12 +172,174 @@ async def exception_middleware(request: Request, call_next):
         )
     except Exception as e:
         logger.error(f"请求异常: {type(e).__name__}: {str(e)}")
+        record_error(e)
         return JSONResponse(
             status_code=500,
             content={"success": False, "status": 500, "message": "服务器内部错误", "data": None}
         )
 
 
+# 探活和监控接口调用频繁，不记录 span 和慢请求
+UNTRACED_PATHS = ("/metrics", "/health", "/ready")
+
+
+def is_traced_path(path: str) -> bool:
+    return path not in UNTRACED_PATHS and not path.startswith("/debug/")
+
+
+# HTTP/2 禁止逐跳头（RFC 9113 8.2.2），流式接口为 HTTP/1.1 设置的 Connection: keep-alive 在 HTTP/2 下要去掉
+HOP_BY_HOP_HEADERS = ("connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade")
+
+
+class RequestContextMiddleware:
+    """
+    请求上下文中间件（纯 ASGI，流式响应写完时才结束）
+
+    - 沿用请求头 X-Request-ID（格式合法时）或生成新的请求ID，写入 contextvar：
+      之后的日志、调用上游的请求头、后台任务都带有该请求ID
+    - 响应头返回 X-Request-ID 和 X-Process-Time（收到请求到开始返回响应的秒数，流式接口即首字节时间）
+    - 请求到达时间写入 request.state.received_at，路由函数据此统计 multipart 表单的接收和解析耗时
+    - 为每个请求创建根 span（沿用请求头 traceparent），各阶段的 span 都挂在它下面
+    - 记录请求的时间线，请求结束时交给慢请求记录器（/debug/slow）
+    - 开启请求内存统计（REQUEST_MEMORY_TRACKING）时记录请求期间的内存峰值和结束时未释放的内存
+    - HTTP/2 连接（server.py 的 SERVER_HTTP2 模式）去掉响应中的逐跳头
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        request_headers = Headers(scope=scope)
+        request_id = new_request_id(request_headers.get("x-request-id"))
+        token = request_id_var.set(request_id)
+        start_time = time.perf_counter()
+        span = None
+        record = None
+        usage = None
+        if is_traced_path(scope["path"]):
+            record, record_token = flight_recorder.start(request_id, scope["method"], scope["path"])
+            usage, usage_token = memory_tracker.start()
+            span = tracer.start_span(
+                f"{scope['method']} {scope['path']}",
+                SPAN_KIND_SERVER,
+                traceparent=request_headers.get("traceparent"),
+                attributes={"http.method": scope["method"], "http.target": scope["path"]}
+            )
+        # 在根 span 开始之后记录，multipart_read 阶段的 span 不会早于根 span
+        scope.setdefault("state", {})["received_at"] = time.perf_counter()
+        status_code = None
+        strip_hop_by_hop = scope.get("http_version") not in ("1.0", "1.1")
+        
+        async def send_with_headers(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["X-Request-ID"] = request_id
+                headers["X-Process-Time"] = f"{time.perf_counter() - start_time:.4f}"
+                if strip_hop_by_hop:
+                    for name in HOP_BY_HOP_HEADERS:
+                        del headers[name]
+            await send(message)
+        
+        error = None
+        try:
+            with tracer.activate(span):
+                await self.app(scope, receive, send_with_headers)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if span is not None:
+                if status_code is not None:
+                    span.set_attribute("http.status_code", status_code)
+                tracer.end_span(span, error)
+            if usage is not None:
+                memory_tracker.finish(usage, usage_token, scope["path"])
+            if record is not None:
+                flight_recorder.finish(record, record_token, status_code, error)
+            request_id_var.reset(token)
+
+
+# 需要准入控制的生图入口（包括创建异步任务和批量任务）
+ADMISSION_PATHS = ("/createPicture", "/createPictureStream", "/createPictureStreamBinary", "/jobs", "/batches")
+
+# 准入控制中间件（在路由解析 multipart 上传之前执行）
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    if request.method != "POST" or request.url.path not in ADMISSION_PATHS:
+        return await call_next(request)
+    
+    retry_after = admission.check(request.url.path)
+    if retry_after is None:
+        return await call_next(request)
+    record_error(ErrorCode.SERVICE_BUSY)
+    return build_overloaded_response(request.url.path, retry_after)
+
+
+def observe_multipart_read(request: Request):
+    """
+    记录 multipart 表单的接收和解析耗时（FastAPI 在调用路由函数之前已经读完请求体）
+    """
+    received_at = getattr(request.state, "received_at", None)
+    if received_at is not None:
+        record_stage("multipart_read", time.perf_counter() - received_at)
+
+
+# 最后注册的中间件在最外层。CORS 在准入控制和异常处理中间件之外：
+# 这两个中间件直接返回的响应（503 服务繁忙、错误响应）同样带有 CORS 头，跨域的浏览器才能读到状态码和 Retry-After
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Request-ID", "X-Process-Time", "Retry-After", "Idempotency-Replayed"]
+)
+
+# 请求ID 在其他中间件之前设置，异常处理中间件的日志同样带有请求ID
+app.add_middleware(RequestContextMiddleware)
+
+
+def build_overloaded_response(path: str, retry_after: int) -> Response:
+    """
+    服务繁忙时的拒绝响应：503 + Retry-After
+    流式接口的响应体是一个携带 retryAfter 的 failed 事件，前端可以沿用原有的事件处理逻辑
+    """
+    message = f"服务繁忙，请 {retry_after} 秒后重试"
+    headers = {"Retry-After": str(retry_after)}
+    if path == "/createPictureStream":
+        event = ImageStreamEvent(status=StreamStatusEnum.Failed, message=message, retryAfter=retry_after)
+        return Response(
+            content=event.to_event_data(),
+            status_code=http_status.HTTP_503_SERVICE_UNAVAILABLE,
+            media_type="text/event-stream",
+            headers=headers
+        )
+    if path == "/createPictureStreamBinary":
+        event = ImageStreamEvent(status=StreamStatusEnum.Failed, message=message, retryAfter=retry_after)
+        return Response(
+            content=event.to_binary_frame(),
+            status_code=http_status.HTTP_503_SERVICE_UNAVAILABLE,
+            media_type="application/octet-stream",
+            headers=headers
+        )
+    return JSONResponse(
+        status_code=http_status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "success": False,
+            "status": http_status.HTTP_503_SERVICE_UNAVAILABLE,
+            "message": message,
+            "data": {"retryAfter": retry_after}
+        },
+        headers=headers
+    )
+
+
 
 @app.get("/")
 async def root():
@@ -170,16 +347,237 @@ async def root():
     return await process_response(data, message="journey poster service 运行正常")
 
 
+def get_client_id(request: Request) -> Optional[str]:
+    """
+    获取调度用的客户端标识：客户端 IP（部署在代理后面时由 uvicorn 的 --forwarded-allow-ips 从可信代理的
+    X-Forwarded-For 解析），不使用客户端可以随意轮换的请求头或请求参数
+    """
+    return request.client.host if request.client else None
+
+
+def get_priority(request: Request, attempt: int = 0) -> PriorityEnum:
+    """
+    获取排队优先级通道，由服务端决定：
+    - 请求头 X-VIP-Token 与 VIP_TOKEN 一致时走贵宾通道
+    - 接口内部的失败重试走 Retry 通道
+    - 其他请求走 Normal 通道
+    """
+    token = request.headers.get("X-VIP-Token")
+    if settings.VIP_TOKEN and token and hmac.compare_digest(token.encode("utf-8"), settings.VIP_TOKEN.encode("utf-8")):
+        return PriorityEnum.VIP
+    if attempt > 0:
+        return PriorityEnum.Retry
+    return PriorityEnum.Normal
+
+@app.get("/metrics", tags=["Health"])
+async def get_metrics():
+    """
+    监控指标（Prometheus 文本格式）
+    """
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/health", tags=["Health"])
 async def health_check():
     logger.debug("Health check requested")
     data = {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
     return await process_response(data, message="healthy")
 
+@app.get("/ready", tags=["Health"])
+async def readiness_check():
+    """
+    就绪检查：启动预热完成前、停机排空期间返回 503，负载均衡据此摘除流量
+    """
+    data = {"ready": lifecycle.ready, "inFlight": lifecycle.in_flight()}
+    if not lifecycle.ready:
+        return await process_response(data, status=http_status.HTTP_503_SERVICE_UNAVAILABLE, success=False, message="not ready")
+    return await process_response(data, message="ready")
+
+def require_debug_token(
+    authorization: Optional[str] = Header(None, alias="Authorization"),
+    debug_token: Optional[str] = Header(None, alias="X-Debug-Token")
+):
+    """
+    调试接口认证：请求头 Authorization: Bearer <DEBUG_TOKEN> 或 X-Debug-Token: <DEBUG_TOKEN>
+    未配置 DEBUG_TOKEN 时调试接口不可用（404）
+    """
+    if not settings.DEBUG_TOKEN:
+        raise ResourceNotFoundException(message="调试接口未启用")
+    token = debug_token
+    if token is None and authorization and authorization.startswith("Bearer "):
+        token = authorization[len("Bearer "):].strip()
+    if not token or not hmac.compare_digest(token.encode("utf-8"), settings.DEBUG_TOKEN.encode("utf-8")):
+        raise AuthException(message="调试接口认证失败", error_code=ErrorCode.AUTH_UNAUTHORIZED)
+
+@app.get("/debug/slow", tags=["Debug"], dependencies=[Depends(require_debug_token)])
+async def get_slow_requests(limit: Optional[int] = Query(None, ge=1, description="最多返回多少条")):
+    """
+    慢请求记录：最近 FLIGHT_RECORDER_WINDOW_SECONDS 内最慢的 FLIGHT_RECORDER_SIZE 个请求，按耗时从高到低
+    
+    每条记录包含各阶段时间线、数据大小、上游事件序列、失败的尝试、错误和最终状态，时间为相对请求开始的毫秒数
+    """
+    data = {
+        "windowSeconds": flight_recorder.window_seconds,
+        "capacity": flight_recorder.capacity,
+        "requests": flight_recorder.snapshot(limit)
+    }
+    return await process_response(data)
+
+@app.get("/debug/loop", tags=["Debug"], dependencies=[Depends(require_debug_token)])
+async def get_loop_blocks():
+    """
+    事件循环阻塞记录：最近 20 次阻塞超过 LOOP_BLOCK_THRESHOLD_MS 的时长和调用栈，按时间从新到旧
+    
+    调用栈在阻塞进行中抓取，栈顶即阻塞事件循环的同步调用；阻塞时长刚超过阈值时可能来不及抓取（stack 为 null）
+    """
+    data = {
+        "running": loop_monitor.running,
+        "thresholdMs": loop_monitor.threshold_ms,
+        "maxLagMs": round(loop_monitor.max_lag * 1000, 1),
+        "blocks": loop_monitor.snapshot()
+    }
+    return await process_response(data)
+
+@app.get("/debug/profile/cpu", tags=["Debug"], dependencies=[Depends(require_debug_token)])
+async def profile_cpu(
+    seconds: float = Query(10, gt=0, description="采样时长（秒），不超过 PROFILE_MAX_SECONDS"),
+    interval_ms: float = Query(5, ge=1, le=1000, description="采样间隔（毫秒）"),
+    format: str = Query("collapsed", pattern="^(collapsed|json)$", description="collapsed: 折叠栈文本（火焰图输入）| json: 按自身耗时排序的函数"),
+    include_idle: bool = Query(False, description="是否包含空闲等待的线程（事件循环 select、线程池等任务）"),
+    limit: int = Query(30, ge=1, description="json 格式最多返回多少个函数")
+):
+    """
+    对当前 worker 进程做 CPU 采样，采样期间阻塞该调试请求，不影响其他请求
+    
+    - `format=collapsed`：每行 `线程;外层函数;...;栈顶函数 次数`，可直接交给 flamegraph.pl / speedscope 生成火焰图
+    - 同一时间只允许一个采样，进行中时返回 409
+    """
+    seconds = min(seconds, settings.PROFILE_MAX_SECONDS)
+    loop = asyncio.get_running_loop()
+    try:
+        # 采样最长持续 PROFILE_MAX_SECONDS，放在默认线程池中，不占用生图使用的共享线程池
+        profile = await loop.run_in_executor(None, cpu_profiler.profile, seconds, interval_ms / 1000, include_idle)
+    except ProfilerBusyError as e:
+        raise ConflictException(message=str(e))
+    if format == "collapsed":
+        return Response(content=profile.collapsed(), media_type="text/plain; charset=utf-8")
+    return await process_response(profile.to_dict(limit))
+
+@app.post("/debug/profile/memory/start", tags=["Debug"], dependencies=[Depends(require_debug_token)])
+async def start_memory_profile(frames: int = Query(25, ge=1, le=100, description="每次分配记录的调用栈深度")):
+    """
+    开始 tracemalloc 内存追踪并记录基线快照（已在追踪时只重新记录基线）
+    
+    追踪期间所有内存分配都有额外开销，分析完应调用 `/debug/profile/memory/stop`
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, memory_profiler.start, frames)
+    return await process_response({"tracing": True, "frames": frames})
+
+@app.get("/debug/profile/memory/snapshot", tags=["Debug"], dependencies=[Depends(require_debug_token)])
+async def get_memory_snapshot(
+    limit: int = Query(30, ge=1, description="最多返回多少条"),
+    key_type: str = Query("lineno", pattern="^(lineno|filename|traceback)$", description="按代码行 / 文件 / 完整调用栈分组"),
+    rebase: bool = Query(False, description="以本次快照作为新的基线")
+):
+    """
+    当前内存快照与基线对比，按增长的字节数从高到低排列
+    
+    每条包含当前大小、相对基线的增长、分配块数量和分配位置的调用栈
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        data = await loop.run_in_executor(None, memory_profiler.snapshot, limit, key_type, rebase)
+    except RuntimeError:
+        raise ConflictException(message="内存追踪未开启，请先调用 /debug/profile/memory/start")
+    return await process_response(data)
+
+@app.post("/debug/profile/memory/stop", tags=["Debug"], dependencies=[Depends(require_debug_token)])
+async def stop_memory_profile():
+    """
+    停止 tracemalloc 内存追踪
+    """
+    memory_profiler.stop()
+    return await process_response({"tracing": False})
+
+@app.post("/portraits", tags=["图生图接口"])
+async def create_portrait(
+    file: UploadFile = File(..., alias="file", description="用户上传的原图文件")
+):
+    """
+    上传人像，返回人像ID
+    
+    上传时完成标准化（按 EXIF 摆正、缩放、转 JPEG）和校验，有效期内生成接口的 `data` 中传入
+    `portraitId` 即可代替上传文件，同一张人像尝试多个城市时不需要重复上传和校验。
+    
+    **返回：** `{"portraitId": "...", "expiresIn": 1800}`
+    """
+    portrait = await DoubaoImages(LLMConf()).create_portrait(file)
+    return await process_response(portrait.model_dump(), message="人像上传成功")
+
+def idempotency_headers(replayed: bool) -> Dict[str, str]:
+    """
+    幂等请求的响应头：复用已有生成时标记 Idempotency-Replayed
+    """
+    return {"Idempotency-Replayed": "true"} if replayed else {}
+
+
+async def iter_job_images(job_id: str):
+    """
+    将任务事件转换为图片列表，供同步接口按幂等键接入或回放
+    第一张图片之前的失败事件转为异常；结束时校验图片数量
+    """
+    image_count = 0
+    async for _, event in job_manager.follow_events(job_id):
+        if event is None or event.status == StreamStatusEnum.Queued:
+            continue
+        if event.status == StreamStatusEnum.Generating:
+            yield ImageItem(id=event.index, base64=event.base64, url=event.url)
+            image_count += 1
+        elif event.status == StreamStatusEnum.Failed:
+            raise CommonException(message="图生图接口异常: " + (event.message or ""))
+    DoubaoImages.verify_image_count(image_count)
+
+
+async def create_idempotent_picture_stream(request: Request, file: Optional[UploadFile], data: str, idempotency_key: str) -> StreamingResponse:
+    """
+    带幂等键的流式生成：生成在后台任务中执行，当前连接只订阅任务事件，
+    客户端断线后携带相同的键重试即可接上，不会重新生成
+    """
+    headers = {
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "X-Accel-Buffering": "no"
+    }
+    try:
+        picture_request = await DoubaoImages.validate_input_data(file, data, get_client_id(request), get_priority(request))
+    except Exception as e:
+        # 与不带幂等键时一致：参数错误以 failed 事件返回
+        error_event = DoubaoImages(LLMConf()).build_failed_event(e)
+        return StreamingResponse(iter([error_event.to_event_data()]), media_type="text/event-stream", headers=headers)
+    
+    job, replayed = await job_manager.create_idempotent_job(f"/createPictureStream:{idempotency_key}", picture_request)
+    
+    async def generateJobStream():
+        async for _, event in job_manager.follow_events(job.job_id):
+            if event is None:
+                yield b": keep-alive\n\n"
+                continue
+            for chunk in iter_timed_event_chunks(event):
+                yield chunk
+    
+    return StreamingResponse(
+        generateJobStream(),
+        media_type="text/event-stream",
+        headers={**headers, **idempotency_headers(replayed)}
+    )
+
+
 @app.post("/createPicture", tags=["图生图接口"])
 async def create_picture(
-    file: UploadFile = File(..., alias="file", description="用户上传的原图文件"),
-    data: str = Form(..., alias="data", description="JSON 字符串格式的请求参数")
+    request: Request,
+    file: Optional[UploadFile] = File(None, alias="file", description="用户上传的原图文件（data 中传 portraitId 时可不传）"),
+    data: str = Form(..., alias="data", description="JSON 字符串格式的请求参数"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", description="幂等键，网络重试时携带相同的值")
 ) -> CreatePictureResponse:
     """
     图片生图接口
@@ -187,7 +585,7 @@ async def create_picture(
     基于用户上传的原图和选择的参数，生成4张不同场景的图片。
     
     **参数说明：**
-    - `file`: 用户上传的原图文件（multipart/form-data）
+    - `file`: 用户上传的原图文件（multipart/form-data），data 中传 `portraitId` 时可不传
     - `data`: JSON 字符串格式的请求参数，包含：
         - `city`: 城市枚举值（0-19，如0=东京、1=巴黎等）
         - `gender`: 性别（0=男、1=女）
@@ -198,34 +596,91 @@ async def create_picture(
     **返回：**
     - 成功时返回4张生成的图片（Base64编码列表）
     - 失败时返回错误信息
+    
+    响应体边生成边写出，每生成一张图片就写出一个 `images[i]` 元素，
+    最终的 JSON 文档与之前一次性返回的格式完全一致。
+    第一张图片之前的错误按普通错误响应返回；之后的错误会中断连接。
+    
+    携带 `Idempotency-Key` 请求头时，有效期内相同的键和参数只会生成一次：
+    重复提交会接入进行中的生成或直接返回已生成的结果（响应头 `Idempotency-Replayed: true`），
+    相同的键搭配不同的参数返回 409。
     """
+    observe_multipart_read(request)
+    if idempotency_key:
+        picture_request = await DoubaoImages.validate_input_data(file, data, get_client_id(request), get_priority(request))
+        if picture_request.cities and len(picture_request.cities) > 1:
+            raise ParamException(message="多城市生成仅支持流式接口（/createPictureStream、/createPictureStreamBinary、/jobs）")
+        job, replayed = await job_manager.create_idempotent_job(f"/createPicture:{idempotency_key}", picture_request)
+        images = iter_job_images(job.job_id)
+        try:
+            first_image = await anext(images)
+        except StopAsyncIteration:
+            raise CommonException(message="生成的图片列表为空")
+        
+        async def write_idempotent_response():
+            async def remaining_images():
+                yield first_image
+                async for image in images:
+                    yield image
+            try:
+                async for chunk in CreatePictureResponse.iter_json_chunks(remaining_images()):
+                    yield chunk
+            except Exception as e:
+                logger.error(f"图生图接口写出响应时异常，连接将被中断: {e}")
+                record_error(e)
+                raise
+        
+        return StreamingResponse(
+            write_idempotent_response(),
+            media_type="application/json",
+            headers=idempotency_headers(replayed)
+        )
+    
     max_retries = 2
     for attempt in range(max_retries):
+        images = DoubaoImages(LLMConf()).generate_images(file, data, get_client_id(request), get_priority(request, attempt))
         try:
-            # 1. 解析前端传来的 JSON
-            request_model = await DoubaoImages.verify_input_data(file, data)
-            
-            logger.info(f"request_model 类型: {type(request_model)}, 值: {request_model}")
-
-            # 4. 创建 LLM 配置并实例化
-            llm_conf = LLMConf()
-            return await DoubaoImages(llm_conf).create_picture(request_model)
-            
+            # 先等到第一张图片再开始写响应：参数校验、图片校验和上游连接阶段的错误仍按普通 JSON 错误返回
+            first_image = await anext(images)
+        except StopAsyncIteration:
+            raise CommonException(message="生成的图片列表为空")
         except CommonException as e:
             raise e
         except Exception as e:
+            await images.aclose()
             logger.error(f"图生图接口异常, 第 {attempt + 1} 次尝试失败: {e}")
+            note_attempt(attempt + 1, e)
             if attempt == max_retries - 1:
                 # 最后一次也没成功，抛出异常
                 raise CommonException(message="图生图接口异常: " + str(e))
             
             # 等待一秒后重试
             await asyncio.sleep(1)
+            continue
+        
+        async def remaining_images():
+            yield first_image
+            async for image in images:
+                yield image
+        
+        async def write_response():
+            # 响应头已经发出，之后的错误只能中断连接，客户端会收到不完整的 JSON
+            try:
+                async for chunk in CreatePictureResponse.iter_json_chunks(remaining_images()):
+                    yield chunk
+            except Exception as e:
+                logger.error(f"图生图接口写出响应时异常，连接将被中断: {e}")
+                record_error(e)
+                raise
+        
+        return StreamingResponse(write_response(), media_type="application/json")
         
 @app.post("/createPictureStream", tags=["图生图流式接口"])
 async def create_picture_stream(
-    file: UploadFile = File(..., alias="file", description="用户上传的原图文件"),
-    data: str = Form(..., alias="data", description="JSON 字符串格式的请求参数")
+    request: Request,
+    file: Optional[UploadFile] = File(None, alias="file", description="用户上传的原图文件（data 中传 portraitId 时可不传）"),
+    data: str = Form(..., alias="data", description="JSON 字符串格式的请求参数"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", description="幂等键，网络重试时携带相同的值")
 ):
     """
     流式图片生成接口
@@ -234,7 +689,7 @@ async def create_picture_stream(
     使用 Server-Sent Events (SSE) 格式返回。
     
     **入参：**
-    - `file`: 用户上传的原图文件（multipart/form-data）
+    - `file`: 用户上传的原图文件（multipart/form-data），data 中传 `portraitId` 时可不传
     - `data`: JSON 字符串格式的请求参数（同 createPicture 接口）
     
     **返回格式：**
@@ -242,6 +697,8 @@ async def create_picture_stream(
     - 每张图片作为一个 SSE 事件返回
     - 事件格式: 
       ```json
+      // 排队中（并发已满时推送，position 为排队位置，estimatedWait 为预计等待秒数）
+      {"status": "queued", "position": 3, "estimatedWait": 45.0, "message": "排队中，前面还有 2 人"}
       // 生成中
       {"status": "generating", "index": 0, "base64": "data:image/...", "message": "success"}
       // 完成
@@ -249,7 +706,14 @@ async def create_picture_stream(
       // 失败
       {"status": "failed", "message": "错误信息"}
       ```
+    
+    携带 `Idempotency-Key` 请求头时，有效期内相同的键和参数只会生成一次：
+    重复提交会从头回放已产生的事件并继续接收后续事件，相同的键搭配不同的参数返回 409。
     """
+    observe_multipart_read(request)
+    if idempotency_key:
+        return await create_idempotent_picture_stream(request, file, data, idempotency_key)
+    
     async def generateImageStream():
         max_retries = 2
         for attempt in range(max_retries):
@@ -257,15 +721,17 @@ async def create_picture_stream(
                 llm_conf = LLMConf()
                 # service 层已经封装了完整的状态推送（generating/completed/failed）
                 # 包括参数校验、图片验证等所有逻辑
-                async for chunk in DoubaoImages(llm_conf).create_picture_stream(file, data):
+                async for chunk in DoubaoImages(llm_conf).create_picture_stream(file, data, get_client_id(request), get_priority(request, attempt)):
                     yield chunk
                 return
             except Exception as e:
                 logger.error(f"图生图SSE接口异常, 第 {attempt + 1} 次尝试失败: {e}")
+                note_attempt(attempt + 1, e)
                 if attempt == max_retries - 1:
                     # 最后一次失败，发送 failed 状态
+                    record_error(e)
                     error_resp = ImageStreamEvent(
-                        status=StreamStatusEnum.FAILED,
+                        status=StreamStatusEnum.Failed,
                         message=f"接口调用失败: {str(e)}"
                     )
                     yield error_resp.to_event_data()
@@ -283,10 +749,241 @@ async def create_picture_stream(
     )
 
 
+@app.post("/createPictureStreamBinary", tags=["图生图流式接口"])
+async def create_picture_stream_binary(
+    request: Request,
+    file: Optional[UploadFile] = File(None, alias="file", description="用户上传的原图文件（data 中传 portraitId 时可不传）"),
+    data: str = Form(..., alias="data", description="JSON 字符串格式的请求参数")
+):
+    """
+    流式图片生成接口（二进制帧）
+    
+    与 `/createPictureStream` 的事件序列完全相同，但图片以原始字节发送，
+    不经过 Base64 编码和 JSON 转义，适合弱网环境。
+    
+    **入参：**
+    - `file`: 用户上传的原图文件（multipart/form-data），data 中传 `portraitId` 时可不传
+    - `data`: JSON 字符串格式的请求参数（同 createPicture 接口）
+    
+    **返回格式：**
+    - Content-Type: application/octet-stream
+    - 由连续的帧组成，每帧结构（长度均为 4 字节大端无符号整数）：
+      `[元数据长度][元数据 JSON][图片长度][图片原始字节]`
+    - 元数据示例：`{"status": "generating", "index": 0, "message": "success", "contentType": "image/png"}`
+    - completed/failed 事件的图片长度为 0
+    """
+    observe_multipart_read(request)
+    
+    async def generateImageFrames():
+        max_retries = 2
+        for attempt in range(max_retries):
+            try:
+                llm_conf = LLMConf()
+                async for frame in DoubaoImages(llm_conf).create_picture_stream_binary(file, data, get_client_id(request), get_priority(request, attempt)):
+                    yield frame
+                return
+            except Exception as e:
+                logger.error(f"图生图二进制流接口异常, 第 {attempt + 1} 次尝试失败: {e}")
+                note_attempt(attempt + 1, e)
+                if attempt == max_retries - 1:
+                    record_error(e)
+                    error_resp = ImageStreamEvent(
+                        status=StreamStatusEnum.Failed,
+                        message=f"接口调用失败: {str(e)}"
+                    )
+                    yield error_resp.to_binary_frame()
+                else:
+                    await asyncio.sleep(1)
+    
+    return StreamingResponse(
+        generateImageFrames(),
+        media_type="application/octet-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+@app.get("/images/{image_name}", tags=["图片"])
+async def get_saved_image(image_name: str, request: Request):
+    """
+    获取已保存的生成图片（delivery=Url 时返回的图片地址）
+    
+    图片按内容哈希命名、内容永不变化：
+    - 返回强 `ETag` 和 `Cache-Control: immutable`，浏览器和 CDN 可长期缓存
+    - 支持 `If-None-Match`（返回 304）和 HTTP Range 分段下载
+    """
+    try:
+        image_path = get_saved_image_path(image_name)
+    except FileNotFoundError:
+        raise ResourceNotFoundException(message="图片不存在")
+    
+    content_hash, _, ext = image_name.partition(".")
+    etag = f'"{content_hash}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=http_status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    return FileResponse(image_path, media_type=MIME_TYPE_MAPPING[ext], headers=headers)
+
+
+# ==================== 异步任务接口 ====================
+
+@app.post("/jobs", tags=["异步任务接口"], status_code=http_status.HTTP_202_ACCEPTED)
+async def create_job(
+    request: Request,
+    file: Optional[UploadFile] = File(None, alias="file", description="用户上传的原图文件（data 中传 portraitId 时可不传）"),
+    data: str = Form(..., alias="data", description="JSON 字符串格式的请求参数")
+):
+    """
+    创建异步生图任务，立即返回任务ID
+    
+    生成过程与 HTTP 连接解耦：手机休眠、切换网络后可以通过 `GET /jobs/{jobId}/events`
+    重新连接，已生成的图片直接回放，不会重新生成。
+    
+    **入参：** 同 createPictureStream 接口
+    
+    **返回：** `{"jobId": "...", "status": "pending", "eventsUrl": "/jobs/{jobId}/events"}`
+    """
+    observe_multipart_read(request)
+    job = await job_manager.create_job(file, data, get_client_id(request), get_priority(request))
+    result = {
+        "jobId": job.job_id,
+        "status": job.status.value,
+        "eventsUrl": f"/jobs/{job.job_id}/events"
+    }
+    return await process_response(result, status=http_status.HTTP_202_ACCEPTED, message="任务已创建")
+
+
+@app.get("/jobs/{job_id}", tags=["异步任务接口"])
+async def get_job(job_id: str):
+    """
+    查询异步生图任务状态
+    """
+    job = await job_manager.get_job(job_id)
+    return await process_response(job.to_info().model_dump(mode='json'))
+
+
+@app.delete("/jobs/{job_id}", tags=["异步任务接口"])
+async def delete_job(job_id: str):
+    """
+    取消并删除异步生图任务
+    """
+    await job_manager.delete_job(job_id)
+    return await process_response({"jobId": job_id}, message="任务已删除")
+
+
+@app.get("/jobs/{job_id}/events", tags=["异步任务接口"])
+async def get_job_events(
+    job_id: str,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID", description="断线重连时最后收到的事件ID")
+):
+    """
+    订阅异步生图任务的事件流（SSE）
+    
+    - 事件格式同 createPictureStream 接口，每个事件额外带有 `id: <事件ID>` 行
+    - 重连时携带 `Last-Event-ID` 请求头（浏览器 EventSource 会自动携带），
+      只推送该事件之后的事件，已生成的图片直接从缓存回放
+    - 等待新事件期间定时发送 `: keep-alive` 注释行作为心跳
+    - 任务结束（completed/failed）后连接关闭
+    """
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            raise ParamException(message=f"Last-Event-ID 格式不正确: {last_event_id}")
+    
+    # 先校验任务存在，不存在时直接返回 404 而不是空的事件流
+    await job_manager.get_job(job_id)
+    
+    async def generateJobEvents():
+        async for event_id, event in job_manager.follow_events(job_id, last_event_id):
+            if event is None:
+                yield b": keep-alive\n\n"
+                continue
+            for chunk in iter_timed_event_chunks(event, event_id=event_id):
+                yield chunk
+    
+    return StreamingResponse(
+        generateJobEvents(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+# ==================== 批量任务接口 ====================
+
+@app.post("/batches", tags=["批量任务接口"], status_code=http_status.HTTP_202_ACCEPTED)
+async def create_batch(
+    file: UploadFile = File(..., alias="file", description="zip 压缩包：人像图片 + manifest.json"),
+    data: Optional[str] = Form(None, alias="data", description="可选，JSON 字符串格式的公共参数，作为每一行的默认值")
+):
+    """
+    创建批量生图任务（整个部门的海报），立即返回任务ID
+    
+    **入参：**
+    - `file`: zip 压缩包，包含人像图片和 `manifest.json`，清单为数组，每行一张人像：
+      `[{"file": "alice.jpg", "name": "alice", "city": "Paris", "gender": "Female", "mode": "Master", "master_mode_tags": {...}}]`
+      除 `file`、`name` 外的字段同 createPicture 接口的 data 参数
+    - `data`: 可选，每行的默认参数（行内字段优先）
+    
+    **返回：** `{"batchId": "...", "total": 120, "statusUrl": "...", "resultUrl": "..."}`
+    """
+    batch = await batch_manager.create_batch(file, data)
+    result = {
+        "batchId": batch.batch_id,
+        "total": len(batch.rows),
+        "statusUrl": f"/batches/{batch.batch_id}",
+        "resultUrl": f"/batches/{batch.batch_id}/result.zip"
+    }
+    return await process_response(result, status=http_status.HTTP_202_ACCEPTED, message="批量任务已创建")
+
+
+@app.get("/batches/{batch_id}", tags=["批量任务接口"])
+async def get_batch(batch_id: str):
+    """
+    查询批量生图任务进度
+    """
+    batch = batch_manager.get_batch(batch_id)
+    return await process_response(batch.to_info().model_dump(mode='json'))
+
+
+@app.get("/batches/{batch_id}/result.zip", tags=["批量任务接口"])
+async def get_batch_result(batch_id: str):
+    """
+    下载批量生图结果（zip），边打包边下载，不在内存中保留全部图片
+    
+    - 目录结构：`<行号_名称>/<城市>_<序号>.png`
+    - `results.csv`：每行的状态（completed/failed/pending）、图片数和失败原因
+    - 任务未结束时下载到的是已完成的部分
+    """
+    batch = batch_manager.get_batch(batch_id)
+    return StreamingResponse(
+        batch_manager.iter_result_zip(batch_id),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="batch_{batch.batch_id}.zip"'}
+    )
+
+
 # ==================== 主程序入口 ====================
 
+# 导入耗时（不含 Python 解释器启动），预热完成时与预热耗时一起记录
+lifecycle.import_seconds = time.perf_counter() - _IMPORT_STARTED_AT
+
 if __name__ == "__main__":
-    
+    import uvicorn
+
     uvicorn.run(
         "journey_poster:app",
         host="localhost",
@@ -0,0 +1,50 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+from enum import Enum
+
+
+class BatchStatusEnum(str, Enum):
+    """批量生图任务状态枚举"""
+    Running = "running"      # 处理中（服务重启后会从断点继续）
+    Completed = "completed"  # 全部行处理结束（可能有部分行失败）
+
+
+class BatchInfo(BaseModel):
+    """
+    批量生图任务信息【GET /batches/{batchId}】
+    """
+
+    batchId: str = Field(
+        ...,
+        description="批量任务ID"
+    )
+
+    status: BatchStatusEnum = Field(
+        ...,
+        description="任务状态：running/completed"
+    )
+
+    total: int = Field(
+        ...,
+        description="总行数（人像数）"
+    )
+
+    completed: int = Field(
+        0,
+        description="已成功的行数"
+    )
+
+    failed: int = Field(
+        0,
+        description="已失败的行数"
+    )
+
+    message: Optional[str] = Field(
+        None,
+        description="最近一条失败信息"
+    )
+
+    createdAt: str = Field(
+        ...,
+        description="创建时间（格式：YYYY-MM-DD HH:MM:SS）"
+    )
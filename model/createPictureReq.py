@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field, field_validator, model_validator
-from typing import Optional, Union, List
+from pydantic import BaseModel, Field, PrivateAttr, field_validator, model_validator
+from typing import Any, Optional, Union, List
 from core.enum import (
     GenderEnum,
     CityEnum,
@@ -8,7 +8,9 @@ from core.enum import (
     MaterialEnum,
     ColorEnum,
     TypeEnum,
-    ClothesCategory
+    ClothesCategory,
+    DeliveryEnum,
+    PriorityEnum
 )
 
 
@@ -91,6 +93,10 @@ class MasterModeTags(BaseModel):
     type: Optional[TypeEnum] = Field(None, description="类型：Set-套装、Dress-连衣裙、Coat-外套、Local-当地特色服饰、AIRandom-AI随机匹配")
 
 
+# 多城市生成单次请求最多的城市数
+MAX_FANOUT_CITIES = 5
+
+
 class CreatePictureRequest(BaseModel):
     """
     图片生图前端传的模式标签入参
@@ -102,12 +108,21 @@ class CreatePictureRequest(BaseModel):
         description="后端内部使用：从上传文件转换来的Base64，前端无需传递"
     )
     
+    # 后端内部使用：该请求占用的内存预算额度（service.memory_budget.MemoryLease）
+    _memory_lease: Optional[Any] = PrivateAttr(None)
+    
     city: CityEnum = Field(
         ..., 
         description="城市名称",
         examples=["巴黎", "东京", "纽约"]
     )
     
+    cities: Optional[List[CityEnum]] = Field(
+        None,
+        max_length=MAX_FANOUT_CITIES,
+        description=f"多城市生成（仅流式接口）：一次请求生成多个城市，人像只上传、校验一次，各城市并发生成并合并到同一个流；不传 city 时取第一个城市，最多 {MAX_FANOUT_CITIES} 个"
+    )
+    
     gender: GenderEnum = Field(
         ..., 
         description="性别：0-男、1-女"
@@ -128,6 +143,52 @@ class CreatePictureRequest(BaseModel):
         description="大师模式标签配置（大师模式下可选，轻松模式下忽略）"
     )
     
+    portraitId: Optional[str] = Field(
+        None,
+        description="人像ID（POST /portraits 返回），传入时不需要再上传文件，直接使用已标准化、已校验的人像"
+    )
+    
+    preview: bool = Field(
+        False,
+        description="是否先推送缩略图预览（仅流式接口有效），关闭时保持原有推送行为"
+    )
+    
+    delivery: DeliveryEnum = Field(
+        DeliveryEnum.Base64,
+        description="生成图片返回方式：Base64-直接返回图片数据（默认）、Url-保存到服务端后返回图片地址"
+    )
+    
+    # 后端内部使用：排队轮转的客户端标识和优先级通道由服务端决定（客户端IP、VIP_TOKEN、接口重试），
+    # 前端 / 批量清单中传入的值会被忽略，避免伪造贵宾通道或轮换标识绕过公平调度
+    clientId: Optional[str] = Field(
+        None,
+        description="后端内部使用：排队时按此轮转保证公平，前端传入的值会被忽略"
+    )
+    
+    priority: PriorityEnum = Field(
+        PriorityEnum.Normal,
+        description="后端内部使用：排队优先级（VIP-贵宾通道、Retry-失败后重试、Normal-普通），前端传入的值会被忽略"
+    )
+    
+    @model_validator(mode='before')
+    @classmethod
+    def drop_server_controlled_fields(cls, data):
+        """clientId / priority 只能由服务端在解析之后设置，忽略入参中的值"""
+        if isinstance(data, dict) and ('clientId' in data or 'priority' in data):
+            data = {key: value for key, value in data.items() if key not in ('clientId', 'priority')}
+        return data
+    
+    @model_validator(mode='before')
+    @classmethod
+    def fill_city_from_cities(cls, data):
+        """多城市生成时 city 可以不传，取 cities 的第一个；cities 去重并保持顺序"""
+        if isinstance(data, dict) and data.get('cities'):
+            cities = list(dict.fromkeys(data['cities']))
+            data = {**data, 'cities': cities}
+            if data.get('city') is None:
+                data['city'] = cities[0]
+        return data
+    
     @field_validator('clothes')
     def validate_clothes_for_easy_mode(cls, v, info):
         """验证轻松模式下必须提供服装配置"""
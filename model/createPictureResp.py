@@ -1,6 +1,31 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import AsyncIterator, Iterator, List, Optional, Union
 from enum import Enum
+import base64
+import json
+import struct
+from core.enum import CityEnum
+
+
+# SSE / JSON 分片写出时单个分片的大小
+EVENT_CHUNK_SIZE = 64 * 1024
+
+
+def is_json_safe_payload(payload: Optional[str]) -> bool:
+    """
+    判断图片数据能否不经转义直接写入 JSON 字符串
+    Base64/data URL 只包含可打印 ASCII 字符，且不含引号和反斜杠
+    """
+    return bool(payload) and payload.isascii() and payload.isprintable() and '"' not in payload and '\\' not in payload
+
+
+def iter_payload_chunks(payload: str, chunk_size: int = EVENT_CHUNK_SIZE) -> Iterator[memoryview]:
+    """
+    将图片数据编码一次，按 chunk_size 输出同一块内存的 memoryview 切片
+    """
+    body = memoryview(payload.encode('ascii'))
+    for offset in range(0, len(body), chunk_size):
+        yield body[offset:offset + chunk_size]
 
 
 class ImageItem(BaseModel):
@@ -11,10 +36,28 @@ class ImageItem(BaseModel):
         description="图片索引ID（0-3）"
     )
     
-    base64: str = Field(
-        ..., 
-        description="图片Base64编码（格式：data:image/jpeg;base64,...）"
+    base64: Optional[str] = Field(
+        None, 
+        description="图片Base64编码（格式：data:image/jpeg;base64,...），delivery=Url 时为空"
     )
+    
+    url: Optional[str] = Field(
+        None,
+        description="图片访问地址，仅 delivery=Url 时返回"
+    )
+
+    def iter_json_chunks(self, chunk_size: int = EVENT_CHUNK_SIZE) -> Iterator[Union[bytes, memoryview]]:
+        """
+        以字节分片输出紧凑 JSON（与 FastAPI 默认序列化格式一致：无空格、不转义中文）
+        空字段不输出，Base64 模式下与原有的 {"id":..,"base64":".."} 格式一致
+        """
+        if self.url is not None or not is_json_safe_payload(self.base64):
+            yield json.dumps(self.model_dump(mode='json', exclude_none=True), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            return
+
+        yield f'{{"id":{json.dumps(self.id)},"base64":"'.encode('utf-8')
+        yield from iter_payload_chunks(self.base64, chunk_size)
+        yield b'"}'
 
 
 class CreatePictureResponse(BaseModel):
@@ -29,6 +72,23 @@ class CreatePictureResponse(BaseModel):
         max_length=4,
         description="生成的4张图片列表，每张图片包含索引ID和Base64编码"
     )
+
+    @staticmethod
+    async def iter_json_chunks(images: AsyncIterator[ImageItem]) -> AsyncIterator[Union[bytes, memoryview]]:
+        """
+        边生成边写出响应 JSON：每收到一张图片就写出对应的 images[i] 元素
+        最终文档与 CreatePictureResponse(images=...) 的 JSON 序列化结果逐字节一致，
+        图片写出后即可释放，不需要在内存中同时持有 4 张图片
+        """
+        yield b'{"images":['
+        is_first = True
+        async for image in images:
+            if not is_first:
+                yield b','
+            is_first = False
+            for chunk in image.iter_json_chunks():
+                yield chunk
+        yield b']}'
     
     class Config:
         json_schema_extra = {
@@ -61,6 +121,8 @@ class CreatePictureResponse(BaseModel):
 
 class StreamStatusEnum(str, Enum):
     """流式推送状态枚举"""
+    Queued = "queued"          # 排队中（携带排队位置和预计等待时间）
+    Preview = "preview"        # 预览缩略图（先于原图推送，仅在请求开启 preview 时出现）
     Generating = "generating"  # 正在生成中（携带图片数据）
     Completed = "completed"    # 全部完成
     Failed = "failed"          # 发生错误
@@ -71,17 +133,37 @@ class ImageStreamEvent(BaseModel):
     
     status: StreamStatusEnum = Field(
         ..., 
-        description="当前推送状态：generating/completed/failed"
+        description="当前推送状态：queued/preview/generating/completed/failed"
+    )
+    
+    city: Optional[CityEnum] = Field(
+        None,
+        description="城市，仅多城市生成（请求传 cities）时出现，index 为该城市内的图片序号"
+    )
+    
+    position: Optional[int] = Field(
+        None,
+        description="排队位置（从 1 开始），仅 queued 状态有效"
+    )
+    
+    estimatedWait: Optional[float] = Field(
+        None,
+        description="预计等待时间（秒），根据近期实际生成耗时估算，仅 queued 状态有效"
     )
     
     index: Optional[int] = Field(
         None, 
-        description="图片索引(0-3)，仅 generating 状态有效"
+        description="图片索引(0-3)，仅 preview/generating 状态有效"
     )
     
     base64: Optional[str] = Field(
         None, 
-        description="图片Base64数据，仅 generating 状态有效"
+        description="图片Base64数据，preview 状态为缩略图，generating 状态为原图（delivery=Url 时为空）"
+    )
+    
+    url: Optional[str] = Field(
+        None,
+        description="图片访问地址，仅 delivery=Url 时的 generating 状态有效"
     )
     
     message: Optional[str] = Field(
@@ -89,18 +171,103 @@ class ImageStreamEvent(BaseModel):
         description="提示信息或错误信息"
     )
     
-    def to_event_data(self) -> str:
+    retryAfter: Optional[int] = Field(
+        None,
+        description="建议多少秒后重试，仅服务繁忙被拒绝时的 failed 状态有效"
+    )
+    
+    def to_event_data(self, event_id: Optional[int] = None) -> str:
         """
         转换为 SSE 事件数据格式
         exclude_none=True 去掉 null 字段，减少网络传输量
+        event_id 不为空时输出 SSE 的 id 行，客户端断线重连时通过 Last-Event-ID 续传
+        """
+        id_line = f"id: {event_id}\n" if event_id is not None else ""
+        return f"{id_line}data: {json.dumps(self.model_dump(mode='json', exclude_none=True))}\n\n"
+
+    def iter_event_chunks(self, chunk_size: int = EVENT_CHUNK_SIZE, event_id: Optional[int] = None) -> Iterator[Union[bytes, memoryview]]:
+        """
+        以字节分片的形式输出 SSE 事件，输出内容与 to_event_data() 逐字节一致
+
+        大图事件不再经过 model_dump -> json.dumps -> f-string 的多次整体拷贝，
+        而是拆成 [前缀][图片数据分片...][后缀]，图片数据只编码一次，
+        分片是同一块内存的 memoryview 切片，可直接交给 StreamingResponse 发送。
+        单个事件的峰值内存约为 1 倍图片大小。
+        """
+        # Base64/data URL 只包含无需 JSON 转义的 ASCII 字符；不满足时回退到普通序列化
+        if not is_json_safe_payload(self.base64):
+            yield self.to_event_data(event_id).encode('utf-8')
+            return
+
+        # 其余字段很小，按模型字段顺序序列化，保证与 to_event_data 的 key 顺序一致
+        fields = self.model_dump(mode='json', exclude_none=True, exclude={'base64'})
+        head_parts, tail_parts = [], []
+        parts = head_parts
+        for name in type(self).model_fields:
+            if name == 'base64':
+                parts = tail_parts
+            elif name in fields:
+                parts.append(f"{json.dumps(name)}: {json.dumps(fields[name])}")
+
+        id_line = f"id: {event_id}\n" if event_id is not None else ""
+        prefix = id_line + "data: {" + "".join(f"{part}, " for part in head_parts) + '"base64": "'
+        suffix = '"' + "".join(f", {part}" for part in tail_parts) + "}\n\n"
+
+        yield prefix.encode('utf-8')
+        yield from iter_payload_chunks(self.base64, chunk_size)
+        yield suffix.encode('utf-8')
+
+    def to_binary_frame(self) -> bytes:
+        """
+        转换为二进制帧格式（/createPictureStreamBinary 接口使用）
+
+        帧结构（长度均为 4 字节大端无符号整数）：
+            [元数据长度][元数据 JSON (UTF-8)][图片长度][图片原始字节]
+        - 元数据为去掉 base64 字段后的事件 JSON，带图片时额外包含 contentType（如 image/png）
+        - 无图片的事件（completed/failed）图片长度为 0
+        图片直接以原始字节发送，比 Base64-in-JSON 少约 33% 传输量
         """
-        import json
-        return f"data: {json.dumps(self.model_dump(mode='json', exclude_none=True))}\n\n"
+        meta = self.model_dump(mode='json', exclude_none=True, exclude={'base64'})
+        payload = b''
+        if self.base64:
+            header, _, base64_data = self.base64.partition(',')
+            if header.startswith('data:'):
+                meta['contentType'] = header[len('data:'):].split(';')[0]
+            else:
+                # 没有 data URL 前缀时整个字符串就是 Base64 数据
+                base64_data = self.base64
+            payload = base64.b64decode(base64_data)
+
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        return b''.join((
+            struct.pack('>I', len(meta_bytes)),
+            meta_bytes,
+            struct.pack('>I', len(payload)),
+            payload
+        ))
     
     class Config:
         json_schema_extra = {
             "description": "流式推送的单个事件数据，通过 SSE 格式返回",
             "examples": [
+                {
+                    "description": "排队中",
+                    "value": {
+                        "status": "queued",
+                        "position": 3,
+                        "estimatedWait": 45.0,
+                        "message": "排队中，前面还有 2 人"
+                    }
+                },
+                {
+                    "description": "预览 - 第1张图片缩略图",
+                    "value": {
+                        "status": "preview",
+                        "index": 0,
+                        "base64": "data:image/jpeg;base64,/9j/4AAQSkZJRgABAQAA...",
+                        "message": "preview"
+                    }
+                },
                 {
                     "description": "生成中 - 第1张图片",
                     "value": {
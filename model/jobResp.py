@@ -0,0 +1,53 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+from enum import Enum
+
+
+class JobStatusEnum(str, Enum):
+    """异步生图任务状态枚举"""
+    Pending = "pending"      # 已创建，等待执行
+    Running = "running"      # 生成中
+    Completed = "completed"  # 全部完成
+    Failed = "failed"        # 生成失败
+    Cancelled = "cancelled"  # 已取消
+
+
+class JobInfo(BaseModel):
+    """
+    异步生图任务信息【GET /jobs/{jobId}】
+    """
+    
+    jobId: str = Field(
+        ...,
+        description="任务ID"
+    )
+    
+    status: JobStatusEnum = Field(
+        ...,
+        description="任务状态：pending/running/completed/failed/cancelled"
+    )
+    
+    imageCount: int = Field(
+        0,
+        description="已生成的图片数量"
+    )
+    
+    eventCount: int = Field(
+        0,
+        description="已产生的事件数量，事件ID从 0 开始递增"
+    )
+    
+    message: Optional[str] = Field(
+        None,
+        description="最近一条提示信息或错误信息"
+    )
+    
+    createdAt: str = Field(
+        ...,
+        description="创建时间（格式：YYYY-MM-DD HH:MM:SS）"
+    )
+    
+    updatedAt: str = Field(
+        ...,
+        description="最近更新时间（格式：YYYY-MM-DD HH:MM:SS）"
+    )
@@ -0,0 +1,17 @@
+from pydantic import BaseModel, Field
+
+
+class PortraitInfo(BaseModel):
+    """
+    人像上传结果【POST /portraits】
+    """
+
+    portraitId: str = Field(
+        ...,
+        description="人像ID，生成接口的 data 中传入 portraitId 即可代替上传文件"
+    )
+
+    expiresIn: int = Field(
+        ...,
+        description="有效期（秒），过期后需要重新上传"
+    )
@@ -0,0 +1,374 @@
+# 生产环境多 worker 启动入口：python server.py
+# 开发调试仍然使用 python journey_poster.py（单 worker，监听 localhost:8123）
+import asyncio
+import gc
+import importlib.util
+import logging
+import os
+import random
+import signal
+import sys
+import time
+import traceback
+from typing import Dict, Optional
+
+import uvicorn
+
+from journey_poster import app
+from core.image_utils import preload_clothes_images
+from core.prompt_strategy import preload_prompt_tables
+from service.lifecycle import lifecycle, preload_modules
+from setting import settings, init_runtime
+from utils.logger import shutdown_logging
+from utils.memory_tracker import MB, get_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+# worker 启动失败（如 lifespan 报错）时 uvicorn 的退出码，主进程不再重新拉起
+STARTUP_FAILURE = 3
+
+# worker 等待进行中的连接（包括 SSE 流）结束的时间比排空时间多出的秒数：
+# 连接排空超时后 lifespan 停机还要取消剩余任务、关闭连接池和线程池
+GRACEFUL_SHUTDOWN_EXTRA_SECONDS = 5
+
+
+def graceful_shutdown_seconds() -> float:
+    """
+    worker 等待进行中的连接结束的上限（uvicorn 的 timeout_graceful_shutdown / hypercorn 的 graceful_timeout）
+    lifespan 停机的排空截止时间从收到 SIGTERM 算起，不超过这个上限
+    """
+    return settings.SHUTDOWN_DRAIN_SECONDS + GRACEFUL_SHUTDOWN_EXTRA_SECONDS
+
+
+def worker_log_file(index: int) -> str:
+    """
+    worker 的日志文件名：每个 worker 写自己的文件，多个进程不会同时轮转同一个文件
+    """
+    return f"app.worker-{index}.log"
+
+
+def pick_implementation(preferred: str, fallback: str) -> str:
+    """
+    已安装 uvloop / httptools 时使用，否则退回 asyncio / h11
+    """
+    return preferred if importlib.util.find_spec(preferred) is not None else fallback
+
+
+class WorkerServer(uvicorn.Server):
+    """
+    单个 worker：处理的请求数达到上限或常驻内存超过阈值时优雅退出（停止接收新连接、排空进行中的生成），
+    由主进程重新拉起
+    """
+
+    def __init__(self, config: uvicorn.Config, max_rss_bytes: int = 0, rss_check_seconds: float = 5.0):
+        super().__init__(config)
+        self.max_rss_bytes = max_rss_bytes
+        # main_loop 每 0.1s 调用一次 on_tick
+        self.rss_check_ticks = max(int(rss_check_seconds * 10), 1)
+
+    def handle_exit(self, sig, frame):
+        # 在 uvicorn 停止接收连接、等待进行中的请求之前：/ready 返回 503，新的生图请求返回 503，批量任务不再开始新的行
+        lifecycle.begin_shutdown()
+        super().handle_exit(sig, frame)
+
+    async def on_tick(self, counter: int) -> bool:
+        if await super().on_tick(counter):
+            return True
+        if self.max_rss_bytes > 0 and counter % self.rss_check_ticks == 0:
+            rss = get_rss_bytes()
+            if rss > self.max_rss_bytes:
+                logger.warning(f"worker 常驻内存 {rss / MB:.0f}MB 超过上限 {self.max_rss_bytes / MB:.0f}MB，优雅退出后重新拉起")
+                return True
+        return False
+
+
+def build_http2_config(bind: str):
+    """
+    hypercorn 配置：明文连接支持 h2c（prior knowledge 和 Upgrade），配置证书时通过 ALPN 协商 h2，同时兼容 HTTP/1.1
+    """
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [bind]
+    config.h2_max_concurrent_streams = settings.HTTP2_MAX_CONCURRENT_STREAMS
+    config.graceful_timeout = graceful_shutdown_seconds()
+    # 使用项目自己的日志配置（hypercorn 日志也进入队列 handler）
+    config.accesslog = logging.getLogger("hypercorn.access")
+    config.errorlog = logging.getLogger("hypercorn.error")
+    if settings.SERVER_CERTFILE and settings.SERVER_KEYFILE:
+        config.certfile = settings.SERVER_CERTFILE
+        config.keyfile = settings.SERVER_KEYFILE
+    return config
+
+
+class Http2WorkerServer:
+    """
+    HTTP/2 worker（SERVER_HTTP2=true，使用 hypercorn）：与 WorkerServer 一致，
+    处理的请求数达到上限或常驻内存超过阈值时优雅退出，由主进程重新拉起
+    """
+
+    # 检查退出条件的间隔（秒）
+    CHECK_INTERVAL = 0.1
+
+    def __init__(self, app, max_requests: Optional[int] = None, max_rss_bytes: int = 0, rss_check_seconds: float = 5.0):
+        self.app = app
+        self.max_requests = max_requests
+        self.max_rss_bytes = max_rss_bytes
+        self.rss_check_seconds = rss_check_seconds
+        self.total_requests = 0
+        self.should_exit = False
+
+    async def counted_app(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.total_requests += 1
+        await self.app(scope, receive, send)
+
+    def handle_exit(self):
+        lifecycle.begin_shutdown()
+        self.should_exit = True
+
+    async def wait_for_exit(self):
+        """
+        hypercorn 的 shutdown_trigger：返回后停止接收新连接，等待进行中的请求结束
+        """
+        last_rss_check = time.monotonic()
+        while not self.should_exit:
+            if self.max_requests is not None and self.total_requests >= self.max_requests:
+                logger.info(f"worker 请求数达到上限 {self.max_requests}，优雅退出后重新拉起")
+                return
+            if self.max_rss_bytes > 0 and time.monotonic() - last_rss_check >= self.rss_check_seconds:
+                last_rss_check = time.monotonic()
+                rss = get_rss_bytes()
+                if rss > self.max_rss_bytes:
+                    logger.warning(f"worker 常驻内存 {rss / MB:.0f}MB 超过上限 {self.max_rss_bytes / MB:.0f}MB，优雅退出后重新拉起")
+                    return
+            await asyncio.sleep(self.CHECK_INTERVAL)
+
+    async def serve(self, config):
+        from hypercorn.asyncio import serve
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.handle_exit)
+        await serve(self.counted_app, config, shutdown_trigger=self.wait_for_exit)
+
+    def run(self, config, loop_factory=None) -> int:
+        from hypercorn.utils import LifespanFailureError
+
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            try:
+                runner.run(self.serve(config))
+            except LifespanFailureError:
+                logger.exception("worker 启动失败")
+                return STARTUP_FAILURE
+        return 0
+
+
+class PreforkServer:
+    """
+    多 worker 启动：主进程导入应用并预加载提示词表、服装素材、openai / PIL 等依赖，
+    调用 gc.freeze() 后 fork 出 worker，预加载的对象以写时复制的方式在 worker 间共享
+
+    - 主进程绑定监听端口，worker 继承同一个 socket，由内核分配连接
+    - 默认由 uvicorn 提供 HTTP/1.1；SERVER_HTTP2=true 时由 hypercorn 提供 HTTP/2（h2c / h2）
+    - worker 退出（请求数 / 内存达到上限、异常退出）后自动重新拉起；启动失败时停止全部 worker
+    - 主进程收到 SIGTERM / SIGINT 时转发给 worker，等待其排空（最长 SHUTDOWN_DRAIN_SECONDS + 15 秒）后退出
+    - 主进程日志写 logs/app.log，每个 worker 写自己的 logs/app.worker-<序号>.log
+    - fork 时主进程没有其他线程：日志后台线程在 fork 前停止、之后在主进程和 worker 中各自重新启动；
+      线程池、上游连接池、事件循环监控都在 worker 启动（lifespan）时才创建
+    """
+
+    # 主进程检查 worker 状态的间隔（秒）
+    POLL_INTERVAL = 0.5
+    # 停机时等待 worker 排空（graceful_shutdown_seconds()）之外额外等待的时间（秒），超时后强制结束
+    SHUTDOWN_GRACE_SECONDS = 10.0
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        workers: Optional[int] = None,
+        max_requests: Optional[int] = None,
+        max_requests_jitter: Optional[int] = None,
+        max_rss_mb: Optional[int] = None,
+        http2: Optional[bool] = None
+    ):
+        self.host = host or settings.SERVER_HOST
+        self.port = settings.SERVER_PORT if port is None else port
+        self.workers = max(workers or settings.SERVER_WORKERS, 1)
+        self.max_requests = settings.WORKER_MAX_REQUESTS if max_requests is None else max_requests
+        self.max_requests_jitter = settings.WORKER_MAX_REQUESTS_JITTER if max_requests_jitter is None else max_requests_jitter
+        self.max_rss_mb = settings.WORKER_MAX_RSS_MB if max_rss_mb is None else max_rss_mb
+        self.loop = pick_implementation("uvloop", "asyncio")
+        self.http2 = settings.SERVER_HTTP2 if http2 is None else http2
+        self.http = "hypercorn" if self.http2 else pick_implementation("httptools", "h11")
+        self.children: Dict[int, int] = {}  # pid -> worker 序号
+        self.should_exit = False
+        self.exit_code = 0
+        self.socket = None
+
+    def preload(self):
+        """
+        在主进程中预加载（fork 前完成，worker 的启动预热直接命中缓存）
+        """
+        start_time = time.perf_counter()
+        preload_modules()
+        clothes_count = preload_clothes_images()
+        city_count = preload_prompt_tables()
+        # 预加载产生的对象移入永久代：worker 中的垃圾回收不再扫描（写入）它们，内存页保持共享
+        gc.collect()
+        gc.freeze()
+        logger.info(
+            f"主进程预加载完成: 服装素材 {clothes_count} 个, 城市场景 {city_count} 个, "
+            f"冻结对象 {gc.get_freeze_count()} 个, 耗时 {time.perf_counter() - start_time:.2f}s"
+        )
+
+    def build_config(self) -> uvicorn.Config:
+        return uvicorn.Config(
+            app,
+            loop=self.loop,
+            http=self.http,
+            lifespan="on",
+            log_config=None,  # 使用项目自己的日志配置（uvicorn 日志也进入队列 handler）
+            limit_max_requests=self.max_requests if self.max_requests > 0 else None,
+            limit_max_requests_jitter=max(self.max_requests_jitter, 0),
+            backlog=settings.SERVER_BACKLOG,
+            timeout_graceful_shutdown=graceful_shutdown_seconds(),
+        )
+
+    def run_worker(self, index: int) -> int:
+        """
+        worker 进程入口（fork 之后执行），返回退出码
+        """
+        # 信号处理由 uvicorn / hypercorn 接管（uvicorn 退出后会重新触发收到的信号，继承自主进程的处理函数只设置标志位，不影响退出码）
+        init_runtime(force=True, log_file=worker_log_file(index))
+        if self.http2:
+            return self.run_http2_worker(index)
+        config = self.build_config()
+        server = WorkerServer(config, max_rss_bytes=self.max_rss_mb * MB, rss_check_seconds=settings.WORKER_RSS_CHECK_SECONDS)
+        logger.info(f"worker {index} 启动: pid={os.getpid()}, 请求数上限={server.limit_max_requests}")
+        try:
+            server.run(sockets=[self.socket])
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        return 0
+
+    def run_http2_worker(self, index: int) -> int:
+        max_requests = None
+        if self.max_requests > 0:
+            max_requests = self.max_requests + random.randint(0, max(self.max_requests_jitter, 0))
+        server = Http2WorkerServer(
+            app,
+            max_requests=max_requests,
+            max_rss_bytes=self.max_rss_mb * MB,
+            rss_check_seconds=settings.WORKER_RSS_CHECK_SECONDS
+        )
+        loop_factory = None
+        if self.loop == "uvloop":
+            import uvloop
+            loop_factory = uvloop.new_event_loop
+        logger.info(f"worker {index} 启动（HTTP/2）: pid={os.getpid()}, 请求数上限={max_requests}")
+        return server.run(build_http2_config(f"fd://{self.socket.fileno()}"), loop_factory=loop_factory)
+
+    def spawn(self, index: int):
+        # fork 时不能有其他线程持有锁：先停止日志后台线程（输出剩余日志），fork 后各自重新启动
+        shutdown_logging()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = self.run_worker(index)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                shutdown_logging()
+                os._exit(code)
+        init_runtime(force=True)
+        self.children[pid] = index
+        logger.info(f"已启动 worker {index}: pid={pid}")
+
+    def handle_exit(self, signum, frame):
+        self.should_exit = True
+
+    def reap(self):
+        """
+        回收已退出的 worker 并重新拉起；worker 启动失败时停止全部 worker
+        """
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            index = self.children.pop(pid, None)
+            if index is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if self.should_exit:
+                logger.info(f"worker {index} 已退出: pid={pid}, 退出码={code}")
+                continue
+            if code == STARTUP_FAILURE:
+                logger.error(f"worker {index} 启动失败: pid={pid}，停止全部 worker")
+                self.exit_code = STARTUP_FAILURE
+                self.should_exit = True
+                continue
+            logger.info(f"worker {index} 已退出: pid={pid}, 退出码={code}，重新拉起")
+            self.spawn(index)
+
+    def stop_workers(self):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        # worker 先等待连接排空（最长 graceful_shutdown_seconds()），lifespan 排空的截止时间从收到 SIGTERM 算起、
+        # 不会再往后延；额外的 SHUTDOWN_GRACE_SECONDS 留给取消剩余任务和关闭连接池、线程池
+        deadline = time.monotonic() + graceful_shutdown_seconds() + self.SHUTDOWN_GRACE_SECONDS
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid, index in list(self.children.items()):
+            logger.warning(f"worker {index} 停机超时，强制结束: pid={pid}")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self.children.pop(pid, None)
+
+    def run(self) -> int:
+        init_runtime()
+        if self.http2 and importlib.util.find_spec("hypercorn") is None:
+            logger.error("SERVER_HTTP2=true 需要安装可选依赖 http2：uv sync --extra http2 或 pip install \"hypercorn[h2]\"")
+            return 1
+        if settings.JOB_STORE.lower() == "memory" and self.workers > 1:
+            logger.warning("JOB_STORE=memory 时异步任务只在创建它的 worker 中可见，多 worker 部署请配置 JOB_STORE=sqlite")
+        self.preload()
+        self.socket = uvicorn.Config(app, host=self.host, port=self.port, backlog=settings.SERVER_BACKLOG, log_config=None).bind_socket()
+        scheme = "https" if self.http2 and settings.SERVER_CERTFILE else "http"
+        logger.info(f"主进程 pid={os.getpid()} 监听 {scheme}://{self.host}:{self.port}, worker {self.workers} 个, loop={self.loop}, http={self.http}")
+
+        signal.signal(signal.SIGTERM, self.handle_exit)
+        signal.signal(signal.SIGINT, self.handle_exit)
+        for index in range(self.workers):
+            self.spawn(index)
+        try:
+            while not self.should_exit:
+                self.reap()
+                time.sleep(self.POLL_INTERVAL)
+        finally:
+            logger.info("主进程停机，等待 worker 排空")
+            self.stop_workers()
+            self.socket.close()
+        logger.info("全部 worker 已退出")
+        return self.exit_code
+
+
+def main() -> int:
+    return PreforkServer().run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
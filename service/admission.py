@@ -0,0 +1,71 @@
+import logging
+import math
+from typing import Optional
+from service.scheduler import GenerationScheduler, scheduler
+from setting import settings
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+admitted_counter = metrics.counter("journey_admission_admitted_total", "入口准入的生图请求数")
+shed_counter = metrics.counter("journey_admission_shed_total", "预计排队时间超限被拒绝的生图请求数")
+
+
+class AdmissionController:
+    """
+    生图入口准入控制
+
+    在读取上传内容之前，根据调度器的排队长度和近期平均生图耗时估算新请求的排队时间，
+    超过 ADMISSION_MAX_WAIT_SECONDS 时直接拒绝，避免白白接收上传、占用内存和上游配额
+    """
+
+    def __init__(self, generation_scheduler: Optional[GenerationScheduler] = None):
+        self.scheduler = generation_scheduler or scheduler
+        # 停机排空期间为 False：拒绝所有新的生图请求
+        self.accepting = True
+
+    def start_admitting(self):
+        self.accepting = True
+
+    def stop_admitting(self):
+        self.accepting = False
+
+    def estimate_wait(self) -> float:
+        """
+        新请求的预计排队时间（秒），有空闲名额时为 0
+        """
+        if self.scheduler.running < self.scheduler.max_workers and self.scheduler.queue_length == 0:
+            return 0.0
+        return self.scheduler.estimate_wait_for_position(self.scheduler.queue_length + 1)
+
+    def check(self, endpoint: str) -> Optional[int]:
+        """
+        准入检查并计数
+
+        Returns:
+            Optional[int]: 准入返回 None；拒绝时返回建议的重试等待秒数
+        """
+        if not self.accepting:
+            shed_counter.inc(endpoint=endpoint)
+            logger.warning(f"服务停机排空中，拒绝生图请求: endpoint={endpoint}")
+            return settings.SHUTDOWN_RETRY_AFTER_SECONDS
+
+        max_wait = settings.ADMISSION_MAX_WAIT_SECONDS
+        estimated_wait = self.estimate_wait()
+        if max_wait <= 0 or estimated_wait <= max_wait:
+            admitted_counter.inc(endpoint=endpoint)
+            return None
+
+        # 排队消化到阈值以内大约需要的时间
+        retry_after = max(1, math.ceil(estimated_wait - max_wait))
+        shed_counter.inc(endpoint=endpoint)
+        logger.warning(
+            f"服务繁忙，拒绝生图请求: endpoint={endpoint}, 预计排队 {estimated_wait:.1f}s > {max_wait:.1f}s, "
+            f"Retry-After={retry_after}s, {self.scheduler.stats()}"
+        )
+        return retry_after
+
+
+# 全局准入控制器，进程内只需要一个
+admission = AdmissionController()
@@ -0,0 +1,503 @@
+import asyncio
+import csv
+import fcntl
+import io
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import uuid
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+from fastapi import UploadFile
+from pydantic import ValidationError
+from core.enum import DeliveryEnum
+from core.exceptions import CommonException, ParamException, ResourceNotFoundException
+from core.image_store import get_saved_image_path, save_image
+from core.image_utils import MAX_INPUT_IMAGE_BYTES
+from core.llm import LLMConf
+from model.batchResp import BatchInfo, BatchStatusEnum
+from model.createPictureReq import CreatePictureRequest
+from model.createPictureResp import StreamStatusEnum
+from service.generation_Image import DoubaoImages
+from service.memory_budget import estimate_upload_bytes, memory_budget
+from setting import settings, executor
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# 压缩包内的清单文件名
+MANIFEST_NAME = "manifest.json"
+
+BATCH_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# 批量任务各行排队时使用的客户端ID前缀（clientId = batch:<batchId>）
+BATCH_CLIENT_PREFIX = "batch:"
+
+# 结果压缩包写出时每次读取的图片字节数
+RESULT_CHUNK_SIZE = 1024 * 1024
+
+
+def read_zip_entry(archive: zipfile.ZipFile, name: str, max_bytes: int) -> bytes:
+    """
+    读取压缩包中的一个文件，解压后超过 max_bytes 时拒绝
+    除了检查文件头中记录的大小，读取时最多只解压 max_bytes + 1 字节，文件头被篡改的压缩包也不会占用更多内存
+
+    Raises:
+        ParamException: 文件超过大小上限
+    """
+    info = archive.getinfo(name)
+    if info.file_size > max_bytes:
+        raise ParamException(message=f"压缩包中的文件超过 {max_bytes // (1024 * 1024)}MB: {name}")
+    with archive.open(info) as f:
+        data = f.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ParamException(message=f"压缩包中的文件超过 {max_bytes // (1024 * 1024)}MB: {name}")
+    return data
+
+
+def get_batch_root() -> Path:
+    """
+    获取批量任务目录（BATCH_DIR 未配置时使用 utils/pictures/batches/）
+    """
+    batch_root = settings.BATCH_DIR
+    if not batch_root:
+        batch_root = Path(__file__).parent.parent / "utils" / "pictures" / "batches"
+    batch_root = Path(batch_root)
+    batch_root.mkdir(parents=True, exist_ok=True)
+    return batch_root
+
+
+class BatchJob:
+    """
+    批量生图任务
+
+    目录结构（BATCH_DIR/<batchId>/）：
+    - input.zip：上传的压缩包，人像按行从中读取，不整体解压
+    - rows.json：校验后的各行请求参数
+    - batch.json：任务状态
+    - progress.jsonl：每行处理结束追加一条记录（断点），服务重启后跳过已记录的行
+    - batch.lock：执行任务的 worker 持有其文件锁（flock），同一时间只有一个进程处理该批次
+    生成的图片按内容哈希保存在 SAVED_DIR，断点记录中只保存文件名
+    """
+
+    def __init__(self, batch_id: str, rows: List[dict], created_at: str, status: BatchStatusEnum = BatchStatusEnum.Running):
+        self.batch_id = batch_id
+        self.batch_dir = get_batch_root() / batch_id
+        self.rows = rows
+        self.created_at = created_at
+        self.status = status
+        self.results: Dict[int, dict] = {}
+        self.task: Optional[asyncio.Task] = None
+        self._write_lock = threading.Lock()
+        self._claim_fd: Optional[int] = None
+
+    @property
+    def input_path(self) -> Path:
+        return self.batch_dir / "input.zip"
+
+    @property
+    def progress_path(self) -> Path:
+        return self.batch_dir / "progress.jsonl"
+
+    def claim(self) -> bool:
+        """
+        获取批次的文件锁（不等待）：多个 worker 启动时都会恢复未完成的批次，只有拿到锁的 worker 执行
+        锁随文件描述符释放，进程退出（包括被强制结束）时由内核自动释放
+
+        Returns:
+            bool: 获取成功返回 True，已被其他进程（或本进程的其他实例）持有时返回 False
+        """
+        if self._claim_fd is not None:
+            return True
+        fd = os.open(self.batch_dir / "batch.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._claim_fd = fd
+        return True
+
+    def release_claim(self):
+        """
+        释放文件锁，重复调用无影响
+        """
+        fd, self._claim_fd = self._claim_fd, None
+        if fd is not None:
+            os.close(fd)
+
+    @classmethod
+    def load(cls, batch_id: str) -> Optional["BatchJob"]:
+        """
+        从磁盘加载任务（服务重启或其他 worker 创建的任务）
+        """
+        batch_dir = get_batch_root() / batch_id
+        try:
+            meta = json.loads((batch_dir / "batch.json").read_text(encoding="utf-8"))
+            rows = json.loads((batch_dir / "rows.json").read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        batch = cls(batch_id, rows, meta["createdAt"], BatchStatusEnum(meta["status"]))
+        batch.results = batch.read_progress()
+        return batch
+
+    def save_meta(self):
+        meta = {"batchId": self.batch_id, "total": len(self.rows), "status": self.status.value, "createdAt": self.created_at}
+        tmp_path = self.batch_dir / "batch.json.tmp"
+        tmp_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.batch_dir / "batch.json")
+
+    def read_progress(self) -> Dict[int, dict]:
+        results = {}
+        try:
+            with open(self.progress_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 写到一半时进程退出留下的残行，该行会重新处理
+                        continue
+                    results[record["row"]] = record
+        except FileNotFoundError:
+            pass
+        return results
+
+    def append_progress(self, record: dict):
+        """
+        追加断点记录并落盘
+        """
+        with self._write_lock:
+            with open(self.progress_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read_portrait(self, file_name: str) -> bytes:
+        """
+        读取一行的人像，解压后的大小不超过在线接口的图片上限（在内存预算登记之前执行）
+        """
+        with zipfile.ZipFile(self.input_path) as archive:
+            return read_zip_entry(archive, file_name, MAX_INPUT_IMAGE_BYTES)
+
+    def to_info(self) -> BatchInfo:
+        failed = [record for record in self.results.values() if record["status"] == "failed"]
+        return BatchInfo(
+            batchId=self.batch_id,
+            status=self.status,
+            total=len(self.rows),
+            completed=len(self.results) - len(failed),
+            failed=len(failed),
+            message=failed[-1]["message"] if failed else None,
+            createdAt=self.created_at
+        )
+
+
+class ZipStreamBuffer:
+    """
+    不可 seek 的写出缓冲，zipfile 写入后由生成器取走，用于边打包边下载
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class BatchManager:
+    """
+    批量生图任务管理
+
+    每行走与在线请求相同的生成管线（DoubaoImages.generate_events_for_request）和调度器，
+    同一批次的所有行使用同一个 clientId，与在线用户按客户端轮转，不会挤占现场用户；
+    批次内同时处理的行数不超过 BATCH_CONCURRENCY
+    """
+
+    def __init__(self):
+        self.batches: Dict[str, BatchJob] = {}
+        # 停机开始后为 True：不再开始处理新的行，未处理的行下次启动时继续
+        self.paused = False
+
+    def pause(self):
+        """
+        暂停批量任务：进行中的行继续执行，不再开始新的行（只设置标志位，可以在信号处理函数中调用）
+        """
+        self.paused = True
+
+    async def create_batch(self, file: UploadFile, data: Optional[str] = None) -> BatchJob:
+        """
+        创建批量任务：保存压缩包、校验清单，随后在后台逐行生成，立即返回任务
+
+        Args:
+            file: zip 压缩包，包含人像图片和 manifest.json
+            data: 可选，JSON 字符串格式的公共参数，作为每一行的默认值
+        """
+        try:
+            defaults = json.loads(data) if data else {}
+        except json.JSONDecodeError as e:
+            raise ParamException(message=f"公共参数解析失败: {e}")
+        if not isinstance(defaults, dict):
+            raise ParamException(message="公共参数必须是 JSON 对象")
+
+        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        await file.seek(0)
+        loop = asyncio.get_running_loop()
+        batch = await loop.run_in_executor(executor, self._create_on_disk, file, uuid.uuid4().hex, defaults, created_at)
+        self.start(batch)
+        logger.info(f"创建批量生图任务: batch_id={batch.batch_id}, 行数={len(batch.rows)}")
+        return batch
+
+    @classmethod
+    def _create_on_disk(cls, file: UploadFile, batch_id: str, defaults: dict, created_at: str) -> BatchJob:
+        """
+        创建任务目录、保存压缩包、写入各行参数和任务状态，全部在线程池中执行，不阻塞事件循环
+        校验失败时删除任务目录
+        """
+        batch_dir = get_batch_root() / batch_id
+        batch_dir.mkdir(parents=True)
+        try:
+            rows = cls._save_and_parse(file, batch_dir, defaults)
+            (batch_dir / "rows.json").write_text(json.dumps(rows, ensure_ascii=False), encoding="utf-8")
+            batch = BatchJob(batch_id, rows, created_at)
+            batch.save_meta()
+        except Exception:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+            raise
+        return batch
+
+    @staticmethod
+    def _save_and_parse(file: UploadFile, batch_dir: Path, defaults: dict) -> List[dict]:
+        """
+        压缩包分块写入磁盘（不整体读入内存），解析并校验清单
+        """
+        input_path = batch_dir / "input.zip"
+        with open(input_path, "wb") as f:
+            shutil.copyfileobj(file.file, f, RESULT_CHUNK_SIZE)
+
+        try:
+            with zipfile.ZipFile(input_path) as archive:
+                # 解压后的大小（文件头记录），读取时 read_portrait 还会再按实际解压的字节数检查
+                archive_sizes = {info.filename: info.file_size for info in archive.infolist()}
+                names = set(archive_sizes)
+                if MANIFEST_NAME not in names:
+                    raise ParamException(message=f"压缩包中缺少 {MANIFEST_NAME}")
+                manifest = json.loads(read_zip_entry(archive, MANIFEST_NAME, MAX_INPUT_IMAGE_BYTES))
+        except zipfile.BadZipFile:
+            raise ParamException(message="上传文件不是有效的 zip 压缩包")
+        except json.JSONDecodeError as e:
+            raise ParamException(message=f"{MANIFEST_NAME} 解析失败: {e}")
+
+        if not isinstance(manifest, list) or not manifest:
+            raise ParamException(message=f"{MANIFEST_NAME} 必须是非空数组")
+        if len(manifest) > settings.BATCH_MAX_ROWS:
+            raise ParamException(message=f"单个批量任务最多 {settings.BATCH_MAX_ROWS} 行，当前 {len(manifest)} 行")
+
+        rows = []
+        for row_index, row in enumerate(manifest):
+            if not isinstance(row, dict) or not row.get("file"):
+                raise ParamException(message=f"第 {row_index + 1} 行缺少 file 字段")
+            file_name = row["file"]
+            if file_name not in names:
+                raise ParamException(message=f"第 {row_index + 1} 行的图片不在压缩包中: {file_name}")
+            if archive_sizes[file_name] > MAX_INPUT_IMAGE_BYTES:
+                raise ParamException(
+                    message=f"第 {row_index + 1} 行的图片超过 {MAX_INPUT_IMAGE_BYTES // (1024 * 1024)}MB: {file_name}"
+                )
+
+            request_fields = {**defaults, **{key: value for key, value in row.items() if key not in ("file", "name")}}
+            try:
+                CreatePictureRequest(**request_fields)
+            except ValidationError as e:
+                raise ParamException(message=f"第 {row_index + 1} 行参数错误: {e}")
+
+            # 结果压缩包中的目录名：行号_名称，避免重名和路径穿越
+            name = re.sub(r'[\\/:*?"<>|\s]+', "_", str(row.get("name") or Path(file_name).stem))
+            rows.append({"file": file_name, "name": f"{row_index + 1:04d}_{name}", "request": request_fields})
+        return rows
+
+    def start(self, batch: BatchJob) -> bool:
+        """
+        获取批次的文件锁后在后台执行，已由其他 worker 执行时跳过
+
+        Returns:
+            bool: 本 worker 开始执行返回 True
+        """
+        if not batch.claim():
+            return False
+        self.batches[batch.batch_id] = batch
+        batch.task = asyncio.create_task(self.run_batch(batch))
+        return True
+
+    async def resume_batches(self) -> int:
+        """
+        服务启动时恢复未完成的批量任务，已记录断点的行不会重新生成
+        每个 worker 启动（包括重新拉起）时都会调用，正在由其他 worker 执行的批次通过文件锁跳过
+        """
+        self.paused = False
+        resumed = 0
+        for batch_dir in get_batch_root().iterdir():
+            if not BATCH_ID_PATTERN.match(batch_dir.name) or batch_dir.name in self.batches:
+                continue
+            batch = BatchJob.load(batch_dir.name)
+            if batch is None or batch.status != BatchStatusEnum.Running:
+                continue
+            if not self.start(batch):
+                continue
+            resumed += 1
+            logger.info(f"恢复批量生图任务: batch_id={batch.batch_id}, 已完成 {len(batch.results)}/{len(batch.rows)} 行")
+        return resumed
+
+    async def stop(self) -> int:
+        """
+        服务停机时取消进行中的批量任务：已完成的行都有断点，下次启动时从断点继续
+        """
+        running = [batch for batch in self.batches.values() if batch.task is not None and not batch.task.done()]
+        for batch in running:
+            batch.task.cancel()
+        await asyncio.gather(*(batch.task for batch in running), return_exceptions=True)
+        for batch in running:
+            # 任务在开始执行前被取消时 run_batch 不会释放文件锁
+            batch.release_claim()
+            self.batches.pop(batch.batch_id, None)
+        return len(running)
+
+    async def run_batch(self, batch: BatchJob):
+        try:
+            semaphore = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+            pending_rows = [row_index for row_index in range(len(batch.rows)) if row_index not in batch.results]
+            await asyncio.gather(*(self.process_row(batch, row_index, semaphore) for row_index in pending_rows))
+            if len(batch.results) < len(batch.rows):
+                # 停机暂停：保持运行中状态，下次启动时从断点继续
+                return
+
+            batch.status = BatchStatusEnum.Completed
+            batch.save_meta()
+        finally:
+            batch.release_claim()
+        info = batch.to_info()
+        logger.info(f"批量生图任务结束: batch_id={batch.batch_id}, 成功 {info.completed} 行, 失败 {info.failed} 行")
+
+    async def process_row(self, batch: BatchJob, row_index: int, semaphore: asyncio.Semaphore):
+        """
+        处理单行：读取人像、标准化校验、生成并保存图片，结束后写入断点
+        被取消（服务关闭）时不写断点，重启后该行重新处理
+        """
+        async with semaphore:
+            if self.paused:
+                return
+            row = batch.rows[row_index]
+            images = []
+            messages = []
+            loop = asyncio.get_running_loop()
+            try:
+                doubao_images = DoubaoImages(LLMConf())
+                image_bytes = await loop.run_in_executor(executor, batch.read_portrait, row["file"])
+                picture_request = CreatePictureRequest(**row["request"])
+                picture_request.clientId = f"{BATCH_CLIENT_PREFIX}{batch.batch_id}"
+                picture_request.delivery = DeliveryEnum.Base64
+                picture_request.preview = False
+                # 后台任务不设等待上限：内存紧张时让位给在线请求
+                await memory_budget.reserve_for(picture_request, estimate_upload_bytes(len(image_bytes)), timeout=math.inf)
+                picture_request.originPicBase64 = await doubao_images.normalize_portrait(image_bytes)
+                memory_budget.lease_of(picture_request).resize(len(picture_request.originPicBase64))
+
+                async for event in doubao_images.generate_events_for_request(picture_request):
+                    if event.status == StreamStatusEnum.Generating:
+                        image_name = await loop.run_in_executor(executor, save_image, event.base64)
+                        city = event.city or picture_request.city
+                        images.append({"city": city.value, "index": event.index, "image": image_name})
+                    elif event.status == StreamStatusEnum.Failed:
+                        messages.append(f"{event.city.value}: {event.message}" if event.city else event.message)
+            except CommonException as e:
+                messages.append(e.message)
+            except Exception as e:
+                logger.error(f"批量生图行处理异常: batch_id={batch.batch_id}, row={row_index}, {e}")
+                messages.append(str(e))
+
+            # 多城市行部分城市失败时按成功计，失败信息保留在结果清单中
+            record = {
+                "row": row_index,
+                "status": "completed" if images else "failed",
+                "images": images,
+                "message": "；".join(messages) or None
+            }
+            await loop.run_in_executor(executor, batch.append_progress, record)
+            batch.results[row_index] = record
+
+    def get_batch(self, batch_id: str) -> BatchJob:
+        """
+        获取任务：本 worker 内的任务直接返回，否则从磁盘加载
+
+        Raises:
+            ResourceNotFoundException: 任务不存在
+        """
+        batch = self.batches.get(batch_id)
+        if batch is not None:
+            return batch
+        batch = BatchJob.load(batch_id) if BATCH_ID_PATTERN.match(batch_id) else None
+        if batch is None:
+            raise ResourceNotFoundException(message=f"批量任务不存在: {batch_id}")
+        return batch
+
+    def iter_result_zip(self, batch_id: str) -> Iterator[bytes]:
+        """
+        边打包边输出结果压缩包：每次只读取一张图片的一个分块，不在内存中保留全部结果
+        目录结构：<行号_名称>/<城市>_<序号>.<扩展名>，另附 results.csv 记录每行的状态和失败原因
+        同步生成器，由 StreamingResponse 放到线程池中执行
+        """
+        batch = self.get_batch(batch_id)
+        results = batch.read_progress()
+        buffer = ZipStreamBuffer()
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for row_index in sorted(results):
+                row = batch.rows[row_index]
+                for image in results[row_index]["images"]:
+                    image_path = get_saved_image_path(image["image"])
+                    ext = image["image"].rsplit(".", 1)[-1]
+                    zip_info = zipfile.ZipInfo.from_file(image_path, f"{row['name']}/{image['city']}_{image['index']}.{ext}")
+                    with open(image_path, "rb") as src, archive.open(zip_info, "w") as dest:
+                        while chunk := src.read(RESULT_CHUNK_SIZE):
+                            dest.write(chunk)
+                            yield buffer.drain()
+
+            summary = io.StringIO()
+            writer = csv.writer(summary)
+            writer.writerow(["row", "name", "file", "status", "images", "message"])
+            for row_index, row in enumerate(batch.rows):
+                record = results.get(row_index)
+                writer.writerow([
+                    row_index + 1,
+                    row["name"],
+                    row["file"],
+                    record["status"] if record else "pending",
+                    len(record["images"]) if record else 0,
+                    (record or {}).get("message") or ""
+                ])
+            archive.writestr("results.csv", summary.getvalue().encode("utf-8-sig"))
+        yield buffer.drain()
+
+
+# 全局批量任务管理器，进程内只需要一个
+batch_manager = BatchManager()
+
+metrics.gauge(
+    "journey_batches_running",
+    "本 worker 内正在执行的批量任务数",
+    lambda: sum(batch.task is not None and not batch.task.done() for batch in batch_manager.batches.values())
+)
@@ -1,54 +1,116 @@
 
-from typing import List
+from collections.abc import AsyncGenerator
+from typing import List, Optional, Tuple
 import base64
 from fastapi import UploadFile
 from core.llm import LLMModel
 from model.createPictureReq import CreatePictureRequest
 from model.createPictureResp import CreatePictureResponse
-from core.enum import CityEnum, ModeEnum, GenderEnum
-from core.exceptions import CommonException, ParamException, ErrorCode
+from core.enum import CityEnum, ModeEnum, GenderEnum, DeliveryEnum, PriorityEnum
+from core.exceptions import CommonException, ParamException, ImageException, ErrorCode, record_error
 from core.prompt_strategy import generate_prompt_by_request
 from model.createPictureResp import ImageItem
 from model.createPictureResp import ImageStreamEvent, StreamStatusEnum
-from core.image_utils import validate_image_format, validate_image_constraints, load_clothes_image
+from core.image_utils import validate_image_format, validate_image_constraints, load_clothes_image, create_thumbnail_base64, normalize_portrait_image
+from core.image_store import save_image, get_image_url
+from service.scheduler import scheduler, SchedulerTicket
+from service.portrait_store import portrait_store
+from service.memory_budget import estimate_upload_bytes, memory_budget
+from model.portraitResp import PortraitInfo
+from setting import settings, executor
 from utils.logger import logger
+from utils.metrics import metrics
+from utils.flight_recorder import note_final_event, note_size
+from utils.tracing import record_stage, trace_stage
+import asyncio
+import functools
 import logging
 import json
+import time
 import traceback
     
 logger = logging.getLogger(__name__)
 
 
+generations_in_flight = metrics.gauge("journey_generations_in_flight", "进行中的生成（含排队），包括同步、流式、异步任务和批量任务")
+generations_in_flight.set(0)
+
+
+def iter_timed_event_chunks(event: ImageStreamEvent, event_id: Optional[int] = None, binary: bool = False):
+    """
+    输出事件的字节分片（SSE 或二进制帧），同时记录序列化耗时和写出耗时
+    StreamingResponse 发送完一个分片后才会取下一个，分片全部取完的时间即为写出耗时
+    """
+    start_time = time.perf_counter()
+    chunks = [event.to_binary_frame()] if binary else list(event.iter_event_chunks(event_id=event_id))
+    serialized_at = time.perf_counter()
+    record_stage("event_serialize", serialized_at - start_time)
+    yield from chunks
+    record_stage("sse_write", time.perf_counter() - serialized_at)
+    note_size("sent_bytes", sum(len(chunk) for chunk in chunks))
+    if event.status in (StreamStatusEnum.Completed, StreamStatusEnum.Failed):
+        note_final_event(event.status.value)
+
+
 class DoubaoImages(LLMModel):
     """
     生图相关方法
     """
     @staticmethod
-    async def validate_input_data(file: UploadFile, data: str) -> CreatePictureRequest:
+    async def validate_input_data(
+        file: Optional[UploadFile],
+        data: str,
+        client_id: Optional[str] = None,
+        priority: PriorityEnum = PriorityEnum.Normal
+    ) -> CreatePictureRequest:
         """
         校验前端传的json和图片，并返回 CreatePictureRequest 对象
+        data 中携带 portraitId 时直接使用已上传的人像，file 可以不传
+        client_id / priority: 服务端确定的排队轮转标识（客户端IP）和优先级通道，data 中的同名字段会被忽略
         """
         # 1. 解析参数和处理图片
         try:
-            # 容错处理:将Python的None替换为JSON标准的null
-            data_cleaned = data.replace('None', 'null')
+            with trace_stage("request_parse"):
+                # 容错处理:将Python的None替换为JSON标准的null
+                data_cleaned = data.replace('None', 'null')
+                
+                # 解析 JSON
+                req_dict = json.loads(data_cleaned)
+                request_model = CreatePictureRequest(**req_dict)
+            request_model.clientId = client_id
+            request_model.priority = priority
             
-            # 解析 JSON
-            req_dict = json.loads(data_cleaned)
-            request_model = CreatePictureRequest(**req_dict)
+            # 已上传过人像：直接读取标准化后的人像，跳过上传读取和 Base64 编码
+            if request_model.portraitId:
+                request_model.originPicBase64 = await portrait_store.load(request_model.portraitId)
+                await memory_budget.reserve_for(request_model, len(request_model.originPicBase64))
+                logger.info(f"流式接口接收请求: city={request_model.city}, mode={request_model.mode}, portraitId={request_model.portraitId}")
+                return request_model
             
-            # 处理图片
-            image_bytes = await file.read()
-            base64_str = base64.b64encode(image_bytes).decode('utf-8')
+            if file is None:
+                raise ParamException(message="缺少用户上传的原图文件或 portraitId")
+            
+            # 读取上传内容之前按估算大小申请内存预算，预算不足时排队等待
+            lease = await memory_budget.reserve_for(request_model, estimate_upload_bytes(file.size or 0))
+            
+            # 处理图片（接口重试时会再次调用，需要从头读取）
+            with trace_stage("upload_read"):
+                await file.seek(0)
+                image_bytes = await file.read()
+                base64_str = base64.b64encode(image_bytes).decode('utf-8')
+            note_size("upload_bytes", len(image_bytes))
             content_type = file.content_type or "image/jpeg"
             image_format = "png" if "png" in content_type.lower() else "jpeg"
             request_model.originPicBase64 = f"data:image/{image_format};base64,{base64_str}"
+            lease.resize(len(request_model.originPicBase64))
             
 
             
             logger.info(f"流式接口接收请求: city={request_model.city}, mode={request_model.mode}")
             return request_model
             
+        except CommonException:
+            raise
         except Exception as e:
             logger.error(f"参数解析失败: {e}")
             # 对于流式接口前的参数错误，直接返回错误响应可能更好，但为了保持 SSE 格式，也可以在流中返回错误
@@ -124,6 +186,33 @@ class DoubaoImages(LLMModel):
         
         return True
     
+    async def create_portrait(self, file: UploadFile) -> PortraitInfo:
+        """
+        上传人像：标准化（摆正、缩放、转 JPEG）并校验一次，保存后返回人像ID
+        同一位用户尝试多个城市时，后续生成只需传 portraitId
+        """
+        image_bytes = await file.read()
+        portrait_base64 = await self.normalize_portrait(image_bytes)
+        portrait_id = await portrait_store.save(portrait_base64)
+        logger.info(f"人像上传成功: portraitId={portrait_id}, {len(image_bytes)} -> {len(portrait_base64)} 字节(Base64)")
+        return PortraitInfo(portraitId=portrait_id, expiresIn=settings.PORTRAIT_TTL_SECONDS)
+    
+    async def normalize_portrait(self, image_bytes: bytes) -> str:
+        """
+        标准化并校验人像，返回 data URL
+        PIL 解码和压缩在线程池中执行，避免阻塞事件循环
+        """
+        def normalize_and_verify() -> str:
+            try:
+                portrait_base64 = normalize_portrait_image(image_bytes, settings.PORTRAIT_MAX_SIZE, settings.PORTRAIT_QUALITY)
+            except ValueError as e:
+                raise ImageException(message=f"输入图片不符合要求：{e}", error_code=ErrorCode.IMAGE_DECODE_ERROR)
+            self.verify_input_image(portrait_base64)
+            return portrait_base64
+        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, normalize_and_verify)
+    
     def verify_image_quality(self, output_image_base64_list: List[str]):
         """
         校验生成图片质量
@@ -146,43 +235,71 @@ class DoubaoImages(LLMModel):
 
 
 
-    async def create_picture(self, file: UploadFile, data: str)->CreatePictureResponse:
+    async def prepare_generation(self, picture_request: CreatePictureRequest) -> Tuple[str, List[str]]:
         """
-        图生图主逻辑
+        生图前置处理：验证输入图片、拼装提示词、准备输入图片列表
+
+        Returns:
+            Tuple[str, List[str]]: (提示词, 输入图片Base64列表)
         """
-        # 1.请求参数校验已经在pytanic中实现了,但需要校验json/转换str
-        picture_request = await self.validate_input_data(file, data)
-        
-        # 2.验证输入图片格式
-        self.verify_input_image(picture_request.originPicBase64)
+        create_picture_input_base64_list = await self.prepare_input_images(picture_request)
+        create_picture_prompt = self.build_prompt(picture_request)
+        return create_picture_prompt, create_picture_input_base64_list
+
+    def build_prompt(self, picture_request: CreatePictureRequest) -> str:
+        """
+        拼装提示词（使用策略模式）
+        """
+        with trace_stage("prompt_build"):
+            create_picture_prompt = generate_prompt_by_request(picture_request)
+        logger.info(f"拼装提示词完成: city={picture_request.city.value}, 长度={len(create_picture_prompt)}")
+        logger.debug(f"拼装提示词：{create_picture_prompt}")
+        return create_picture_prompt
+
+    async def prepare_input_images(self, picture_request: CreatePictureRequest) -> List[str]:
+        """
+        验证输入图片、准备输入图片列表（与城市无关，多城市生成时只处理一次）
+        PIL 解码校验和服装图片读取在线程池中执行，避免阻塞事件循环
+
+        Returns:
+            List[str]: 输入图片Base64列表
+        """
+        loop = asyncio.get_running_loop()
         
-        # 3.拼装提示词（使用策略模式）
-        create_picture_prompt = generate_prompt_by_request(picture_request)
-        logger.info(f"拼装提示词：{create_picture_prompt}")
+        # 1.验证输入图片格式（portraitId 对应的人像上传时已校验过）
+        if not picture_request.portraitId:
+            with trace_stage("image_validation"):
+                await loop.run_in_executor(executor, self.verify_input_image, picture_request.originPicBase64)
         
-        # 4.准备输入图片列表
+        # 2.准备输入图片列表
         # 图片来源说明：
         # - 人物原图：前端传入的 Base64（picture_request.originPicBase64）
         # - 服装图片：后端根据性别和样式ID从本地文件加载（使用 ClothesLoader）
         create_picture_input_base64_list = []
         
-        # 4.1 添加人物原图（前端传入）
+        # 2.1 添加人物原图（前端传入）
         create_picture_input_base64_list.append(picture_request.originPicBase64)
         logger.info(f"添加人物原图: 来源=前端上传")
         
-        # 4.2 轻松模式：根据性别和样式ID自动加载服装图片（后端本地文件）
+        # 2.2 轻松模式：根据性别和样式ID自动加载服装图片（后端本地文件）
         if picture_request.mode == ModeEnum.Easy and picture_request.clothes:
             try:
                 # 服装图片加载
-                clothes_images = load_clothes_image(
-                    sex=picture_request.gender.value,
-                    upper_style_id=picture_request.clothes.upperStyle,
-                    lower_style_id=picture_request.clothes.lowerStyle,
-                    dress_id=picture_request.clothes.dress
-                )
+                with trace_stage("clothes_load"):
+                    clothes_images = await loop.run_in_executor(
+                        executor,
+                        functools.partial(
+                            load_clothes_image,
+                            sex=picture_request.gender.value,
+                            upper_style_id=picture_request.clothes.upperStyle,
+                            lower_style_id=picture_request.clothes.lowerStyle,
+                            dress_id=picture_request.clothes.dress
+                        )
+                    )
                 
-                # 添加服装图片到输入列表
+                # 添加服装图片到输入列表（发送给上游时会随请求体复制一份，计入内存预算）
                 create_picture_input_base64_list.extend(clothes_images)
+                memory_budget.charge(picture_request, sum(len(image) for image in clothes_images))
                 
                 # 日志记录
                 if picture_request.clothes.dress is not None:
@@ -204,96 +321,343 @@ class DoubaoImages(LLMModel):
                 )
         
         logger.info(f"输入图片总数: {len(create_picture_input_base64_list)} 张（1张人物 + {len(create_picture_input_base64_list)-1}张服装）")
+        return create_picture_input_base64_list
+
+    async def generate_images(
+        self,
+        file: UploadFile,
+        data: str,
+        client_id: Optional[str] = None,
+        priority: PriorityEnum = PriorityEnum.Normal
+    ) -> AsyncGenerator[ImageItem, None]:
+        """
+        图生图主逻辑 - 逐张产出生成的图片
+        同步接口基于此方法边生成边写出 JSON，不必等 4 张图片全部生成
+        """
+        # 1.请求参数校验已经在pytanic中实现了,但需要校验json/转换str
+        picture_request = await self.validate_input_data(file, data, client_id, priority)
+        if picture_request.cities and len(picture_request.cities) > 1:
+            raise ParamException(message="多城市生成仅支持流式接口（/createPictureStream、/createPictureStreamBinary、/jobs）")
         
-        # 5.调用火山豆包生图接口（流式生成器）
-        output_image_base64_list = []
-        async for base64_image in self.create_picture_by_seed_ream(create_picture_input_base64_list, create_picture_prompt):
-            # 单张图片质量校验（可选）
-            # await self.verifySingleImageQuality(base64_image)
-            output_image_base64_list.append(base64_image)
+        image_count = 0
+        generations_in_flight.inc()
+        try:
+            # 2.验证输入图片、拼装提示词、准备输入图片列表
+            create_picture_prompt, create_picture_input_base64_list = await self.prepare_generation(picture_request)
+            
+            # 3.排队获取上游执行名额后，调用火山豆包生图接口（流式生成器），每收到一张立即产出，不在内存中累积
+            async with scheduler.slot(picture_request.clientId, picture_request.priority):
+                async for base64_image in self.create_picture_by_seed_ream(create_picture_input_base64_list, create_picture_prompt):
+                    # 图片写出之前计入内存预算
+                    output_bytes = len(base64_image)
+                    note_size("output_bytes", output_bytes)
+                    memory_budget.charge(picture_request, output_bytes)
+                    try:
+                        if picture_request.delivery == DeliveryEnum.Url:
+                            yield ImageItem(id=image_count, url=await self.persist_image(base64_image))
+                        else:
+                            yield ImageItem(id=image_count, base64=base64_image)
+                    finally:
+                        memory_budget.discharge(picture_request, output_bytes)
+                    image_count += 1
+        finally:
+            generations_in_flight.dec()
+            memory_budget.release(picture_request)
         
-        # 5.校验生成图片质量（批量校验）
-        self.verify_image_quality(output_image_base64_list)
+        # 4.校验生成图片数量
+        self.verify_image_count(image_count)
 
-        # 6.封装dto响应体返回
-        images = [
-            ImageItem(id=idx, base64=img_base64)
-            for idx, img_base64 in enumerate(output_image_base64_list)
-        ]
+    @staticmethod
+    def verify_image_count(image_count: int):
+        """
+        校验生成图片数量（流式场景下不保留图片列表，只校验数量）
+        """
+        if image_count == 0:
+            raise CommonException(message="生成的图片列表为空")
+        
+        if image_count != 4:
+            raise CommonException(message=f"期望生成4张图片，实际生成{image_count}张")
+        
+        return True
+
+    async def create_picture(self, file: UploadFile, data: str) -> CreatePictureResponse:
+        """
+        图生图主逻辑，收集全部图片后一次性返回
+        """
+        images = [image async for image in self.generate_images(file, data)]
         
+        # 封装dto响应体返回
         return CreatePictureResponse(images=images)
     
-    async def create_picture_stream(self, file: UploadFile, data: str):
+    async def persist_image(self, base64_image: str) -> str:
         """
-        流式图生图 - 生成器方法，用于 SSE 推送
-        每生成一张图片就立即推送，最后发送完成或失败状态
+        将生成的图片按内容哈希保存到 SAVED_DIR，返回图片访问地址
+        文件写入在线程池中执行，避免阻塞事件循环
+        """
+        loop = asyncio.get_running_loop()
+        image_name = await loop.run_in_executor(executor, save_image, base64_image)
+        logger.info(f"图片已保存: {image_name}")
+        return get_image_url(image_name)
+
+    async def build_preview_event(self, index: int, base64_image: str) -> Optional[ImageStreamEvent]:
+        """
+        生成单张图片的预览事件（缩略图）
+        缩略图在线程池中生成，避免 PIL 解码阻塞事件循环；失败时返回 None，不影响原图推送
+        """
+        try:
+            loop = asyncio.get_running_loop()
+            thumbnail = await loop.run_in_executor(
+                executor,
+                create_thumbnail_base64,
+                base64_image,
+                settings.PREVIEW_MAX_SIZE,
+                settings.PREVIEW_QUALITY
+            )
+        except Exception as e:
+            logger.warning(f"缩略图生成失败，跳过预览 index={index}: {e}")
+            return None
+
+        logger.info(f"流式推送预览 index={index}, size={len(thumbnail)}")
+        return ImageStreamEvent(
+            status=StreamStatusEnum.Preview,
+            index=index,
+            base64=thumbnail,
+            message="preview"
+        )
+
+    async def generate_events(
+        self,
+        file: UploadFile,
+        data: str,
+        client_id: Optional[str] = None,
+        priority: PriorityEnum = PriorityEnum.Normal
+    ) -> AsyncGenerator[ImageStreamEvent, None]:
+        """
+        流式图生图 - 事件生成器，与传输格式无关
+        每生成一张图片就立即产出事件，最后产出完成或失败状态
+        SSE 与二进制帧接口都基于此方法，只是序列化方式不同
         """
         try:
             # 校验输入的入参转换json
-            picture_request = await self.validate_input_data(file, data)
+            picture_request = await self.validate_input_data(file, data, client_id, priority)
+        except Exception as e:
+            yield self.build_failed_event(e)
+            return
+        
+        async for event in self.generate_events_for_request(picture_request):
+            yield event
 
-            # 验证输入图片
-            self.verify_input_image(picture_request.originPicBase64)
-            
-            # 生成提示词
-            create_picture_prompt = generate_prompt_by_request(picture_request)
-            logger.info(f"流式生成 - 提示词：{create_picture_prompt}")
-            
-            # 准备输入图片列表
-            create_picture_input_base64_list = [picture_request.originPicBase64]
-            
-            # 轻松模式：加载服装图片
-            if picture_request.mode == ModeEnum.Easy and picture_request.clothes:
-                try:
-                    clothes_images = load_clothes_image(
-                        sex=picture_request.gender.value,
-                        upper_style_id=picture_request.clothes.upperStyle,
-                        lower_style_id=picture_request.clothes.lowerStyle,
-                        dress_id=picture_request.clothes.dress
-                    )
-                    create_picture_input_base64_list.extend(clothes_images)
-                except ValueError as e:
-                    logger.error(f"加载服装图片失败: {e}")
-                    raise ParamException(message=str(e), error_code=ErrorCode.PARAM_INVALID)
-                except FileNotFoundError as e:
-                    logger.error(f"服装图片文件不存在: {e}")
-                    raise ParamException(message="服装图片文件不存在，请联系管理员", error_code=ErrorCode.RESOURCE_NOT_FOUND)
+    async def generate_events_for_request(self, picture_request: CreatePictureRequest) -> AsyncGenerator[ImageStreamEvent, None]:
+        """
+        基于已解析的请求产出流式事件
+        异步任务（/jobs）在请求内完成上传解析后，在后台通过此方法执行生成
+        """
+        generations_in_flight.inc()
+        try:
+            if picture_request.cities and len(picture_request.cities) > 1:
+                async for event in self.generate_fanout_events(picture_request):
+                    yield event
+                return
             
-            logger.info(f"流式生成 - 输入图片总数: {len(create_picture_input_base64_list)} 张")
+            # 验证输入图片、生成提示词、准备输入图片列表
+            create_picture_prompt, create_picture_input_base64_list = await self.prepare_generation(picture_request)
             
-            # 调用底层生成器，逐张推送图片
             image_count = 0
-            async for base64_image in self.create_picture_by_seed_ream(create_picture_input_base64_list, create_picture_prompt):
-                # 封装成功生成的消息
-                resp = ImageStreamEvent(
-                    status=StreamStatusEnum.Generating,
-                    index=image_count,
-                    base64=base64_image,
-                    message="success"
-                )
-                image_count += 1
-                logger.info(f"流式推送图片 index={image_count-1}")
-                yield resp.to_event_data()
+            async for event in self.generate_city_events(picture_request, create_picture_prompt, create_picture_input_base64_list):
+                if event.status == StreamStatusEnum.Generating:
+                    image_count += 1
+                yield event
             
             # 发送完成信号
             logger.info(f"流式生成完成，共生成 {image_count} 张图片")
-            end_resp = ImageStreamEvent(
+            yield ImageStreamEvent(
                 status=StreamStatusEnum.Completed,
                 message=f"生成流程结束，共生成 {image_count} 张图片"
             )
-            yield end_resp.to_event_data()
             
         except Exception as e:
             # 发送错误信号
-            logger.error(f"流式生成异常: {e}")
-            error_detail = traceback.format_exc()
-            logger.error(f"异常详情: {error_detail}")
-            error_resp = ImageStreamEvent(
+            yield self.build_failed_event(e)
+        finally:
+            # 生成结束，归还请求占用的内存预算
+            generations_in_flight.dec()
+            memory_budget.release(picture_request)
+
+    async def generate_city_events(
+        self,
+        picture_request: CreatePictureRequest,
+        create_picture_prompt: str,
+        create_picture_input_base64_list: List[str],
+        city: Optional[CityEnum] = None
+    ) -> AsyncGenerator[ImageStreamEvent, None]:
+        """
+        单个城市的生成：排队获取上游执行名额后逐张产出 queued/preview/generating 事件
+        city 不为空时（多城市生成）每个事件都带上城市，index 为该城市内的图片序号
+        """
+        # 排队等待上游执行名额，排队期间定时推送 queued 事件
+        ticket = scheduler.submit(picture_request.clientId, picture_request.priority)
+        try:
+            async for queued_resp in self.wait_in_queue(ticket, city):
+                yield queued_resp
+            
+            # 调用底层生成器，逐张推送图片
+            image_count = 0
+            async for base64_image in self.create_picture_by_seed_ream(create_picture_input_base64_list, create_picture_prompt):
+                # 图片推送出去之前计入内存预算
+                output_bytes = len(base64_image)
+                note_size("output_bytes", output_bytes)
+                memory_budget.charge(picture_request, output_bytes)
+                try:
+                    # 开启预览时先推送缩略图，弱网下用户可以更早看到结果
+                    if picture_request.preview:
+                        preview_resp = await self.build_preview_event(image_count, base64_image)
+                        if preview_resp is not None:
+                            preview_resp.city = city
+                            yield preview_resp
+
+                    # 封装成功生成的消息（Url 模式下只推送图片地址）
+                    if picture_request.delivery == DeliveryEnum.Url:
+                        resp = ImageStreamEvent(
+                            status=StreamStatusEnum.Generating,
+                            city=city,
+                            index=image_count,
+                            url=await self.persist_image(base64_image),
+                            message="success"
+                        )
+                    else:
+                        resp = ImageStreamEvent(
+                            status=StreamStatusEnum.Generating,
+                            city=city,
+                            index=image_count,
+                            base64=base64_image,
+                            message="success"
+                        )
+                    image_count += 1
+                    logger.info(f"流式推送图片 index={image_count-1}" + (f", city={city.value}" if city else ""))
+                    yield resp
+                finally:
+                    memory_budget.discharge(picture_request, output_bytes)
+        finally:
+            scheduler.release(ticket)
+
+    async def generate_fanout_events(self, picture_request: CreatePictureRequest) -> AsyncGenerator[ImageStreamEvent, None]:
+        """
+        多城市生成：人像和服装素材只处理一次，每个城市各自拼装提示词，
+        各城市并发排队、并发调用上游（受调度器并发数限制），所有事件按到达顺序合并到同一个流中
+
+        单个城市失败时推送带 city 的 failed 事件，不影响其他城市；
+        全部城市结束后推送 completed（至少一个城市成功）或 failed（全部失败）
+        """
+        create_picture_input_base64_list = await self.prepare_input_images(picture_request)
+        cities = picture_request.cities
+        logger.info(f"多城市生成: {[city.value for city in cities]}")
+        
+        # 有界队列：客户端读取慢时各城市的生成会被反压，不会在内存中堆积图片
+        queue: asyncio.Queue = asyncio.Queue(maxsize=len(cities))
+        image_counts = {city: 0 for city in cities}
+        failed_cities = []
+        
+        async def run_city(city: CityEnum):
+            try:
+                city_request = picture_request.model_copy(update={"city": city, "cities": None})
+                create_picture_prompt = self.build_prompt(city_request)
+                async for event in self.generate_city_events(city_request, create_picture_prompt, create_picture_input_base64_list, city):
+                    await queue.put(event)
+            except Exception as e:
+                logger.error(f"多城市生成异常: city={city.value}, {e}")
+                record_error(e)
+                failed_cities.append(city)
+                await queue.put(ImageStreamEvent(status=StreamStatusEnum.Failed, city=city, message=str(e)))
+            # 结束标记（被取消时不再写入，避免队列已满时阻塞）
+            await queue.put(None)
+        
+        tasks = [asyncio.create_task(run_city(city)) for city in cities]
+        try:
+            running = len(tasks)
+            while running:
+                event = await queue.get()
+                if event is None:
+                    running -= 1
+                    continue
+                if event.status == StreamStatusEnum.Generating:
+                    image_counts[event.city] += 1
+                yield event
+        finally:
+            # 客户端断开或出错时取消仍在生成的城市，归还调度名额
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        image_count = sum(image_counts.values())
+        summary = "，".join(f"{city.value} {count} 张" for city, count in image_counts.items())
+        logger.info(f"多城市生成完成，共生成 {image_count} 张图片（{summary}）")
+        if len(failed_cities) == len(cities):
+            yield ImageStreamEvent(
                 status=StreamStatusEnum.Failed,
-                message=str(e)
+                message=f"全部城市生成失败（{summary}）"
+            )
+        else:
+            yield ImageStreamEvent(
+                status=StreamStatusEnum.Completed,
+                message=f"生成流程结束，共生成 {image_count} 张图片（{summary}）"
             )
-            yield error_resp.to_event_data()
 
+    async def wait_in_queue(self, ticket: SchedulerTicket, city: Optional[CityEnum] = None) -> AsyncGenerator[ImageStreamEvent, None]:
+        """
+        等待调度，排队期间每隔 SCHEDULER_QUEUE_EVENT_INTERVAL 推送一次排队位置和预计等待时间
+        有空闲名额时直接返回，不推送 queued 事件
+        """
+        while not ticket.granted:
+            position = scheduler.position(ticket)
+            yield ImageStreamEvent(
+                status=StreamStatusEnum.Queued,
+                city=city,
+                position=position,
+                estimatedWait=scheduler.estimated_wait(ticket),
+                message=f"排队中，前面还有 {position - 1} 人"
+            )
+            await scheduler.wait_for_slot(ticket, settings.SCHEDULER_QUEUE_EVENT_INTERVAL)
 
+    def build_failed_event(self, e: Exception) -> ImageStreamEvent:
+        """
+        记录异常并封装失败事件
+        """
+        logger.error(f"流式生成异常: {e}")
+        record_error(e)
+        error_detail = traceback.format_exc()
+        logger.error(f"异常详情: {error_detail}")
+        return ImageStreamEvent(
+            status=StreamStatusEnum.Failed,
+            message=str(e)
+        )
 
-        
+    async def create_picture_stream(
+        self,
+        file: UploadFile,
+        data: str,
+        client_id: Optional[str] = None,
+        priority: PriorityEnum = PriorityEnum.Normal
+    ):
+        """
+        流式图生图 - 生成器方法，用于 SSE 推送
+        每生成一张图片就立即推送，最后发送完成或失败状态
+        事件以字节分片输出（见 ImageStreamEvent.iter_event_chunks），避免大图被整体拷贝多次
+        """
+        async for event in self.generate_events(file, data, client_id, priority):
+            for chunk in iter_timed_event_chunks(event):
+                yield chunk
+
+    async def create_picture_stream_binary(
+        self,
+        file: UploadFile,
+        data: str,
+        client_id: Optional[str] = None,
+        priority: PriorityEnum = PriorityEnum.Normal
+    ):
+        """
+        流式图生图 - 二进制帧推送
+        图片以原始字节发送，不经过 Base64 和 JSON 转义，帧格式见 ImageStreamEvent.to_binary_frame
+        """
+        async for event in self.generate_events(file, data, client_id, priority):
+            for frame in iter_timed_event_chunks(event, binary=True):
+                yield frame
@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from typing import Dict, Optional, Tuple
+from fastapi import UploadFile
+from core.enum import PriorityEnum
+from core.exceptions import ConflictException, ErrorCode, ResourceNotFoundException
+from core.llm import LLMConf
+from model.createPictureReq import CreatePictureRequest
+from model.createPictureResp import ImageStreamEvent, StreamStatusEnum
+from model.jobResp import JobStatusEnum
+from service.generation_Image import DoubaoImages
+from service.job_store import JobRecord, JobStore, create_job_store
+from setting import settings
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class JobManager:
+    """
+    异步生图任务管理
+    任务元数据和事件日志保存在 JobStore 中，生成只在创建任务的 worker 内执行；
+    使用共享存储（JOB_STORE=sqlite）时，任意 worker 都可以查询、订阅和删除任务
+    """
+
+    def __init__(self, store: Optional[JobStore] = None):
+        self.store = store or create_job_store()
+        # 本 worker 内正在执行的生成任务
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    async def create_job(
+        self,
+        file: UploadFile,
+        data: str,
+        client_id: Optional[str] = None,
+        priority: PriorityEnum = PriorityEnum.Normal
+    ) -> JobRecord:
+        """
+        创建任务：在请求内完成参数解析和上传读取（请求结束后 UploadFile 会被关闭），
+        随后在后台执行生成，立即返回任务
+        """
+        await self.purge_expired_jobs()
+
+        picture_request = await DoubaoImages.validate_input_data(file, data, client_id, priority)
+        job = await self.store.create_job(uuid.uuid4().hex)
+        self.start_job(job.job_id, picture_request)
+        return job
+
+    async def create_idempotent_job(self, idempotency_key: str, picture_request: CreatePictureRequest) -> Tuple[JobRecord, bool]:
+        """
+        按幂等键创建任务：有效期内同一个键只会触发一次生成
+        - 键未使用：创建任务并开始生成
+        - 键已绑定且请求一致：返回原任务（进行中则接入，已完成则回放），不再生成
+        - 原任务失败、取消或已过期：重新生成并改绑到新任务
+        - 键已用于不同的请求：拒绝
+
+        Returns:
+            Tuple[JobRecord, bool]: (任务, 是否复用了已有任务)
+
+        Raises:
+            ConflictException: 幂等键已用于不同的请求
+        """
+        await self.purge_expired_jobs()
+
+        fingerprint = self.request_fingerprint(picture_request)
+        # 先创建任务记录再占用键：其他请求拿到键时任务一定已存在
+        job = await self.store.create_job(uuid.uuid4().hex)
+        while True:
+            owner_job_id, owner_fingerprint = await self.store.claim_idempotency_key(
+                idempotency_key, fingerprint, job.job_id, settings.IDEMPOTENCY_TTL_SECONDS
+            )
+            if owner_fingerprint != fingerprint:
+                await self.store.delete_job(job.job_id)
+                raise ConflictException(
+                    message=f"Idempotency-Key 已用于不同的请求参数: {idempotency_key}",
+                    error_code=ErrorCode.IDEMPOTENCY_KEY_CONFLICT
+                )
+            if owner_job_id == job.job_id:
+                break
+            owner_job = await self.store.get_job(owner_job_id)
+            if owner_job is not None and owner_job.status not in (JobStatusEnum.Failed, JobStatusEnum.Cancelled):
+                await self.store.delete_job(job.job_id)
+                logger.info(f"幂等键重复提交，复用已有任务: key={idempotency_key}, job_id={owner_job_id}")
+                return owner_job, True
+            # 原任务失败或已清理：改绑失败说明被并发请求抢先，重新读取绑定
+            if await self.store.swap_idempotency_key(idempotency_key, owner_job_id, job.job_id):
+                break
+
+        self.start_job(job.job_id, picture_request)
+        return job, False
+
+    def start_job(self, job_id: str, picture_request: CreatePictureRequest):
+        """
+        在后台执行生成任务
+        """
+        task = asyncio.create_task(self.run_job(job_id, picture_request))
+        self.tasks[job_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job_id, None))
+        logger.info(f"创建异步生图任务: job_id={job_id}, city={picture_request.city}, mode={picture_request.mode}")
+
+    @staticmethod
+    def request_fingerprint(picture_request: CreatePictureRequest) -> str:
+        """
+        请求指纹：参数 + 人像内容的哈希，用于判断幂等键是否被用于不同的请求
+        clientId、priority 不参与计算（网络切换后客户端 IP 可能变化，优先级通道由服务端决定）
+        """
+        params = picture_request.model_dump(mode='json', exclude={'originPicBase64', 'clientId', 'priority'})
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update((picture_request.originPicBase64 or '').encode('utf-8'))
+        return digest.hexdigest()
+
+    async def run_job(self, job_id: str, picture_request: CreatePictureRequest):
+        """
+        执行任务：逐个写入流式事件，根据最后一个事件确定任务结束状态
+        """
+        await self.store.set_status(job_id, JobStatusEnum.Running)
+        final_status = JobStatusEnum.Failed
+        image_count = 0
+        events = DoubaoImages(LLMConf()).generate_events_for_request(picture_request)
+        try:
+            async for event in events:
+                if await self.store.append_event(job_id, event) is None:
+                    # 任务已被其他 worker 删除，停止生成
+                    logger.info(f"异步生图任务已被删除，停止生成: job_id={job_id}")
+                    return
+                if event.status == StreamStatusEnum.Generating:
+                    image_count += 1
+                elif event.status == StreamStatusEnum.Completed:
+                    final_status = JobStatusEnum.Completed
+                elif event.status == StreamStatusEnum.Failed:
+                    final_status = JobStatusEnum.Failed
+        except asyncio.CancelledError:
+            logger.info(f"异步生图任务已取消: job_id={job_id}")
+            await self.store.append_event(job_id, ImageStreamEvent(status=StreamStatusEnum.Failed, message="任务已取消"))
+            await self.store.set_status(job_id, JobStatusEnum.Cancelled)
+            raise
+        except Exception as e:
+            logger.error(f"异步生图任务异常: job_id={job_id}, {e}")
+            await self.store.append_event(job_id, ImageStreamEvent(status=StreamStatusEnum.Failed, message=str(e)))
+        finally:
+            # 提前结束时关闭生成器，归还调度名额
+            await events.aclose()
+        await self.store.set_status(job_id, final_status)
+        logger.info(f"异步生图任务结束: job_id={job_id}, status={final_status.value}, 图片数={image_count}")
+
+    async def get_job(self, job_id: str) -> JobRecord:
+        """
+        获取任务
+
+        Raises:
+            ResourceNotFoundException: 任务不存在或已过期
+        """
+        await self.purge_expired_jobs()
+        job = await self.store.get_job(job_id)
+        if job is None:
+            raise ResourceNotFoundException(message=f"任务不存在或已过期: {job_id}")
+        return job
+
+    async def delete_job(self, job_id: str):
+        """
+        删除任务：本 worker 内仍在生成的任务会先被取消；
+        其他 worker 上的任务在写入下一个事件时发现已删除，自行停止
+        """
+        await self.get_job(job_id)
+        task = self.tasks.get(job_id)
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.store.delete_job(job_id)
+        logger.info(f"删除异步生图任务: job_id={job_id}")
+
+    async def follow_events(self, job_id: str, last_event_id: Optional[int] = None):
+        """
+        订阅任务事件：先回放 last_event_id 之后的已保存事件，再实时推送新事件，直到任务结束
+        等待期间每隔 SSE_HEARTBEAT_SECONDS 产出一次 (None, None) 作为心跳
+
+        Yields:
+            Tuple[Optional[int], Optional[ImageStreamEvent]]: (事件ID, 事件)
+        """
+        await self.get_job(job_id)
+        next_id = 0 if last_event_id is None else last_event_id + 1
+        while True:
+            # 先读任务状态再读事件：状态为已结束时，读到的事件一定是完整的
+            job = await self.store.get_job(job_id)
+            if job is None:
+                return
+            for event_id, event in await self.store.read_events(job_id, next_id):
+                yield event_id, event
+                next_id = event_id + 1
+            if job.is_finished:
+                return
+            if not await self.store.wait_for_events(job_id, next_id, settings.SSE_HEARTBEAT_SECONDS):
+                yield None, None
+
+    async def cancel_running_jobs(self) -> int:
+        """
+        取消本 worker 内仍在生成的任务（停机排空超时后调用），任务状态记为 cancelled
+        """
+        tasks = [task for task in self.tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return len(tasks)
+
+    async def purge_expired_jobs(self):
+        """
+        清理结束超过 JOB_TTL_SECONDS 的任务
+        """
+        purged = await self.store.purge_expired_jobs(settings.JOB_TTL_SECONDS)
+        if purged:
+            logger.info(f"清理过期异步生图任务 {purged} 个")
+
+
+# 全局任务管理器，进程内只需要一个
+job_manager = JobManager()
+
+metrics.gauge("journey_jobs_running", "本 worker 内正在执行的异步任务数", lambda: sum(not task.done() for task in job_manager.tasks.values()))
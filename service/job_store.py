@@ -0,0 +1,532 @@
+import asyncio
+import base64
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from pydantic import BaseModel
+from core.image_store import MIME_TYPE_MAPPING, get_saved_dir, get_saved_image_path, save_image
+from model.createPictureResp import ImageStreamEvent, StreamStatusEnum
+from model.jobResp import JobInfo, JobStatusEnum
+from service.memory_budget import memory_budget, spilled_counter
+from setting import settings, executor, SharedExecutor
+
+logger = logging.getLogger(__name__)
+
+
+# 结束状态：任务不会再产生新事件
+FINISHED_STATUSES = (JobStatusEnum.Completed, JobStatusEnum.Failed, JobStatusEnum.Cancelled)
+
+
+class JobRecord(BaseModel):
+    """
+    任务元数据（存储层使用，时间为 Unix 时间戳）
+    """
+    job_id: str
+    status: JobStatusEnum = JobStatusEnum.Pending
+    image_count: int = 0
+    event_count: int = 0
+    message: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_info(self) -> JobInfo:
+        return JobInfo(
+            jobId=self.job_id,
+            status=self.status,
+            imageCount=self.image_count,
+            eventCount=self.event_count,
+            message=self.message,
+            createdAt=datetime.fromtimestamp(self.created_at).strftime("%Y-%m-%d %H:%M:%S"),
+            updatedAt=datetime.fromtimestamp(self.updated_at).strftime("%Y-%m-%d %H:%M:%S")
+        )
+
+
+class JobStore(ABC):
+    """
+    异步生图任务存储抽象：任务元数据 + 按顺序追加的事件日志
+
+    - 事件ID即事件在日志中的下标，从 0 开始连续递增
+    - 同一进程内追加事件会立即唤醒等待者；跨进程写入的事件通过按 poll_interval 轮询发现
+    - 接入外部 KV（如 Redis）时实现本类的抽象方法即可，JobManager 不需要改动
+    """
+
+    # 等待新事件时的轮询间隔（秒），None 表示只依赖进程内唤醒
+    poll_interval: Optional[float] = None
+
+    def __init__(self):
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+
+    @abstractmethod
+    async def create_job(self, job_id: str) -> JobRecord:
+        ...
+
+    @abstractmethod
+    async def get_job(self, job_id: str) -> Optional[JobRecord]:
+        ...
+
+    @abstractmethod
+    async def set_status(self, job_id: str, status: JobStatusEnum):
+        ...
+
+    @abstractmethod
+    async def append_event(self, job_id: str, event: ImageStreamEvent) -> Optional[int]:
+        """
+        追加事件，返回事件ID；任务不存在（已被删除）时返回 None
+        """
+        ...
+
+    @abstractmethod
+    async def read_events(self, job_id: str, start_id: int) -> List[Tuple[int, ImageStreamEvent]]:
+        """
+        读取事件ID >= start_id 的全部事件
+        """
+        ...
+
+    @abstractmethod
+    async def delete_job(self, job_id: str):
+        ...
+
+    @abstractmethod
+    async def purge_expired_jobs(self, ttl_seconds: float) -> int:
+        """
+        清理结束超过 ttl_seconds 的任务，返回清理数量
+        """
+        ...
+
+    @abstractmethod
+    async def claim_idempotency_key(self, key: str, fingerprint: str, job_id: str, ttl_seconds: float) -> Tuple[str, str]:
+        """
+        原子地占用幂等键：键不存在（或已过期）时绑定到 job_id，否则保持原绑定
+
+        Returns:
+            Tuple[str, str]: 键当前绑定的 (任务ID, 请求指纹)
+        """
+        ...
+
+    @abstractmethod
+    async def swap_idempotency_key(self, key: str, old_job_id: str, new_job_id: str) -> bool:
+        """
+        键仍绑定 old_job_id 时改绑到 new_job_id（原任务失败后重新生成），返回是否成功
+        """
+        ...
+
+    async def close(self):
+        """
+        服务停机时释放存储占用的资源（连接、线程），之后再次调用其他方法时重新创建
+        """
+
+    async def wait_for_events(self, job_id: str, event_count: int, timeout: float) -> bool:
+        """
+        等待任务产生第 event_count 个之后的新事件
+
+        Returns:
+            bool: 有新事件、任务已结束或已删除返回 True，超时返回 False
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            waiter = asyncio.Event()
+            self._waiters.setdefault(job_id, set()).add(waiter)
+            try:
+                # 先注册再检查，避免检查之后、等待之前写入的事件被漏掉
+                record = await self.get_job(job_id)
+                if record is None or record.event_count > event_count or record.is_finished:
+                    return True
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                wait_seconds = remaining if self.poll_interval is None else min(remaining, self.poll_interval)
+                try:
+                    await asyncio.wait_for(waiter.wait(), wait_seconds)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                waiters = self._waiters.get(job_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[job_id]
+
+    def notify(self, job_id: str):
+        """
+        唤醒本进程内等待该任务的订阅者
+        """
+        for waiter in self._waiters.get(job_id, ()):
+            waiter.set()
+
+
+def load_saved_image_data_url(image_name: str) -> str:
+    """
+    读取落盘的图片，还原为 Base64 data URL
+    """
+    ext = image_name.rsplit(".", 1)[-1]
+    image_bytes = get_saved_image_path(image_name).read_bytes()
+    return f"data:{MIME_TYPE_MAPPING[ext]};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+
+
+class MemoryJobStore(JobStore):
+    """
+    进程内存储，只适用于单 worker 部署
+
+    缓存在内存中的图片计入内存预算；内存紧张时新生成的图片改为落盘（内容哈希文件名），读取时再还原
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._jobs: Dict[str, JobRecord] = {}
+        self._events: Dict[str, List[ImageStreamEvent]] = {}
+        # 任务ID -> {事件ID: 落盘的图片文件名}
+        self._spilled: Dict[str, Dict[int, str]] = {}
+        # 任务ID -> 内存中缓存的图片字节数
+        self._retained_bytes: Dict[str, int] = {}
+        # 幂等键 -> (任务ID, 请求指纹, 绑定时间)
+        self._idempotency_keys: Dict[str, Tuple[str, str, float]] = {}
+
+    async def create_job(self, job_id: str) -> JobRecord:
+        now = time.time()
+        record = JobRecord(job_id=job_id, created_at=now, updated_at=now)
+        self._jobs[job_id] = record
+        self._events[job_id] = []
+        return record.model_copy()
+
+    async def get_job(self, job_id: str) -> Optional[JobRecord]:
+        record = self._jobs.get(job_id)
+        return record.model_copy() if record is not None else None
+
+    async def set_status(self, job_id: str, status: JobStatusEnum):
+        record = self._jobs.get(job_id)
+        if record is None:
+            return
+        record.status = status
+        record.updated_at = time.time()
+        self.notify(job_id)
+
+    async def append_event(self, job_id: str, event: ImageStreamEvent) -> Optional[int]:
+        if job_id not in self._jobs:
+            return None
+        image_name = None
+        if event.status == StreamStatusEnum.Generating and event.base64 and memory_budget.under_pressure:
+            loop = asyncio.get_running_loop()
+            image_name = await loop.run_in_executor(executor, save_image, event.base64)
+            event = event.model_copy(update={"base64": None})
+            spilled_counter.inc()
+            logger.info(f"内存紧张，生成结果落盘保存: job_id={job_id}, image={image_name}")
+
+        record = self._jobs.get(job_id)
+        if record is None:
+            return None
+        events = self._events[job_id]
+        events.append(event)
+        record.event_count = len(events)
+        if image_name:
+            self._spilled.setdefault(job_id, {})[record.event_count - 1] = image_name
+        elif event.base64:
+            self._retained_bytes[job_id] = self._retained_bytes.get(job_id, 0) + len(event.base64)
+            memory_budget.charge_bytes(len(event.base64))
+        if event.status == StreamStatusEnum.Generating:
+            record.image_count += 1
+        if event.message:
+            record.message = event.message
+        record.updated_at = time.time()
+        self.notify(job_id)
+        return record.event_count - 1
+
+    async def read_events(self, job_id: str, start_id: int) -> List[Tuple[int, ImageStreamEvent]]:
+        events = list(enumerate(self._events.get(job_id, [])))[start_id:]
+        spilled = self._spilled.get(job_id)
+        if not spilled:
+            return events
+        loop = asyncio.get_running_loop()
+        restored = []
+        for event_id, event in events:
+            image_name = spilled.get(event_id)
+            if image_name:
+                image = await loop.run_in_executor(executor, load_saved_image_data_url, image_name)
+                event = event.model_copy(update={"base64": image})
+            restored.append((event_id, event))
+        return restored
+
+    async def delete_job(self, job_id: str):
+        self._jobs.pop(job_id, None)
+        self._events.pop(job_id, None)
+        self._spilled.pop(job_id, None)
+        memory_budget.free_bytes(self._retained_bytes.pop(job_id, 0))
+        self.notify(job_id)
+
+    async def purge_expired_jobs(self, ttl_seconds: float) -> int:
+        now = time.time()
+        expired_ids = [
+            job_id for job_id, record in self._jobs.items()
+            if record.is_finished and now - record.updated_at > ttl_seconds
+        ]
+        for job_id in expired_ids:
+            await self.delete_job(job_id)
+        return len(expired_ids)
+
+    async def claim_idempotency_key(self, key: str, fingerprint: str, job_id: str, ttl_seconds: float) -> Tuple[str, str]:
+        now = time.time()
+        claimed = self._idempotency_keys.get(key)
+        if claimed is None or now - claimed[2] > ttl_seconds:
+            claimed = (job_id, fingerprint, now)
+            self._idempotency_keys[key] = claimed
+        return claimed[0], claimed[1]
+
+    async def swap_idempotency_key(self, key: str, old_job_id: str, new_job_id: str) -> bool:
+        claimed = self._idempotency_keys.get(key)
+        if claimed is None or claimed[0] != old_job_id:
+            return False
+        self._idempotency_keys[key] = (new_job_id, claimed[1], time.time())
+        return True
+
+
+class SqliteJobStore(JobStore):
+    """
+    基于 SQLite（WAL 模式）的共享存储，同一台机器上的多个 worker 进程共用一个数据库文件
+
+    - 事件日志按 (job_id, event_id) 聚簇存储，续传时按主键范围读取
+    - 事件中的图片不写入数据库：按内容哈希保存到 SAVED_DIR，事件行只记录文件名，读取时再还原
+    - 数据库操作在存储专用的小线程池（JOB_STORE_THREADS）中执行，不阻塞事件循环；每个线程使用自己的连接。
+      订阅方的轮询、等待写锁（BEGIN IMMEDIATE 最长等待 30 秒）都只占用专用线程，不会挤占缩略图、
+      保存图片、人像校验等使用的共享线程池
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id      TEXT PRIMARY KEY,
+            status      TEXT NOT NULL,
+            image_count INTEGER NOT NULL DEFAULT 0,
+            event_count INTEGER NOT NULL DEFAULT 0,
+            message     TEXT,
+            created_at  REAL NOT NULL,
+            updated_at  REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS job_events (
+            job_id     TEXT NOT NULL,
+            event_id   INTEGER NOT NULL,
+            data       TEXT NOT NULL,
+            image_name TEXT,
+            PRIMARY KEY (job_id, event_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs (status, updated_at);
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key         TEXT PRIMARY KEY,
+            job_id      TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            created_at  REAL NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: Optional[str] = None, poll_interval: Optional[float] = None):
+        super().__init__()
+        self.db_path = str(db_path or settings.JOB_STORE_PATH or get_saved_dir().parent / "jobs.sqlite3")
+        self.poll_interval = poll_interval or settings.JOB_STORE_POLL_INTERVAL
+        self._local = threading.local()
+        self.executor = SharedExecutor(max_workers=max(settings.JOB_STORE_THREADS, 1), thread_name_prefix="journey-jobstore")
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        # 建表用一次性连接，不缓存在当前线程：多 worker 启动时本对象在主进程中创建，SQLite 连接不能跨 fork 使用
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.executescript(self.SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None：自行控制事务，追加事件时用 BEGIN IMMEDIATE 串行化写入
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    @staticmethod
+    def _row_to_record(row) -> JobRecord:
+        return JobRecord(
+            job_id=row[0],
+            status=JobStatusEnum(row[1]),
+            image_count=row[2],
+            event_count=row[3],
+            message=row[4],
+            created_at=row[5],
+            updated_at=row[6]
+        )
+
+    def _create_job(self, job_id: str) -> JobRecord:
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO jobs (job_id, status, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (job_id, JobStatusEnum.Pending.value, now, now)
+        )
+        return JobRecord(job_id=job_id, created_at=now, updated_at=now)
+
+    def _get_job(self, job_id: str) -> Optional[JobRecord]:
+        row = self._connect().execute(
+            "SELECT job_id, status, image_count, event_count, message, created_at, updated_at FROM jobs WHERE job_id = ?",
+            (job_id,)
+        ).fetchone()
+        return self._row_to_record(row) if row is not None else None
+
+    def _set_status(self, job_id: str, status: JobStatusEnum):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+            (status.value, time.time(), job_id)
+        )
+
+    def _append_event(self, job_id: str, event: ImageStreamEvent) -> Optional[int]:
+        # 图片先落盘（内容哈希去重），事务内只写文件名
+        image_name = save_image(event.base64) if event.base64 else None
+        data = json.dumps(event.model_dump(mode='json', exclude_none=True, exclude={'base64'}), ensure_ascii=False)
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT event_count FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            event_id = row[0]
+            conn.execute(
+                "INSERT INTO job_events (job_id, event_id, data, image_name) VALUES (?, ?, ?, ?)",
+                (job_id, event_id, data, image_name)
+            )
+            conn.execute(
+                "UPDATE jobs SET event_count = event_count + 1, image_count = image_count + ?, "
+                "message = COALESCE(?, message), updated_at = ? WHERE job_id = ?",
+                (1 if event.status == StreamStatusEnum.Generating else 0, event.message or None, time.time(), job_id)
+            )
+            conn.execute("COMMIT")
+            return event_id
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _read_events(self, job_id: str, start_id: int) -> List[Tuple[int, ImageStreamEvent]]:
+        rows = self._connect().execute(
+            "SELECT event_id, data, image_name FROM job_events WHERE job_id = ? AND event_id >= ? ORDER BY event_id",
+            (job_id, start_id)
+        ).fetchall()
+        events = []
+        for event_id, data, image_name in rows:
+            fields = json.loads(data)
+            if image_name:
+                fields["base64"] = load_saved_image_data_url(image_name)
+            events.append((event_id, ImageStreamEvent(**fields)))
+        return events
+
+    def _delete_job(self, job_id: str):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _purge_expired_jobs(self, ttl_seconds: float) -> int:
+        statuses = [status.value for status in FINISHED_STATUSES]
+        placeholders = ",".join("?" * len(statuses))
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired_ids = [row[0] for row in conn.execute(
+                f"SELECT job_id FROM jobs WHERE status IN ({placeholders}) AND updated_at < ?",
+                (*statuses, time.time() - ttl_seconds)
+            ).fetchall()]
+            for job_id in expired_ids:
+                conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            conn.execute("COMMIT")
+            return len(expired_ids)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _claim_idempotency_key(self, key: str, fingerprint: str, job_id: str, ttl_seconds: float) -> Tuple[str, str]:
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND created_at < ?", (key, now - ttl_seconds))
+            conn.execute(
+                "INSERT OR IGNORE INTO idempotency_keys (key, job_id, fingerprint, created_at) VALUES (?, ?, ?, ?)",
+                (key, job_id, fingerprint, now)
+            )
+            row = conn.execute("SELECT job_id, fingerprint FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+            conn.execute("COMMIT")
+            return row[0], row[1]
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _swap_idempotency_key(self, key: str, old_job_id: str, new_job_id: str) -> bool:
+        cursor = self._connect().execute(
+            "UPDATE idempotency_keys SET job_id = ?, created_at = ? WHERE key = ? AND job_id = ?",
+            (new_job_id, time.time(), key, old_job_id)
+        )
+        return cursor.rowcount == 1
+
+    async def create_job(self, job_id: str) -> JobRecord:
+        return await self._run(self._create_job, job_id)
+
+    async def get_job(self, job_id: str) -> Optional[JobRecord]:
+        return await self._run(self._get_job, job_id)
+
+    async def set_status(self, job_id: str, status: JobStatusEnum):
+        await self._run(self._set_status, job_id, status)
+        self.notify(job_id)
+
+    async def append_event(self, job_id: str, event: ImageStreamEvent) -> Optional[int]:
+        event_id = await self._run(self._append_event, job_id, event)
+        self.notify(job_id)
+        return event_id
+
+    async def read_events(self, job_id: str, start_id: int) -> List[Tuple[int, ImageStreamEvent]]:
+        return await self._run(self._read_events, job_id, start_id)
+
+    async def delete_job(self, job_id: str):
+        await self._run(self._delete_job, job_id)
+        self.notify(job_id)
+
+    async def purge_expired_jobs(self, ttl_seconds: float) -> int:
+        return await self._run(self._purge_expired_jobs, ttl_seconds)
+
+    async def claim_idempotency_key(self, key: str, fingerprint: str, job_id: str, ttl_seconds: float) -> Tuple[str, str]:
+        return await self._run(self._claim_idempotency_key, key, fingerprint, job_id, ttl_seconds)
+
+    async def swap_idempotency_key(self, key: str, old_job_id: str, new_job_id: str) -> bool:
+        return await self._run(self._swap_idempotency_key, key, old_job_id, new_job_id)
+
+    async def close(self):
+        # 线程退出时各自的连接随 threading.local 一起释放
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+
+
+def create_job_store() -> JobStore:
+    """
+    根据 JOB_STORE 配置创建任务存储：memory（默认，单 worker）、sqlite（多 worker 共享）
+    """
+    backend = (settings.JOB_STORE or "memory").lower()
+    if backend == "memory":
+        return MemoryJobStore()
+    if backend == "sqlite":
+        store = SqliteJobStore()
+        logger.info(f"异步任务存储使用 SQLite: {store.db_path}")
+        return store
+    raise ValueError(f"不支持的 JOB_STORE: {settings.JOB_STORE}，仅支持: memory、sqlite")
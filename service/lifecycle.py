@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+from core.image_utils import preload_clothes_images, preload_image_codecs
+from core.llm import close_image_client, load_openai, warm_up_image_client
+from core.prompt_strategy import preload_prompt_tables
+from service.admission import AdmissionController, admission
+from service.batch_manager import BATCH_CLIENT_PREFIX, BatchManager, batch_manager
+from service.job_manager import job_manager
+from service.scheduler import scheduler
+from setting import settings, executor
+from utils.loop_monitor import loop_monitor
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 冷启动耗时：phase=import 为导入服务模块，phase=warm_up 为启动预热（到 GET /ready 返回 200）
+startup_gauge = metrics.gauge("journey_startup_seconds", "冷启动各阶段耗时（秒）")
+
+
+def preload_modules():
+    """
+    导入延迟加载的重型依赖（openai SDK、PIL），在线程池中执行，首个请求不会在事件循环中导入
+    """
+    load_openai()
+    preload_image_codecs()
+
+
+class ServiceLifecycle:
+    """
+    服务生命周期：启动预热、就绪状态、停机排空
+
+    - 启动：预加载服装素材和提示词表、导入 openai / PIL、预热上游连接，完成后才标记为就绪（GET /ready 返回 200）
+    - 停机：收到 SIGTERM 时（server.py 的 worker，早于 uvicorn 停止接收连接）立即标记为未就绪、停止准入、
+      暂停批量任务；uvicorn 随后等待进行中的请求（包括 SSE 流）结束，最长 timeout_graceful_shutdown；
+      lifespan 停机时再等待后台生成（异步任务、幂等请求）结束，从收到信号算起最长 SHUTDOWN_DRAIN_SECONDS，
+      超时后取消剩余任务，最后关闭上游连接池和线程池
+    - 预热完成后开始监控事件循环延迟，停机时停止（严格模式下有阻塞记录则抛出 LoopBlockedError）
+    """
+
+    # 排空期间检查进行中任务的间隔（秒）
+    DRAIN_POLL_INTERVAL = 0.2
+
+    def __init__(self, admission_controller: AdmissionController = admission, batches: BatchManager = batch_manager):
+        self.admission = admission_controller
+        self.batches = batches
+        self.ready = False
+        # 导入服务模块的耗时，由 journey_poster 在导入完成时写入
+        self.import_seconds: Optional[float] = None
+        self.warm_up_seconds: Optional[float] = None
+        # 开始停机的时间（time.monotonic），排空的截止时间从这里算起
+        self.shutdown_started_at: Optional[float] = None
+
+    async def start(self):
+        """
+        启动预热，完成后标记为就绪
+        """
+        start_time = time.perf_counter()
+        self.shutdown_started_at = None
+        self.admission.start_admitting()
+        loop = asyncio.get_running_loop()
+        modules_loaded = loop.run_in_executor(executor, preload_modules)
+        clothes_count = await loop.run_in_executor(executor, preload_clothes_images)
+        await modules_loaded
+        city_count = preload_prompt_tables()
+        upstream_ready = await warm_up_image_client()
+
+        resumed = await self.batches.resume_batches()
+        if resumed:
+            logger.info(f"已恢复 {resumed} 个未完成的批量生图任务")
+
+        # 预热期间的同步加载不计入，预热完成后才开始监控
+        if settings.LOOP_MONITOR_ENABLED:
+            loop_monitor.start(
+                interval=settings.LOOP_MONITOR_INTERVAL_SECONDS,
+                threshold_ms=settings.LOOP_BLOCK_THRESHOLD_MS,
+                strict=settings.LOOP_MONITOR_STRICT
+            )
+
+        self.ready = True
+        self.warm_up_seconds = time.perf_counter() - start_time
+        startup_gauge.set(self.warm_up_seconds, phase="warm_up")
+        if self.import_seconds is not None:
+            startup_gauge.set(self.import_seconds, phase="import")
+        logger.info(
+            f"服务预热完成: 服装素材 {clothes_count} 个, 城市场景 {city_count} 个, "
+            f"上游连接{'已预热' if upstream_ready else '未预热'}, 耗时 {self.warm_up_seconds:.2f}s"
+            f"（导入 {self.import_seconds or 0:.2f}s）"
+        )
+
+    def in_flight(self) -> int:
+        """
+        进行中的生成数：已占用或正在等待上游名额的请求 + 本 worker 内的异步任务
+        批量任务的行不计入：停机时暂停批量任务，未完成的行下次启动时从断点继续，不需要等待
+        """
+        return scheduler.count(exclude_client_prefix=BATCH_CLIENT_PREFIX) + len(job_manager.tasks)
+
+    def begin_shutdown(self):
+        """
+        开始停机：标记为未就绪、停止准入、暂停批量任务启动新的行，重复调用无影响
+        server.py 的 worker 收到 SIGTERM 时立即调用（在信号处理函数中执行，只设置标志位、不写日志）
+        """
+        if self.shutdown_started_at is None:
+            self.shutdown_started_at = time.monotonic()
+        self.ready = False
+        self.admission.stop_admitting()
+        self.batches.pause()
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        停止准入并等待进行中的生成结束，截止时间从开始停机（收到 SIGTERM）算起：
+        uvicorn 等待 SSE 等连接结束已经用掉的时间不再重复等待
+
+        Returns:
+            bool: 超时前全部结束返回 True
+        """
+        self.begin_shutdown()
+        deadline = self.shutdown_started_at + timeout
+        logger.info(
+            f"停止接收新的生图请求，等待进行中的生成结束: 进行中 {self.in_flight()} 个, "
+            f"最长等待 {max(deadline - time.monotonic(), 0):.0f}s"
+        )
+        while self.in_flight() > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(self.DRAIN_POLL_INTERVAL)
+        remaining = self.in_flight()
+        if remaining:
+            logger.warning(f"停机排空超时，仍有 {remaining} 个生成未结束")
+        return remaining == 0
+
+    async def stop(self):
+        """
+        停机：排空、取消剩余任务、关闭连接池和线程池
+        """
+        await self.drain(settings.SHUTDOWN_DRAIN_SECONDS)
+
+        cancelled_jobs = await job_manager.cancel_running_jobs()
+        stopped_batches = await self.batches.stop()
+        if cancelled_jobs or stopped_batches:
+            logger.info(f"已取消异步任务 {cancelled_jobs} 个，暂停批量任务 {stopped_batches} 个（重启后从断点继续）")
+
+        await close_image_client()
+        await job_manager.store.close()
+        await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+        logger.info("上游连接池和线程池已关闭")
+
+        loop_monitor.stop()
+
+
+# 全局生命周期管理，进程内只需要一个
+lifecycle = ServiceLifecycle()
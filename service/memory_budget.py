@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import math
+import threading
+import weakref
+from typing import List, Optional, Tuple
+from core.exceptions import ServiceBusyException
+from setting import settings
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+rejected_counter = metrics.counter("journey_memory_budget_rejected_total", "内存预算不足、等待超时被拒绝的请求数")
+waited_counter = metrics.counter("journey_memory_budget_waited_total", "内存预算不足、需要排队等待的请求数")
+spilled_counter = metrics.counter("journey_memory_spilled_total", "内存紧张时落盘保存的生成结果数")
+
+
+def estimate_upload_bytes(upload_size: int) -> int:
+    """
+    上传人像在内存中的大致占用：读取出的原始字节 + Base64 data URL（约 4/3 倍）
+    """
+    return upload_size + math.ceil(upload_size / 3) * 4
+
+
+class MemoryLease:
+    """
+    单个请求持有的内存额度
+
+    准入时通过 MemoryBudget.acquire 等待额度；之后的服装素材、生成结果等只记账不等待——
+    已经在执行的请求中途阻塞可能互相等待，超出的部分会让后续新请求排队
+    """
+
+    def __init__(self, budget: "MemoryBudget", nbytes: int):
+        self.budget = budget
+        self.nbytes = nbytes
+        self._lock = threading.Lock()
+
+    def charge(self, nbytes: int):
+        with self._lock:
+            self.nbytes += nbytes
+        self.budget.charge_bytes(nbytes)
+
+    def discharge(self, nbytes: int):
+        with self._lock:
+            nbytes = min(nbytes, self.nbytes)
+            self.nbytes -= nbytes
+        self.budget.free_bytes(nbytes)
+
+    def resize(self, nbytes: int):
+        """
+        按实际大小修正额度（准入时按估算值申请）
+        """
+        with self._lock:
+            delta = nbytes - self.nbytes
+        if delta > 0:
+            self.charge(delta)
+        elif delta < 0:
+            self.discharge(-delta)
+
+    def release(self):
+        """
+        归还全部额度，可重复调用
+        """
+        with self._lock:
+            nbytes, self.nbytes = self.nbytes, 0
+        self.budget.free_bytes(nbytes)
+
+
+class MemoryBudget:
+    """
+    进程内在途图片数据的内存预算
+
+    - 新请求读取上传内容之前按估算大小申请额度，预算不足时排队等待，超过 MEMORY_BUDGET_WAIT_SECONDS 返回 503
+    - 额度绑定到请求对象（CreatePictureRequest）上，生成结束时归还；请求对象被回收时也会自动归还，不会泄漏
+    - 用量超过 MEMORY_SPILL_RATIO 时视为内存紧张，缓存的生成结果改为落盘保存
+    """
+
+    def __init__(self, capacity: Optional[int] = None):
+        # None 表示读取配置（测试中可以修改配置）
+        self._capacity = capacity
+        self.used = 0
+        self._lock = threading.Lock()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @property
+    def capacity(self) -> int:
+        if self._capacity is not None:
+            return self._capacity
+        return settings.MEMORY_BUDGET_MB * 1024 * 1024
+
+    @property
+    def under_pressure(self) -> bool:
+        capacity = self.capacity
+        return capacity > 0 and self.used >= capacity * settings.MEMORY_SPILL_RATIO
+
+    def _try_reserve(self, nbytes: int) -> bool:
+        with self._lock:
+            capacity = self.capacity
+            # 空闲时总是放行，超过预算的单个请求也能执行
+            if capacity <= 0 or self.used == 0 or self.used + nbytes <= capacity:
+                self.used += nbytes
+                return True
+            return False
+
+    async def acquire(self, nbytes: int, timeout: Optional[float] = None) -> MemoryLease:
+        """
+        申请额度，预算不足时等待其他请求归还（timeout 为 math.inf 时一直等待）
+
+        Raises:
+            ServiceBusyException: 等待超时
+        """
+        if self._try_reserve(nbytes):
+            return MemoryLease(self, nbytes)
+
+        timeout = settings.MEMORY_BUDGET_WAIT_SECONDS if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        waited_counter.inc()
+        logger.warning(f"内存预算不足，请求排队等待: 申请 {nbytes} 字节, 已用 {self.used}/{self.capacity} 字节")
+        while True:
+            waiter = (loop, loop.create_future())
+            with self._lock:
+                self._waiters.append(waiter)
+            try:
+                # 先登记再检查，避免检查之后、等待之前归还的额度被漏掉
+                if self._try_reserve(nbytes):
+                    return MemoryLease(self, nbytes)
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    rejected_counter.inc()
+                    logger.warning(f"内存预算等待超时，拒绝请求: 申请 {nbytes} 字节, 已用 {self.used}/{self.capacity} 字节")
+                    raise ServiceBusyException(message="服务繁忙（内存不足），请稍后重试")
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter[1]), None if math.isinf(remaining) else remaining)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+    def charge_bytes(self, nbytes: int):
+        """
+        直接记账（不等待）
+        """
+        with self._lock:
+            self.used += nbytes
+
+    def free_bytes(self, nbytes: int):
+        """
+        归还额度并唤醒等待者（可能在其他线程中调用，如垃圾回收时）
+        """
+        if nbytes <= 0:
+            return
+        with self._lock:
+            self.used -= nbytes
+            waiters = list(self._waiters)
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(self._wake, future)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    @staticmethod
+    def _wake(future: asyncio.Future):
+        if not future.done():
+            future.set_result(None)
+
+    async def reserve_for(self, owner, nbytes: int, timeout: Optional[float] = None) -> MemoryLease:
+        """
+        为请求对象申请额度并绑定：之后可以通过 charge/discharge/release 按请求对象记账
+        请求对象被回收时自动归还剩余额度
+        """
+        lease = await self.acquire(nbytes, timeout)
+        owner._memory_lease = lease
+        weakref.finalize(owner, lease.release)
+        return lease
+
+    @staticmethod
+    def lease_of(owner) -> Optional[MemoryLease]:
+        return getattr(owner, "_memory_lease", None)
+
+    def charge(self, owner, nbytes: int):
+        """
+        按请求对象记账；请求没有绑定额度时直接计入总用量
+        """
+        lease = self.lease_of(owner)
+        if lease is not None:
+            lease.charge(nbytes)
+        else:
+            self.charge_bytes(nbytes)
+
+    def discharge(self, owner, nbytes: int):
+        lease = self.lease_of(owner)
+        if lease is not None:
+            lease.discharge(nbytes)
+        else:
+            self.free_bytes(nbytes)
+
+    def release(self, owner):
+        """
+        生成结束时归还请求持有的全部额度
+        """
+        lease = self.lease_of(owner)
+        if lease is not None:
+            lease.release()
+
+
+# 全局内存预算，进程内只需要一个
+memory_budget = MemoryBudget()
+
+metrics.gauge("journey_memory_budget_bytes", "在途图片数据的内存预算（字节），0 表示不限制", lambda: max(memory_budget.capacity, 0))
+metrics.gauge("journey_memory_in_use_bytes", "在途图片数据当前占用的字节数", lambda: memory_budget.used)
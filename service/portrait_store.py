@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+from core.exceptions import ResourceNotFoundException
+from setting import settings, executor
+
+logger = logging.getLogger(__name__)
+
+
+# 人像ID格式：标准化后图片 data URL 的 sha256
+PORTRAIT_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class PortraitStore:
+    """
+    人像会话存储
+
+    人像上传时完成标准化和校验，保存标准化后的 data URL 文本，后续生成直接读取，
+    不再重复上传、Base64 编码和校验。
+    以文件形式保存在 PORTRAIT_DIR 下，多个 worker 共用；文件修改时间即最近上传时间，用于判断过期。
+    过期文件在上传时顺带清理，每个进程最多每 PORTRAIT_PURGE_INTERVAL_SECONDS 扫描一次目录。
+    人像不经过 /images 对外提供访问。
+    """
+
+    def __init__(self, portrait_dir: Optional[str] = None, ttl_seconds: Optional[int] = None, purge_interval_seconds: Optional[int] = None):
+        self._portrait_dir = portrait_dir
+        self._ttl_seconds = ttl_seconds
+        self._purge_interval_seconds = purge_interval_seconds
+        # 上次清理的时间（time.monotonic），None 表示还没有清理过
+        self._last_purge_at: Optional[float] = None
+        self._purge_lock = threading.Lock()
+
+    @property
+    def portrait_dir(self) -> Path:
+        portrait_dir = self._portrait_dir or settings.PORTRAIT_DIR
+        if not portrait_dir:
+            portrait_dir = Path(__file__).parent.parent / "utils" / "pictures" / "portraits"
+        portrait_dir = Path(portrait_dir)
+        portrait_dir.mkdir(parents=True, exist_ok=True)
+        return portrait_dir
+
+    @property
+    def ttl_seconds(self) -> int:
+        return self._ttl_seconds if self._ttl_seconds is not None else settings.PORTRAIT_TTL_SECONDS
+
+    @property
+    def purge_interval_seconds(self) -> int:
+        if self._purge_interval_seconds is not None:
+            return self._purge_interval_seconds
+        return settings.PORTRAIT_PURGE_INTERVAL_SECONDS
+
+    def _save(self, data_url: str) -> str:
+        portrait_id = hashlib.sha256(data_url.encode('utf-8')).hexdigest()
+        portrait_path = self.portrait_dir / f"{portrait_id}.txt"
+        try:
+            # 同一张人像重复上传时续期
+            os.utime(portrait_path)
+        except FileNotFoundError:
+            # 不存在，或刚被其他线程 / worker 作为过期文件清理掉：重新写入
+            # 临时文件名带随机后缀，同一进程的多个线程同时上传同一张人像时各写各的临时文件
+            tmp_path = portrait_path.with_name(f".{portrait_id}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+            tmp_path.write_text(data_url, encoding='utf-8')
+            os.replace(tmp_path, portrait_path)
+        self._maybe_purge_expired()
+        return portrait_id
+
+    def _load(self, portrait_id: str) -> Optional[str]:
+        if not PORTRAIT_ID_PATTERN.match(portrait_id):
+            return None
+        portrait_path = self.portrait_dir / f"{portrait_id}.txt"
+        try:
+            if time.time() - portrait_path.stat().st_mtime > self.ttl_seconds:
+                return None
+            return portrait_path.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return None
+
+    def _maybe_purge_expired(self):
+        """
+        距离上次清理超过 PORTRAIT_PURGE_INTERVAL_SECONDS 时清理过期人像，其他线程正在清理时直接返回
+        """
+        if not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            if self._last_purge_at is not None and now - self._last_purge_at < self.purge_interval_seconds:
+                return
+            self._last_purge_at = now
+            self._purge_expired()
+        finally:
+            self._purge_lock.release()
+
+    def _purge_expired(self):
+        expire_before = time.time() - self.ttl_seconds
+        for portrait_path in self.portrait_dir.glob("*.txt"):
+            try:
+                if portrait_path.stat().st_mtime < expire_before:
+                    portrait_path.unlink()
+            except FileNotFoundError:
+                pass
+
+    async def save(self, data_url: str) -> str:
+        """
+        保存已标准化并校验通过的人像，返回人像ID
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self._save, data_url)
+
+    async def load(self, portrait_id: str) -> str:
+        """
+        读取人像 data URL
+
+        Raises:
+            ResourceNotFoundException: 人像不存在或已过期
+        """
+        loop = asyncio.get_running_loop()
+        data_url = await loop.run_in_executor(executor, self._load, portrait_id)
+        if data_url is None:
+            raise ResourceNotFoundException(message=f"人像不存在或已过期，请重新上传: {portrait_id}")
+        return data_url
+
+
+# 全局人像存储，进程内只需要一个
+portrait_store = PortraitStore()
@@ -0,0 +1,226 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List, Optional, Set
+from core.enum import PriorityEnum
+from setting import settings
+from utils.metrics import metrics
+from utils.tracing import record_stage
+
+logger = logging.getLogger(__name__)
+
+
+# 优先级从高到低，高优先级通道有排队时总是先调度
+PRIORITY_ORDER = (PriorityEnum.VIP, PriorityEnum.Retry, PriorityEnum.Normal)
+
+# 单次生图耗时的指数移动平均系数
+SERVICE_TIME_EWMA_ALPHA = 0.2
+
+
+class SchedulerTicket:
+    """
+    排队凭证，调度到时 granted 被置位
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, client_id: str, priority: PriorityEnum):
+        self.ticket_id = next(self._ids)
+        self.client_id = client_id
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self._granted = asyncio.get_running_loop().create_future()
+        # 提交时的上下文（请求ID、当前 span），调度时在该上下文中记录排队耗时
+        self.context = contextvars.copy_context()
+
+    @property
+    def granted(self) -> bool:
+        return self._granted.done()
+
+
+class GenerationScheduler:
+    """
+    进程内生图调度器，位于 DoubaoImages 调用上游之前
+
+    - 同时调用上游的数量不超过 max_workers，超出的请求排队
+    - 按优先级通道调度（VIP > Retry > Normal）
+    - 同一通道内按客户端轮转，单个客户端连续提交多次也不会挤占其他客户端
+    - 根据实际生图耗时估算排队等待时间
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, initial_service_seconds: Optional[float] = None):
+        self.max_workers = max_workers or settings.SCHEDULER_MAX_WORKERS
+        self.avg_service_seconds = initial_service_seconds or settings.SCHEDULER_INITIAL_SERVICE_SECONDS
+        # 通道 -> (客户端ID -> 该客户端的排队凭证)，OrderedDict 的顺序即轮转顺序
+        self.lanes: Dict[PriorityEnum, "OrderedDict[str, Deque[SchedulerTicket]]"] = {
+            priority: OrderedDict() for priority in PRIORITY_ORDER
+        }
+        self.running = 0
+        self.completed = 0
+        # 已调度、尚未归还名额的凭证
+        self.running_tickets: Set[SchedulerTicket] = set()
+
+    @property
+    def queue_length(self) -> int:
+        return sum(len(tickets) for lane in self.lanes.values() for tickets in lane.values())
+
+    def count(self, exclude_client_prefix: Optional[str] = None) -> int:
+        """
+        运行中和排队中的生成数，可以排除客户端ID带有指定前缀的请求（如批量任务的行）
+        """
+        if exclude_client_prefix is None:
+            return self.running + self.queue_length
+        queued = (ticket for lane in self.lanes.values() for tickets in lane.values() for ticket in tickets)
+        return sum(
+            not ticket.client_id.startswith(exclude_client_prefix)
+            for ticket in itertools.chain(self.running_tickets, queued)
+        )
+
+    def submit(self, client_id: Optional[str], priority: PriorityEnum = PriorityEnum.Normal) -> SchedulerTicket:
+        """
+        提交排队请求，有空闲名额时立即调度
+        """
+        ticket = SchedulerTicket(client_id or "anonymous", priority)
+        self.lanes[priority].setdefault(ticket.client_id, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    async def wait_for_slot(self, ticket: SchedulerTicket, timeout: Optional[float] = None) -> bool:
+        """
+        等待调度
+
+        Returns:
+            bool: 已获得执行名额返回 True，超时返回 False
+        """
+        if ticket.granted:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket._granted), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def release(self, ticket: SchedulerTicket):
+        """
+        归还名额（执行结束）或取消排队（未调度），并调度下一个请求
+        """
+        if ticket.granted:
+            if ticket.granted_at is None:
+                return
+            elapsed = time.monotonic() - ticket.granted_at
+            ticket.granted_at = None
+            self.running -= 1
+            self.running_tickets.discard(ticket)
+            self.completed += 1
+            self.avg_service_seconds += SERVICE_TIME_EWMA_ALPHA * (elapsed - self.avg_service_seconds)
+        else:
+            self._remove(ticket)
+            ticket._granted.cancel()
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, client_id: Optional[str], priority: PriorityEnum = PriorityEnum.Normal):
+        """
+        排队并占用一个执行名额（不需要推送排队进度的场景使用）
+        """
+        ticket = self.submit(client_id, priority)
+        try:
+            await self.wait_for_slot(ticket)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def position(self, ticket: SchedulerTicket) -> int:
+        """
+        排队位置（从 1 开始），已调度返回 0
+        """
+        if ticket.granted:
+            return 0
+        for position, queued in enumerate(self._dispatch_order(), start=1):
+            if queued is ticket:
+                return position
+        return 0
+
+    def estimated_wait(self, ticket: SchedulerTicket) -> float:
+        """
+        预计等待时间（秒）：排在前面的请求数 / 并发数 * 近期平均生图耗时
+        """
+        return self.estimate_wait_for_position(self.position(ticket))
+
+    def estimate_wait_for_position(self, position: int) -> float:
+        if position <= 0:
+            return 0.0
+        return round(position * self.avg_service_seconds / self.max_workers, 1)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "running": self.running,
+            "queued": self.queue_length,
+            "completed": self.completed,
+            "maxWorkers": self.max_workers,
+            "avgServiceSeconds": round(self.avg_service_seconds, 2),
+        }
+
+    def _dispatch(self):
+        while self.running < self.max_workers:
+            ticket = self._pop_next()
+            if ticket is None:
+                return
+            self.running += 1
+            self.running_tickets.add(ticket)
+            ticket.granted_at = time.monotonic()
+            ticket._granted.set_result(True)
+            ticket.context.run(record_stage, "queue_wait", ticket.granted_at - ticket.enqueued_at)
+            logger.info(
+                f"生图调度: client={ticket.client_id}, priority={ticket.priority.value}, "
+                f"排队 {ticket.granted_at - ticket.enqueued_at:.1f}s, 运行中 {self.running}/{self.max_workers}"
+            )
+
+    def _pop_next(self) -> Optional[SchedulerTicket]:
+        for priority in PRIORITY_ORDER:
+            lane = self.lanes[priority]
+            while lane:
+                client_id, tickets = lane.popitem(last=False)
+                if not tickets:
+                    continue
+                ticket = tickets.popleft()
+                # 该客户端还有排队的请求时放到轮转末尾
+                if tickets:
+                    lane[client_id] = tickets
+                return ticket
+        return None
+
+    def _remove(self, ticket: SchedulerTicket):
+        lane = self.lanes[ticket.priority]
+        tickets = lane.get(ticket.client_id)
+        if tickets is None:
+            return
+        try:
+            tickets.remove(ticket)
+        except ValueError:
+            return
+        if not tickets:
+            del lane[ticket.client_id]
+
+    def _dispatch_order(self) -> List[SchedulerTicket]:
+        """
+        按当前队列模拟后续的调度顺序
+        """
+        order = []
+        for priority in PRIORITY_ORDER:
+            queues = [list(tickets) for tickets in self.lanes[priority].values()]
+            for round_tickets in itertools.zip_longest(*queues):
+                order.extend(ticket for ticket in round_tickets if ticket is not None)
+        return order
+
+
+# 全局调度器，进程内只需要一个
+scheduler = GenerationScheduler()
+
+metrics.gauge("journey_scheduler_running", "正在调用上游的生成数", lambda: scheduler.running)
+metrics.gauge("journey_scheduler_queued", "排队等待上游名额的生成数", lambda: scheduler.queue_length)
@@ -2,9 +2,14 @@ import os
 import logging
 from pydantic_settings import BaseSettings
 from typing import Optional, List
-from utils.logger import setup_logging
-from concurrent.futures import ThreadPoolExecutor
+from utils.logger import register_secret, setup_logging
+from utils.tracing import setup_tracing
+from utils.flight_recorder import flight_recorder
+from utils.memory_tracker import memory_tracker
+from concurrent.futures import Executor, ThreadPoolExecutor
+import contextvars
 import logging
+import threading
 
 ENV = os.getenv("ENV", "dev")
 
@@ -18,7 +23,96 @@ class Settings(BaseSettings):
     CLOTHES_DIR: Optional[str] = None
     SAVED_DIR: Optional[str] = None
 
+    # 流式预览缩略图配置
+    PREVIEW_MAX_SIZE: int = 256  # 缩略图最长边（px）
+    PREVIEW_QUALITY: int = 70    # 缩略图 JPEG 质量
+
+    # 生成图片访问地址前缀（delivery=Url 时返回 {IMAGE_URL_PREFIX}/{文件名}），可配置为 CDN 域名
+    IMAGE_URL_PREFIX: str = "/images"
+
+    # 异步生图任务配置
+    JOB_TTL_SECONDS: int = 3600       # 任务结束后保留多久（供断线重连回放）
+    SSE_HEARTBEAT_SECONDS: int = 15   # 等待新事件时发送心跳的间隔，防止代理断开空闲连接
+    JOB_STORE: str = "memory"         # 任务存储：memory（单 worker）| sqlite（多 worker 共享，WAL 模式）
+    JOB_STORE_PATH: Optional[str] = None      # SQLite 数据库文件路径，默认 utils/pictures/jobs.sqlite3
+    JOB_STORE_POLL_INTERVAL: float = 0.2      # 跨 worker 订阅事件时的轮询间隔（秒）
+    JOB_STORE_THREADS: int = 2                # SQLite 任务存储专用的线程数，与生图共享线程池隔离
+    IDEMPOTENCY_TTL_SECONDS: int = 3600       # Idempotency-Key 的有效期：期间重复提交接入同一次生成或回放结果
+
+    # 生图调度配置
+    SCHEDULER_MAX_WORKERS: int = 4                  # 同时调用上游生图的最大数量
+    SCHEDULER_INITIAL_SERVICE_SECONDS: float = 60.0 # 还没有实际耗时数据时假定的单次生图耗时
+    SCHEDULER_QUEUE_EVENT_INTERVAL: float = 2.0     # 排队时推送 queued 事件的间隔（秒）
+    VIP_TOKEN: Optional[str] = None                 # 贵宾通道令牌（请求头 X-VIP-Token），未配置时不开放贵宾通道
+
+    # 人像会话配置：上传一次人像，多次生成不同城市
+    PORTRAIT_DIR: Optional[str] = None        # 人像保存目录，默认 utils/pictures/portraits
+    PORTRAIT_TTL_SECONDS: int = 1800          # 人像有效期（秒），重复上传同一张会续期
+    PORTRAIT_PURGE_INTERVAL_SECONDS: int = 60  # 上传人像时清理过期人像的最短间隔（秒），清理需要扫描整个目录
+    PORTRAIT_MAX_SIZE: int = 2048             # 标准化后人像最长边（px）
+    PORTRAIT_QUALITY: int = 90                # 标准化后人像 JPEG 质量
+
+    # 批量生图配置
+    BATCH_DIR: Optional[str] = None           # 批量任务目录（压缩包、断点），默认 utils/pictures/batches
+    BATCH_CONCURRENCY: int = 2                # 单个批量任务同时处理的行数
+    BATCH_MAX_ROWS: int = 500                 # 单个批量任务最多行数
+
+    # 入口限流配置：预计排队时间超过该值时直接拒绝新请求（不读取上传内容），<=0 表示不限流
+    ADMISSION_MAX_WAIT_SECONDS: float = 180.0
+
+    # 内存预算：进程内在途图片数据（上传人像、服装素材、生成结果）的总字节数上限，<=0 表示不限制（仍然统计）
+    MEMORY_BUDGET_MB: int = 1024
+    MEMORY_BUDGET_WAIT_SECONDS: float = 30.0  # 预算不足时新请求最多等待多久，超时返回 503
+    MEMORY_SPILL_RATIO: float = 0.8           # 用量超过预算的该比例时，缓存的生成结果改为落盘保存
+
+    # 上游生图客户端连接池配置（进程内共享一个客户端，启动时预热连接）
+    UPSTREAM_MAX_CONNECTIONS: int = 20        # 连接池最大连接数
+    UPSTREAM_TIMEOUT_SECONDS: float = 120.0   # 单次生图请求超时（图片生成可能需要较长时间）
+
+    # 停机排空配置：停止准入后等待进行中的生成结束，超时后取消剩余任务
+    SHUTDOWN_DRAIN_SECONDS: float = 60.0
+    SHUTDOWN_RETRY_AFTER_SECONDS: int = 10    # 排空期间拒绝新请求时建议的重试等待秒数
+
     LOG_LEVEL: str = "INFO" # "DEBUG" | "INFO"
+    LOG_FORMAT: str = "text"              # 控制台日志格式："text" | "json"（文件日志固定为 JSON）
+    LOG_QUEUE_SIZE: int = 10000           # 日志队列长度，写入跟不上时丢弃新日志（计入 journey_log_dropped_total）
+    LOG_RATE_LIMIT_PER_SECOND: int = 5    # 逐事件日志（如上游流式事件）每个分组每秒最多输出条数，<=0 表示不限流
+
+    # 链路追踪：各阶段 span 以 OTLP JSON 格式（每行一批）追加写入本地文件，可导入 Jaeger / OTel Collector
+    TRACE_ENABLED: bool = True
+    TRACE_EXPORT_PATH: str = "logs/traces.jsonl"
+
+    # 慢请求记录（GET /debug/slow）：保留时间窗口内最慢的 N 个请求的时间线
+    FLIGHT_RECORDER_SIZE: int = 50
+    FLIGHT_RECORDER_WINDOW_SECONDS: int = 3600
+    DEBUG_TOKEN: Optional[str] = None     # 调试接口的访问令牌，未配置时调试接口不可用
+
+    # 事件循环监控（GET /debug/loop）：持续记录调度延迟，阻塞超过阈值时抓取调用栈
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_MONITOR_INTERVAL_SECONDS: float = 0.05
+    LOOP_BLOCK_THRESHOLD_MS: float = 100
+    LOOP_MONITOR_STRICT: bool = False     # 严格模式（CI 使用）：停机时发现阻塞记录则报错
+
+    # 按需分析（/debug/profile/*）：单次 CPU 采样的最长时间
+    PROFILE_MAX_SECONDS: int = 60
+    # 请求内存统计：记录每个请求的内存峰值和结束时未释放的内存（日志 + 指标），依赖 tracemalloc，有额外 CPU 开销
+    REQUEST_MEMORY_TRACKING: bool = False
+
+    # 生产多 worker 启动（python server.py）：主进程预加载后 fork 出 worker，共享同一个监听端口
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8123
+    SERVER_WORKERS: int = 4
+    SERVER_BACKLOG: int = 2048
+    WORKER_MAX_REQUESTS: int = 10000      # 单个 worker 处理的请求数达到上限后优雅退出并重新拉起，<=0 表示不限制
+    WORKER_MAX_REQUESTS_JITTER: int = 1000  # 上限额外加上 0~N 的随机数，避免所有 worker 同时重启
+    WORKER_MAX_RSS_MB: int = 2048         # worker 常驻内存超过该值时优雅退出并重新拉起，<=0 表示不限制
+    WORKER_RSS_CHECK_SECONDS: float = 5.0
+    # HTTP/2（需要安装 hypercorn）：多个流式请求复用一个连接，不受浏览器每个域名约 6 个 HTTP/1.1 连接的限制
+    # 未配置证书时为明文 h2c（本地测试，支持 prior knowledge 和 Upgrade），配置证书时通过 ALPN 协商 h2
+    SERVER_HTTP2: bool = False
+    SERVER_CERTFILE: Optional[str] = None
+    SERVER_KEYFILE: Optional[str] = None
+    HTTP2_MAX_CONCURRENT_STREAMS: int = 100  # 单个连接上同时进行的流（请求）数上限
 
     class Config:
         if ENV.lower() in ['test','TEST','sit','SIT']:
@@ -34,13 +128,77 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
+class SharedExecutor(Executor):
+    """
+    全局线程池：首次提交任务时创建，shutdown 之后再次提交会重新创建
+    服务停机时关闭线程池，同一进程内再次启动应用（如测试）仍然可以使用
+    任务在提交时的 contextvars 上下文中执行，线程池中的日志同样带有请求ID
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = "journey"):
+        self._max_workers = max_workers
+        self._thread_name_prefix = thread_name_prefix
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix=self._thread_name_prefix)
+            pool = self._pool
+        return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
 # 创建线程池执行器，全局只需要一个
-executor = ThreadPoolExecutor(max_workers=5)
+executor = SharedExecutor(max_workers=5)
+
+_runtime_lock = threading.Lock()
+_runtime_initialized = False
+
+
+def init_runtime(force: bool = False, log_file: str = "app.log") -> bool:
+    """
+    初始化进程级运行环境：日志（会创建 logs/ 目录）、密钥脱敏、追踪导出、慢请求记录、请求内存统计
+
+    导入本模块只读取配置、不产生副作用；由服务入口（journey_poster）显式调用一次，
+    重复调用直接返回，force=True 时按当前 settings 重新配置（日志只初始化一次）
+    log_file 为 logs/ 下的日志文件名，server.py 的每个 worker 使用自己的文件
 
-setup_logging(settings.LOG_LEVEL)
-logger = logging.getLogger(__name__)
-logger.info(f"当前环境ENV 变量->>>>>>>> {ENV} <<<<<<")
+    Returns:
+        bool: 本次调用执行了初始化返回 True
+    """
+    global _runtime_initialized
+    with _runtime_lock:
+        if _runtime_initialized and not force:
+            return False
+        first = not _runtime_initialized
+        # 密钥原文不会出现在日志中
+        register_secret(settings.LLM_API_KEY)
+        register_secret(os.getenv("OPENAI_API_KEY"))
+        register_secret(settings.DEBUG_TOKEN)
+        register_secret(settings.VIP_TOKEN)
+        setup_logging(
+            settings.LOG_LEVEL,
+            log_format=settings.LOG_FORMAT,
+            queue_size=settings.LOG_QUEUE_SIZE,
+            rate_limit_per_second=settings.LOG_RATE_LIMIT_PER_SECOND,
+            log_file=log_file
+        )
+        setup_tracing(settings.TRACE_ENABLED, settings.TRACE_EXPORT_PATH)
+        flight_recorder.configure(settings.FLIGHT_RECORDER_SIZE, settings.FLIGHT_RECORDER_WINDOW_SECONDS)
+        memory_tracker.configure(settings.REQUEST_MEMORY_TRACKING)
+        _runtime_initialized = True
 
-logger.info(f"LLM_URL: {settings.LLM_URL}")
-logger.info(f"CLOTHES_DIR: {settings.CLOTHES_DIR}")
-# raise
\ No newline at end of file
+    if not first:
+        return True
+    logger = logging.getLogger(__name__)
+    logger.info(f"当前环境ENV 变量->>>>>>>> {ENV} <<<<<<")
+    logger.info(f"LLM_URL: {settings.LLM_URL}")
+    logger.info(f"CLOTHES_DIR: {settings.CLOTHES_DIR}")
+    return True
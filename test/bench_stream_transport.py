@@ -0,0 +1,55 @@
+"""
+流式传输格式基准测试：SSE（Base64-in-JSON） vs 二进制帧
+对比每张图片的传输字节数和服务端序列化 CPU 耗时
+
+运行方式：
+    python test/bench_stream_transport.py [图片原始字节数] [迭代次数]
+"""
+import base64
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from model.createPictureResp import ImageStreamEvent, StreamStatusEnum
+
+
+def bench(name: str, encode, iterations: int) -> tuple:
+    """返回 (每张图片传输字节数, 每张图片 CPU 毫秒)"""
+    wire_bytes = len(encode())
+    start = time.process_time()
+    for _ in range(iterations):
+        encode()
+    cpu_ms = (time.process_time() - start) * 1000 / iterations
+    print(f"{name:<12} 传输字节: {wire_bytes:>10,}  CPU: {cpu_ms:>7.2f} ms/张")
+    return wire_bytes, cpu_ms
+
+
+def main():
+    # 豆包 2K 输出的 PNG 约 1.35MB，Base64 后约 1.8MB；随机字节模拟不可压缩的图片数据
+    raw_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_350_000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    base64_image = "data:image/png;base64," + base64.b64encode(os.urandom(raw_size)).decode("utf-8")
+
+    def make_event() -> ImageStreamEvent:
+        # 事件构造也计入耗时，与接口中的实际路径一致
+        return ImageStreamEvent(
+            status=StreamStatusEnum.Generating,
+            index=0,
+            base64=base64_image,
+            message="success"
+        )
+
+    print(f"图片原始大小: {raw_size:,} 字节，迭代 {iterations} 次")
+    # StreamingResponse 会把 str 编码为 UTF-8 后再发送
+    sse_bytes, sse_cpu = bench("SSE", lambda: make_event().to_event_data().encode("utf-8"), iterations)
+    bin_bytes, bin_cpu = bench("Binary", lambda: make_event().to_binary_frame(), iterations)
+
+    print(f"二进制帧传输量为 SSE 的 {bin_bytes / sse_bytes:.1%}，CPU 耗时为 SSE 的 {bin_cpu / sse_cpu:.1%}")
+
+
+if __name__ == "__main__":
+    main()
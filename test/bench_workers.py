@@ -0,0 +1,212 @@
+"""
+多 worker 吞吐基准测试：单 worker 入口（python journey_poster.py 的 uvicorn.run） vs 预加载多 worker 入口（python server.py）
+对比 /createPictureStream 的每秒完成请求数、延迟，以及各 worker 的内存占用（PSS / 私有内存）
+
+上游是本地的假生图服务（每个请求立即返回 4 张约 1.8MB 的 Base64 图片），测的是本服务自身的处理能力：
+接收上传、人像校验、拼接 data URL、解析上游流、SSE 编码与写出
+
+运行方式：
+    python test/bench_workers.py [worker 数] [并发数] [每种模式的压测秒数]
+"""
+import asyncio
+import base64
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+REQUEST_DATA = json.dumps({"city": "Paris", "gender": "Male", "mode": "Master", "master_mode_tags": {"style": "FutureTech"}})
+
+SINGLE_WORKER_CODE = (
+    "import uvicorn; "
+    "uvicorn.run('journey_poster:app', host='127.0.0.1', port={port}, reload=False, log_level='warning')"
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_fake_upstream(port: int):
+    """
+    假的豆包生图接口：POST /images/generations 以 SSE 返回 4 张图片
+    """
+    import uvicorn
+
+    images = [base64.b64encode(os.urandom(1_350_000 + index)).decode("utf-8") for index in range(4)]
+    events = [
+        {"type": "image_generation.partial_succeeded", "image_index": index, "b64_json": image}
+        for index, image in enumerate(images)
+    ]
+    events.append({"type": "image_generation.completed", "usage": {"generated_images": 4}})
+    body = [f"data: {json.dumps(event)}\n\n".encode("utf-8") for event in events] + [b"data: [DONE]\n\n"]
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        more_body = True
+        while more_body:
+            more_body = (await receive()).get("more_body", False)
+        if scope["path"].endswith("/images/generations"):
+            await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+            for chunk in body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        else:
+            await send({"type": "http.response.start", "status": 404, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def wait_ready(port: int, timeout: float = 30.0):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/ready", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"服务未在 {timeout}s 内就绪: port={port}")
+
+
+def memory_of(pid: int) -> dict:
+    """
+    进程的 RSS / PSS / 私有内存（KB），读取 /proc/<pid>/smaps_rollup
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:", "Private_Clean:", "Private_Dirty:"):
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return {"rss": values["Rss"], "pss": values["Pss"], "private": values["Private_Clean"] + values["Private_Dirty"]}
+
+
+def worker_pids(pid: int) -> list:
+    children = Path(f"/proc/{pid}/task/{pid}/children").read_text().split()
+    return [int(child) for child in children] or [pid]
+
+
+async def load(port: int, concurrency: int, seconds: float) -> dict:
+    import httpx
+
+    image = INPUT_IMAGE.read_bytes()
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def user(client: httpx.AsyncClient):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                async with client.stream(
+                    "POST", "/createPictureStream",
+                    files={"file": (INPUT_IMAGE.name, image, "image/jpeg")},
+                    data={"data": REQUEST_DATA}
+                ) as response:
+                    async for _ in response.aiter_raw():
+                        pass
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120.0) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(user(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    pick = lambda q: latencies[min(int(len(latencies) * q), len(latencies) - 1)] if latencies else float("nan")
+    return {"rps": len(latencies) / elapsed, "p50": pick(0.5), "p95": pick(0.95), "errors": errors}
+
+
+def bench(name: str, command: list, env: dict, port: int, concurrency: int, seconds: float):
+    process = subprocess.Popen(command, cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        pids = worker_pids(process.pid)
+        idle = [memory_of(pid) for pid in pids]
+        asyncio.run(load(port, concurrency, 2.0))  # 预热
+        result = asyncio.run(load(port, concurrency, seconds))
+        loaded = [memory_of(pid) for pid in pids]
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
+
+    total = lambda items, key: sum(item[key] for item in items) / 1024
+    print(
+        f"{name:<14} {result['rps']:>6.2f} req/s  p50 {result['p50'] * 1000:>6.0f}ms  p95 {result['p95'] * 1000:>6.0f}ms  "
+        f"失败 {result['errors']}"
+    )
+    print(
+        f"{'':<14} worker {len(pids)} 个，内存合计（MB）: 空闲 RSS {total(idle, 'rss'):.0f} / PSS {total(idle, 'pss'):.0f} / "
+        f"私有 {total(idle, 'private'):.0f}，压测后 RSS {total(loaded, 'rss'):.0f} / PSS {total(loaded, 'pss'):.0f} / "
+        f"私有 {total(loaded, 'private'):.0f}"
+    )
+    return result
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--upstream":
+        run_fake_upstream(int(sys.argv[2]))
+        return
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 20.0
+
+    upstream_port = free_port()
+    upstream = subprocess.Popen([sys.executable, __file__, "--upstream", str(upstream_port)])
+    env = dict(
+        os.environ,
+        LLM_URL=f"http://127.0.0.1:{upstream_port}",
+        LLM_API_KEY="bench",
+        LLM_SCENE_ID="bench",
+        LOG_LEVEL="WARNING",
+        TRACE_ENABLED="false",
+        SCHEDULER_MAX_WORKERS="1000",
+        ADMISSION_MAX_WAIT_SECONDS="0",
+        SHUTDOWN_DRAIN_SECONDS="5",
+    )
+    print(f"CPU {os.cpu_count()} 核, 并发 {concurrency}, 每种模式压测 {seconds:.0f}s")
+    try:
+        port = free_port()
+        single = bench(
+            "单 worker", [sys.executable, "-c", SINGLE_WORKER_CODE.format(port=port)],
+            env, port, concurrency, seconds
+        )
+        port = free_port()
+        prefork = bench(
+            f"server.py x{workers}", [sys.executable, "server.py"],
+            dict(env, SERVER_HOST="127.0.0.1", SERVER_PORT=str(port), SERVER_WORKERS=str(workers)),
+            port, concurrency, seconds
+        )
+    finally:
+        upstream.terminate()
+        upstream.wait()
+    print(f"多 worker 吞吐为单 worker 的 {prefork['rps'] / single['rps']:.2f} 倍")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+测试生图入口准入控制：预计排队时间超限时在读取上传内容之前返回 503 + Retry-After
+"""
+import asyncio
+import json
+import os
+import struct
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from fastapi.testclient import TestClient
+
+from journey_poster import app
+from service.admission import admission, admitted_counter, shed_counter
+from service.batch_manager import batch_manager
+from service.generation_Image import DoubaoImages
+from service.scheduler import GenerationScheduler
+from setting import settings
+
+# 不是合法的 multipart 内容：一旦被读取解析就会返回 4xx，而不是 503
+GARBAGE_BODY = b"x" * 1024 * 1024
+GARBAGE_HEADERS = {"Content-Type": "multipart/form-data; boundary=never-parsed"}
+
+
+def build_busy_scheduler(queued: int) -> GenerationScheduler:
+    """2 个名额全部占满，另有 queued 个请求在排队，平均生图耗时 60 秒"""
+    async def fill():
+        busy = GenerationScheduler(max_workers=2, initial_service_seconds=60)
+        for i in range(2 + queued):
+            busy.submit(f"client-{i}")
+        return busy
+
+    return asyncio.run(fill())
+
+
+def test_shed_before_reading_body(monkeypatch):
+    async def must_not_be_called(*args, **kwargs):
+        raise AssertionError("被拒绝的请求不应解析上传内容")
+
+    monkeypatch.setattr(DoubaoImages, "validate_input_data", must_not_be_called)
+    monkeypatch.setattr(batch_manager, "create_batch", must_not_be_called)
+    # 新请求排第 6 位：6 * 60 / 2 = 180s，阈值 100s，约 80s 后重试
+    monkeypatch.setattr(admission, "scheduler", build_busy_scheduler(queued=5))
+    monkeypatch.setattr(settings, "ADMISSION_MAX_WAIT_SECONDS", 100.0)
+
+    shed_before = shed_counter.get(endpoint="/createPicture")
+    with TestClient(app) as client:
+        response = client.post("/createPicture", content=GARBAGE_BODY, headers=GARBAGE_HEADERS)
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "80"
+        assert response.json()["data"] == {"retryAfter": 80}
+
+        response = client.post("/createPictureStream", content=GARBAGE_BODY, headers=GARBAGE_HEADERS)
+        assert response.status_code == 503
+        assert response.headers["content-type"].startswith("text/event-stream")
+        event = json.loads(response.text[len("data: "):])
+        assert event["status"] == "failed"
+        assert event["retryAfter"] == 80
+
+        response = client.post("/createPictureStreamBinary", content=GARBAGE_BODY, headers=GARBAGE_HEADERS)
+        assert response.status_code == 503
+        (meta_length,) = struct.unpack(">I", response.content[:4])
+        assert json.loads(response.content[4:4 + meta_length])["retryAfter"] == 80
+
+        # 创建异步任务和批量任务同样是生图入口
+        for path in ("/jobs", "/batches"):
+            response = client.post(path, content=GARBAGE_BODY, headers=GARBAGE_HEADERS)
+            assert response.status_code == 503
+            assert response.json()["data"] == {"retryAfter": 80}
+
+        exported = client.get("/metrics").text
+
+    assert shed_counter.get(endpoint="/createPicture") == shed_before + 1
+    assert 'journey_admission_shed_total{endpoint="/createPictureStream"}' in exported
+
+
+def test_admitted_when_wait_within_slo(monkeypatch):
+    # 新请求排第 1 位：1 * 60 / 2 = 30s，阈值 100s，正常准入后由路由解析上传内容
+    monkeypatch.setattr(admission, "scheduler", build_busy_scheduler(queued=0))
+    monkeypatch.setattr(settings, "ADMISSION_MAX_WAIT_SECONDS", 100.0)
+
+    admitted_before = admitted_counter.get(endpoint="/createPicture")
+    with TestClient(app) as client:
+        response = client.post("/createPicture", content=GARBAGE_BODY, headers=GARBAGE_HEADERS)
+
+    assert response.status_code != 503
+    assert "retry-after" not in response.headers
+    assert admitted_counter.get(endpoint="/createPicture") == admitted_before + 1
+
+
+def test_shed_response_carries_cors_headers(monkeypatch):
+    # 跨域的浏览器前端需要 CORS 头才能读到 503 和 Retry-After，否则只能看到网络错误
+    monkeypatch.setattr(admission, "scheduler", build_busy_scheduler(queued=5))
+    monkeypatch.setattr(settings, "ADMISSION_MAX_WAIT_SECONDS", 100.0)
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/createPicture",
+            content=GARBAGE_BODY,
+            headers={**GARBAGE_HEADERS, "Origin": "https://poster.example.com"}
+        )
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "80"
+    assert response.headers["access-control-allow-origin"] in ("*", "https://poster.example.com")
+    assert "retry-after" in response.headers["access-control-expose-headers"].lower()
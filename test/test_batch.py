@@ -0,0 +1,317 @@
+"""
+测试批量生图任务：zip + manifest 上传、断点续跑、结果压缩包流式下载
+使用假的上游生成器，不调用真实的豆包接口
+"""
+import asyncio
+import base64
+import csv
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import pytest
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+
+from core.exceptions import ParamException
+from core.image_utils import MAX_INPUT_IMAGE_BYTES
+from journey_poster import app
+from model.batchResp import BatchStatusEnum
+from service.admission import AdmissionController
+from service import batch_manager as batch_manager_module
+from service.batch_manager import BatchJob, BatchManager
+from service.generation_Image import DoubaoImages
+from service.lifecycle import ServiceLifecycle
+from setting import settings
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+DEFAULTS = json.dumps({"gender": "Male", "mode": "Master", "master_mode_tags": {"style": "FutureTech"}})
+
+MANIFEST = [
+    {"file": "photos/alice.jpeg", "name": "alice", "city": "Paris"},
+    {"file": "photos/bob.jpeg", "city": "Tokyo"},
+    {"file": "photos/carol.jpeg", "name": "carol", "city": "London"},
+]
+
+
+def build_zip() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("manifest.json", json.dumps(MANIFEST))
+        for row in MANIFEST:
+            archive.writestr(row["file"], INPUT_IMAGE.read_bytes())
+    return buffer.getvalue()
+
+
+def fake_image_bytes(prompt: str, index: int) -> bytes:
+    return f"{prompt[-40:]}-{index}".encode("utf-8")
+
+
+def use_tmp_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_DIR", str(tmp_path / "batches"))
+    monkeypatch.setattr(settings, "SAVED_DIR", str(tmp_path / "saved"))
+    monkeypatch.setattr("core.prompt_strategy.PromptStrategy._get_city_scene_description", lambda self, city: f"city={city.value}")
+
+
+def test_batch_end_to_end(tmp_path, monkeypatch):
+    use_tmp_dirs(tmp_path, monkeypatch)
+
+    async def fake_seed_ream(self, input_image_list, prompt):
+        if "city=Tokyo" in prompt:
+            raise RuntimeError("Tokyo upstream error")
+        for index in range(4):
+            yield "data:image/png;base64," + base64.b64encode(fake_image_bytes(prompt, index)).decode("utf-8")
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/batches",
+            files={"file": ("department.zip", build_zip(), "application/zip")},
+            data={"data": DEFAULTS}
+        )
+        assert response.status_code == 202
+        batch_id = response.json()["data"]["batchId"]
+
+        for _ in range(100):
+            info = client.get(f"/batches/{batch_id}").json()["data"]
+            if info["status"] == "completed":
+                break
+            time.sleep(0.05)
+        assert info["total"] == 3
+        assert info["completed"] == 2
+        assert info["failed"] == 1
+        assert "Tokyo upstream error" in info["message"]
+
+        response = client.get(f"/batches/{batch_id}/result.zip")
+        assert response.headers["content-type"] == "application/zip"
+
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        names = archive.namelist()
+        assert sorted(names) == sorted(
+            [f"0001_alice/Paris_{i}.png" for i in range(4)]
+            + [f"0003_carol/London_{i}.png" for i in range(4)]
+            + ["results.csv"]
+        )
+        assert archive.read("0001_alice/Paris_2.png").endswith(b"-2")
+        rows = list(csv.DictReader(io.StringIO(archive.read("results.csv").decode("utf-8-sig"))))
+    assert [(row["name"], row["status"]) for row in rows] == [
+        ("0001_alice", "completed"), ("0002_bob", "failed"), ("0003_carol", "completed")
+    ]
+
+
+def test_invalid_manifest_is_rejected(tmp_path, monkeypatch):
+    use_tmp_dirs(tmp_path, monkeypatch)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("manifest.json", json.dumps([{"file": "missing.jpeg", "city": "Paris"}]))
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/batches",
+            files={"file": ("department.zip", buffer.getvalue(), "application/zip")},
+            data={"data": DEFAULTS}
+        )
+
+    assert response.status_code == 400
+    assert "missing.jpeg" in response.json()["message"]
+    assert list((tmp_path / "batches").iterdir()) == []
+
+
+def test_oversized_portrait_is_rejected_before_reading(tmp_path, monkeypatch):
+    # 高压缩比的条目（zip 炸弹）：解压后超过图片大小上限，不会在内存预算登记之前整体解压
+    use_tmp_dirs(tmp_path, monkeypatch)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("manifest.json", json.dumps([{"file": "photos/bomb.jpeg", "city": "Paris"}]))
+        archive.writestr("photos/bomb.jpeg", b"\0" * (MAX_INPUT_IMAGE_BYTES + 1))
+    assert len(buffer.getvalue()) < 100 * 1024
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/batches",
+            files={"file": ("department.zip", buffer.getvalue(), "application/zip")},
+            data={"data": DEFAULTS}
+        )
+
+    assert response.status_code == 400
+    assert "photos/bomb.jpeg" in response.json()["message"]
+    assert list((tmp_path / "batches").iterdir()) == []
+
+
+def test_read_portrait_rechecks_size(tmp_path, monkeypatch):
+    use_tmp_dirs(tmp_path, monkeypatch)
+
+    async def create() -> BatchJob:
+        manager = BatchManager()
+        manager.pause()
+        upload = UploadFile(file=io.BytesIO(build_zip()), filename="department.zip")
+        batch = await manager.create_batch(upload, DEFAULTS)
+        await asyncio.wait_for(batch.task, 5)
+        return batch
+
+    batch = asyncio.run(create())
+    assert batch.read_portrait(MANIFEST[0]["file"]) == INPUT_IMAGE.read_bytes()
+
+    # 读取时再次按大小上限检查（断点续跑时读取的是磁盘上保存的压缩包）
+    monkeypatch.setattr(batch_manager_module, "MAX_INPUT_IMAGE_BYTES", 1024)
+    with pytest.raises(ParamException):
+        batch.read_portrait(MANIFEST[0]["file"])
+
+
+def test_restart_resumes_from_checkpoint(tmp_path, monkeypatch):
+    use_tmp_dirs(tmp_path, monkeypatch)
+    monkeypatch.setattr(settings, "BATCH_CONCURRENCY", 1)
+    upstream_calls = []
+    crash = None
+
+    async def fake_seed_ream(self, input_image_list, prompt):
+        upstream_calls.append(prompt)
+        if crash is not None and "city=London" in prompt:
+            # 第三行处理到一半时“进程退出”
+            crash.set()
+            await asyncio.sleep(3600)
+        for index in range(4):
+            yield "data:image/png;base64," + base64.b64encode(fake_image_bytes(prompt, index)).decode("utf-8")
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+
+    async def first_run() -> str:
+        nonlocal crash
+        crash = asyncio.Event()
+        manager = BatchManager()
+        upload = UploadFile(file=io.BytesIO(build_zip()), filename="department.zip")
+        batch = await manager.create_batch(upload, DEFAULTS)
+        await asyncio.wait_for(crash.wait(), 5)
+        batch.task.cancel()
+        await asyncio.gather(batch.task, return_exceptions=True)
+        return batch.batch_id
+
+    async def second_run(batch_id: str):
+        nonlocal crash
+        crash = None
+        manager = BatchManager()
+        assert await manager.resume_batches() == 1
+        await asyncio.wait_for(manager.batches[batch_id].task, 5)
+        return manager.get_batch(batch_id).to_info()
+
+    batch_id = asyncio.run(first_run())
+    assert len(upstream_calls) == 3
+    info = asyncio.run(second_run(batch_id))
+
+    # 重启后只重新处理未记录断点的第三行
+    assert len(upstream_calls) == 4
+    assert "city=London" in upstream_calls[-1]
+    assert info.status == BatchStatusEnum.Completed
+    assert info.completed == 3
+
+
+def test_paused_batch_keeps_running_status_and_resumes(tmp_path, monkeypatch):
+    use_tmp_dirs(tmp_path, monkeypatch)
+    monkeypatch.setattr(settings, "BATCH_CONCURRENCY", 1)
+    first_row_started = None
+    release_first_row = None
+
+    async def fake_seed_ream(self, input_image_list, prompt):
+        if release_first_row is not None:
+            first_row_started.set()
+            await release_first_row.wait()
+        for index in range(4):
+            yield "data:image/png;base64," + base64.b64encode(fake_image_bytes(prompt, index)).decode("utf-8")
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+
+    async def first_run() -> str:
+        nonlocal first_row_started, release_first_row
+        first_row_started = asyncio.Event()
+        release_first_row = asyncio.Event()
+        manager = BatchManager()
+        upload = UploadFile(file=io.BytesIO(build_zip()), filename="department.zip")
+        batch = await manager.create_batch(upload, DEFAULTS)
+        await asyncio.wait_for(first_row_started.wait(), 5)
+        # 停机：进行中的行继续完成，不再开始新的行
+        manager.pause()
+        release_first_row.set()
+        await asyncio.wait_for(batch.task, 5)
+        return batch.batch_id
+
+    async def second_run(batch_id: str):
+        nonlocal release_first_row
+        release_first_row = None
+        manager = BatchManager()
+        assert await manager.resume_batches() == 1
+        await asyncio.wait_for(manager.batches[batch_id].task, 5)
+        return manager.get_batch(batch_id).to_info()
+
+    batch_id = asyncio.run(first_run())
+    info = BatchManager().get_batch(batch_id).to_info()
+    assert info.status == BatchStatusEnum.Running
+    assert info.completed == 1
+
+    info = asyncio.run(second_run(batch_id))
+    assert info.status == BatchStatusEnum.Completed
+    assert info.completed == 3
+
+
+def test_only_one_worker_resumes_a_batch(tmp_path, monkeypatch):
+    # 两个 worker（两个生命周期、各自的批量任务管理器）共用同一个 BATCH_DIR
+    use_tmp_dirs(tmp_path, monkeypatch)
+    monkeypatch.setattr(settings, "BATCH_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "LOOP_MONITOR_ENABLED", False)
+    upstream_calls = []
+    release_rows = None
+
+    async def fake_seed_ream(self, input_image_list, prompt):
+        upstream_calls.append(prompt)
+        await release_rows.wait()
+        for index in range(4):
+            yield "data:image/png;base64," + base64.b64encode(fake_image_bytes(prompt, index)).decode("utf-8")
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+
+    async def run():
+        nonlocal release_rows
+        release_rows = asyncio.Event()
+        # 上次停机时暂停、未开始任何一行的批次
+        manager = BatchManager()
+        upload = UploadFile(file=io.BytesIO(build_zip()), filename="department.zip")
+        batch = await manager.create_batch(upload, DEFAULTS)
+        manager.pause()
+        await asyncio.wait_for(batch.task, 5)
+        assert upstream_calls == []
+
+        first = ServiceLifecycle(AdmissionController(), batches=BatchManager())
+        second = ServiceLifecycle(AdmissionController(), batches=BatchManager())
+        await first.start()
+        await second.start()
+        assert list(first.batches.batches) == [batch.batch_id]
+        assert second.batches.batches == {}
+        while not upstream_calls:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        assert len(upstream_calls) == 1
+
+        # 执行批次的 worker 退出后，重新拉起的 worker 可以接手
+        await first.stop()
+        assert await second.batches.resume_batches() == 1
+        release_rows.set()
+        await asyncio.wait_for(second.batches.batches[batch.batch_id].task, 5)
+        await second.stop()
+        return batch.batch_id
+
+    batch_id = asyncio.run(run())
+    info = BatchManager().get_batch(batch_id).to_info()
+    assert info.status == BatchStatusEnum.Completed
+    assert info.completed == 3
+    # 只有被取消的第一行生成了两次
+    assert len(upstream_calls) == 4
@@ -0,0 +1,82 @@
+"""
+测试同步接口 /createPicture 的流式 JSON 响应
+使用假的上游生成器，不调用真实的豆包接口
+"""
+import base64
+import json
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from fastapi.testclient import TestClient
+
+from journey_poster import app
+from model.createPictureResp import CreatePictureResponse
+from service.generation_Image import DoubaoImages
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+REQUEST_DATA = json.dumps({
+    "city": "Paris",
+    "gender": "Female",
+    "mode": "Master",
+    "master_mode_tags": {"style": "FrenchElegant", "material": "Silk", "color": "Neutral", "type": "Suit"}
+})
+
+OUTPUT_IMAGES = [
+    "data:image/png;base64," + base64.b64encode(os.urandom(200_000 + i)).decode("utf-8")
+    for i in range(4)
+]
+
+
+def post_create_picture(client: TestClient):
+    return client.post(
+        "/createPicture",
+        files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+        data={"data": REQUEST_DATA}
+    )
+
+
+def test_streamed_json_is_byte_compatible(monkeypatch):
+    async def fake_seed_ream(self, input_image_list, prompt):
+        for image in OUTPUT_IMAGES:
+            yield image
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+
+    with TestClient(app) as client:
+        response = post_create_picture(client)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+
+    # 与原有一次性返回的 JSON 文档逐字节一致
+    expected = {"images": [{"id": i, "base64": image} for i, image in enumerate(OUTPUT_IMAGES)]}
+    assert response.content == json.dumps(expected, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    assert CreatePictureResponse.model_validate_json(response.content).images[3].base64 == OUTPUT_IMAGES[3]
+
+
+def test_error_before_first_image_returns_json_error(monkeypatch):
+    async def failing_seed_ream(self, input_image_list, prompt):
+        raise RuntimeError("upstream unavailable")
+        yield
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", failing_seed_ream)
+    monkeypatch.setattr("journey_poster.asyncio.sleep", lambda seconds: _no_sleep())
+
+    with TestClient(app) as client:
+        response = post_create_picture(client)
+
+    assert response.status_code == 500
+    body = response.json()
+    assert body["success"] is False
+    assert "upstream unavailable" in body["message"]
+
+
+async def _no_sleep():
+    return None
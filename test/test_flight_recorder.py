@@ -0,0 +1,166 @@
+"""
+测试慢请求记录：只保留时间窗口内最慢的 N 个请求、记录各阶段时间线/上游事件/重试/最终状态、调试接口认证
+使用假的上游生成器 / 假的上游客户端，不调用真实的豆包接口
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import pytest
+from fastapi.testclient import TestClient
+
+import core.llm as llm
+from core.exceptions import CommonException
+from journey_poster import app
+from service.generation_Image import DoubaoImages
+from setting import settings
+from utils.flight_recorder import FlightRecord, FlightRecorder, flight_recorder
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+REQUEST_DATA = json.dumps({"city": "Paris", "gender": "Male", "mode": "Master", "master_mode_tags": {"style": "FutureTech"}})
+DEBUG_HEADERS = {"Authorization": "Bearer debug-secret"}
+
+
+def fake_image(index: int) -> str:
+    return "data:image/png;base64," + base64.b64encode(f"image-{index}".encode("utf-8") * 100).decode("utf-8")
+
+
+def make_record(duration: float, started_at: float = None) -> FlightRecord:
+    record = FlightRecord("req", "POST", "/createPictureStream")
+    record.duration = duration
+    if started_at is not None:
+        record.started_at = started_at
+    return record
+
+
+@pytest.fixture
+def debug_token(monkeypatch):
+    monkeypatch.setattr(settings, "DEBUG_TOKEN", "debug-secret")
+    flight_recorder.clear()
+    yield
+    flight_recorder.clear()
+
+
+def test_keeps_slowest_requests_within_window():
+    recorder = FlightRecorder(capacity=3, window_seconds=60)
+    for duration in (0.5, 3.0, 1.0, 0.1, 2.0, 4.0):
+        recorder.offer(make_record(duration))
+    assert [record["durationMs"] for record in recorder.snapshot()] == [4000.0, 3000.0, 2000.0]
+    assert len(recorder.snapshot(limit=1)) == 1
+
+    # 超出时间窗口的记录被淘汰，即使它更慢
+    recorder.offer(make_record(10.0, started_at=time.time() - 120))
+    assert [record["durationMs"] for record in recorder.snapshot()] == [4000.0, 3000.0, 2000.0]
+
+
+def test_debug_endpoint_requires_token(monkeypatch):
+    with TestClient(app) as client:
+        monkeypatch.setattr(settings, "DEBUG_TOKEN", None)
+        assert client.get("/debug/slow", headers=DEBUG_HEADERS).status_code == 404
+
+        monkeypatch.setattr(settings, "DEBUG_TOKEN", "debug-secret")
+        assert client.get("/debug/slow").status_code == 401
+        assert client.get("/debug/slow", headers={"Authorization": "Bearer wrong"}).status_code == 401
+        assert client.get("/debug/slow", headers=DEBUG_HEADERS).status_code == 200
+        assert client.get("/debug/slow", headers={"X-Debug-Token": "debug-secret"}).status_code == 200
+
+
+def test_slow_stream_timeline_is_recorded(monkeypatch, debug_token):
+    monkeypatch.setattr(settings, "LLM_URL", "http://upstream.test/api/v3")
+    monkeypatch.setattr(settings, "LLM_API_KEY", "key")
+    monkeypatch.setattr(settings, "LLM_SCENE_ID", "model")
+    delays = iter([0.01, 0.2])
+
+    class FakeImages:
+        async def generate(self, **kwargs):
+            delay = next(delays)
+
+            async def events():
+                for index in range(4):
+                    await asyncio.sleep(delay)
+                    yield SimpleNamespace(type="image_generation.partial_succeeded", b64_json=f"image-{index}")
+                yield SimpleNamespace(type="image_generation.completed", usage=None)
+
+            return events()
+
+    monkeypatch.setattr(llm, "get_image_client", lambda base_url, api_key: SimpleNamespace(images=FakeImages()))
+
+    with TestClient(app) as client:
+        for request_id in ("req-fast", "req-slow"):
+            response = client.post(
+                "/createPictureStream",
+                files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+                data={"data": REQUEST_DATA},
+                headers={"X-Request-ID": request_id}
+            )
+            assert '"status":"completed"' in response.text.replace(" ", "")
+        body = client.get("/debug/slow", headers=DEBUG_HEADERS).json()["data"]
+
+    assert body["capacity"] == settings.FLIGHT_RECORDER_SIZE
+    # 调试接口本身不记录
+    assert [record["requestId"] for record in body["requests"]] == ["req-slow", "req-fast"]
+    slow = body["requests"][0]
+    assert slow["path"] == "/createPictureStream"
+    assert slow["statusCode"] == 200
+    assert slow["finalEvent"] == "completed"
+    assert slow["durationMs"] >= 800
+
+    stages = [stage["stage"] for stage in slow["stages"]]
+    for stage in ("multipart_read", "request_parse", "upload_read", "image_validation", "prompt_build",
+                  "queue_wait", "upstream_connect", "upstream_first_image", "upstream_total"):
+        assert stage in stages, stage
+    assert stages.count("upstream_image_gap") == 3
+
+    events = slow["upstreamEvents"]
+    assert [event["type"] for event in events] == ["image_generation.partial_succeeded"] * 4 + ["image_generation.completed"]
+    assert [event["atMs"] for event in events] == sorted(event["atMs"] for event in events)
+    assert events[0]["size"] == len("image-0")
+
+    assert slow["sizes"]["upload_bytes"] == INPUT_IMAGE.stat().st_size
+    assert slow["sizes"]["output_bytes"] == 4 * len("data:image/png;base64,image-0")
+    assert slow["sizes"]["sent_bytes"] > slow["sizes"]["output_bytes"]
+    assert slow["attempts"] == [] and slow["errors"] == []
+
+
+def test_retries_and_errors_are_recorded(monkeypatch, debug_token):
+    calls = []
+
+    async def flaky_seed_ream(self, input_image_list, prompt):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("upstream reset")
+        for index in range(3):
+            yield fake_image(index)
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", flaky_seed_ream)
+
+    with TestClient(app) as client:
+        # 第二次尝试只生成了 3 张，图片写出后才校验数量，连接被中断
+        with pytest.raises(CommonException):
+            client.post(
+                "/createPicture",
+                files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+                data={"data": REQUEST_DATA},
+                headers={"X-Request-ID": "req-retry"}
+            )
+        assert len(calls) == 2
+        [record] = client.get("/debug/slow", headers=DEBUG_HEADERS).json()["data"]["requests"]
+
+    assert record["requestId"] == "req-retry"
+    [attempt] = record["attempts"]
+    assert attempt["attempt"] == 1
+    assert attempt["error"] == "RuntimeError: upstream reset"
+    [error] = record["errors"]
+    assert error["name"] == "SYSTEM_ERROR"
+    assert "期望生成4张图片" in error["message"]
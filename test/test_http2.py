@@ -0,0 +1,221 @@
+"""
+测试 HTTP/2 模式（server.py 的 SERVER_HTTP2，使用 hypercorn）：
+- HTTP/2 响应去掉逐跳头（Connection 等），HTTP/1.1 保持不变
+- 一个客户端在同一个 h2c 连接上同时打开 20 个 /createPictureStream，事件逐个推送（不被缓冲）
+使用假的上游生成器，不调用真实的豆包接口；未安装 hypercorn / h2 时跳过 HTTP/2 连接测试
+"""
+import asyncio
+import base64
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import pytest
+
+from journey_poster import RequestContextMiddleware, app
+from service import admission as admission_module
+from service import generation_Image
+from service.generation_Image import DoubaoImages
+from service.scheduler import GenerationScheduler
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+STREAM_COUNT = 20
+REQUEST_DATA = json.dumps({"city": "Tokyo", "gender": "Female", "mode": "Master", "master_mode_tags": {"style": "JapaneseSimple"}})
+
+OUTPUT_IMAGES = [
+    "data:image/png;base64," + base64.b64encode(os.urandom(100_000 + index)).decode("utf-8")
+    for index in range(4)
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def send_response_headers(http_version: str) -> dict:
+    async def inner_app(scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"connection", b"keep-alive"), (b"x-accel-buffering", b"no")]
+        })
+        await send({"type": "http.response.body", "body": b""})
+
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "http_version": http_version, "method": "GET", "path": "/health", "headers": []}
+    await RequestContextMiddleware(inner_app)(scope, receive, send)
+    return {name.decode(): value.decode() for name, value in messages[0]["headers"]}
+
+
+def test_hop_by_hop_headers_are_removed_for_http2():
+    http2_headers = asyncio.run(send_response_headers("2"))
+    assert "connection" not in http2_headers
+    assert http2_headers["x-accel-buffering"] == "no"
+    assert "x-request-id" in http2_headers
+
+    assert asyncio.run(send_response_headers("1.1"))["connection"] == "keep-alive"
+
+
+@pytest.fixture
+def http2_server(monkeypatch):
+    """
+    在后台线程中用 hypercorn 启动应用（与 SERVER_HTTP2 模式相同的配置），返回端口
+    """
+    pytest.importorskip("hypercorn")
+    from hypercorn.asyncio import serve
+    from server import build_http2_config
+
+    # 20 个流同时调用上游，不排队、不被入口限流拒绝
+    scheduler = GenerationScheduler(max_workers=STREAM_COUNT)
+    monkeypatch.setattr(generation_Image, "scheduler", scheduler)
+    monkeypatch.setattr(admission_module.admission, "scheduler", scheduler)
+
+    port = free_port()
+    loop = asyncio.new_event_loop()
+    stopped = None
+
+    async def run():
+        nonlocal stopped
+        stopped = asyncio.Event()
+        await serve(app, build_http2_config(f"127.0.0.1:{port}"), shutdown_trigger=stopped.wait)
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(run(),), daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    yield port
+    loop.call_soon_threadsafe(stopped.set)
+    thread.join(timeout=30)
+
+
+async def open_streams(port: int, count: int, on_first_event) -> dict:
+    """
+    用 h2 在一个 h2c 连接（prior knowledge）上同时打开 count 个 /createPictureStream，返回 {stream_id: (响应头, 事件列表)}
+    只有一个任务读写连接（httpx 的 HTTP/2 连接由各个流轮流读取，某个流的数据已经到达时仍可能等在读锁上，
+    与本测试“收齐 20 个首张图片才继续推送”的条件相互等待）
+    """
+    import h2.config
+    import h2.connection
+    import h2.events
+    import httpx
+
+    # multipart 请求体由 httpx 编码
+    request = httpx.Request(
+        "POST", f"http://127.0.0.1:{port}/createPictureStream",
+        files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+        data={"data": REQUEST_DATA}
+    )
+    body = request.read()
+    headers = [
+        (":method", "POST"), (":scheme", "http"), (":authority", f"127.0.0.1:{port}"), (":path", "/createPictureStream"),
+        ("content-type", request.headers["content-type"]), ("content-length", str(len(body)))
+    ]
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=True))
+    connection.initiate_connection()
+    pending = {}
+    for _ in range(count):
+        stream_id = connection.get_next_available_stream_id()
+        connection.send_headers(stream_id, headers)
+        pending[stream_id] = body
+
+    responses = {stream_id: [None, []] for stream_id in pending}
+    buffers = {stream_id: b"" for stream_id in pending}
+    ended = set()
+    try:
+        while len(ended) < count:
+            # 按流量控制窗口发送请求体
+            for stream_id, data in list(pending.items()):
+                size = min(connection.local_flow_control_window(stream_id), connection.max_outbound_frame_size, len(data))
+                while size > 0:
+                    connection.send_data(stream_id, data[:size])
+                    data = data[size:]
+                    size = min(connection.local_flow_control_window(stream_id), connection.max_outbound_frame_size, len(data))
+                pending[stream_id] = data
+                if not data:
+                    connection.end_stream(stream_id)
+                    del pending[stream_id]
+            writer.write(connection.data_to_send())
+            await writer.drain()
+
+            data = await reader.read(65536)
+            assert data, "连接被服务端关闭"
+            for event in connection.receive_data(data):
+                if isinstance(event, h2.events.ResponseReceived):
+                    responses[event.stream_id][0] = {name.decode(): value.decode() for name, value in event.headers}
+                elif isinstance(event, h2.events.DataReceived):
+                    connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    buffers[event.stream_id] += event.data
+                    events = responses[event.stream_id][1]
+                    while b"\n\n" in buffers[event.stream_id]:
+                        chunk, buffers[event.stream_id] = buffers[event.stream_id].split(b"\n\n", 1)
+                        events.append(json.loads(chunk[len(b"data: "):]))
+                        if len(events) == 1:
+                            on_first_event()
+                elif isinstance(event, (h2.events.StreamEnded, h2.events.StreamReset)):
+                    ended.add(event.stream_id)
+    finally:
+        writer.close()
+    return responses
+
+
+def test_twenty_concurrent_streams_over_one_connection(monkeypatch, http2_server):
+    pytest.importorskip("h2")
+    pytest.importorskip("httpx")
+
+    # 每个流推送第一张图片后停住，直到客户端在全部 20 个流上都收到了第一张：
+    # 既要求 20 个流同时在进行（单个 HTTP/1.1 连接做不到），也要求事件逐个推送、没有被缓冲
+    first_images_received = threading.Event()
+    received = 0
+
+    def on_first_event():
+        nonlocal received
+        received += 1
+        if received == STREAM_COUNT:
+            first_images_received.set()
+
+    async def fake_seed_ream(self, input_image_list, prompt):
+        yield OUTPUT_IMAGES[0]
+        while not first_images_received.is_set():
+            await asyncio.sleep(0.01)
+        for image in OUTPUT_IMAGES[1:]:
+            yield image
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+
+    responses = asyncio.run(asyncio.wait_for(open_streams(http2_server, STREAM_COUNT, on_first_event), timeout=60))
+
+    assert first_images_received.is_set()
+    assert len(responses) == STREAM_COUNT
+    for headers, events in responses.values():
+        assert headers[":status"] == "200"
+        assert headers["content-type"].startswith("text/event-stream")
+        assert headers["x-accel-buffering"] == "no"
+        assert "connection" not in headers
+        assert [event["status"] for event in events] == ["generating"] * 4 + ["completed"]
+        assert [event["base64"] for event in events[:4]] == OUTPUT_IMAGES
@@ -0,0 +1,128 @@
+"""
+测试 Idempotency-Key：重复提交接入同一次生成或回放结果，同一个键搭配不同参数被拒绝
+使用假的上游生成器，不调用真实的豆包接口
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from journey_poster import app
+from service.generation_Image import DoubaoImages
+from service.job_store import MemoryJobStore, SqliteJobStore
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+REQUEST_DATA = json.dumps({"city": "Paris", "gender": "Male", "mode": "Master", "master_mode_tags": {"style": "FutureTech"}})
+OTHER_DATA = json.dumps({"city": "Tokyo", "gender": "Male", "mode": "Master", "master_mode_tags": {"style": "FutureTech"}})
+
+
+def fake_image(index: int) -> str:
+    return "data:image/png;base64," + base64.b64encode(f"image-{index}".encode("utf-8")).decode("utf-8")
+
+
+def patch_upstream(monkeypatch, fail_first: bool = False) -> list:
+    calls = []
+
+    async def fake_seed_ream(self, input_image_list, prompt):
+        calls.append(prompt)
+        if fail_first and len(calls) == 1:
+            raise RuntimeError("upstream error")
+        for index in range(4):
+            yield fake_image(index)
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+    return calls
+
+
+def post(client: TestClient, path: str, key: str, data: str = REQUEST_DATA):
+    return client.post(
+        path,
+        files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+        data={"data": data},
+        headers={"Idempotency-Key": key}
+    )
+
+
+def parse_events(text: str) -> list:
+    return [json.loads(block[len("data: "):]) for block in text.split("\n\n") if block.startswith("data: ")]
+
+
+def test_stream_repeat_replays_without_regenerating(monkeypatch):
+    calls = patch_upstream(monkeypatch)
+
+    with TestClient(app) as client:
+        first = post(client, "/createPictureStream", "stream-key-1")
+        second = post(client, "/createPictureStream", "stream-key-1")
+
+    assert len(calls) == 1
+    assert "idempotency-replayed" not in first.headers
+    assert second.headers["idempotency-replayed"] == "true"
+    first_events = parse_events(first.text)
+    assert [event["base64"] for event in first_events if event["status"] == "generating"] == [fake_image(i) for i in range(4)]
+    assert first_events[-1]["status"] == "completed"
+    assert parse_events(second.text) == first_events
+
+
+def test_create_picture_repeat_returns_same_result(monkeypatch):
+    calls = patch_upstream(monkeypatch)
+
+    with TestClient(app) as client:
+        first = post(client, "/createPicture", "sync-key-1")
+        second = post(client, "/createPicture", "sync-key-1")
+
+    assert len(calls) == 1
+    assert first.json() == {"images": [{"id": i, "base64": fake_image(i)} for i in range(4)]}
+    assert second.content == first.content
+    assert second.headers["idempotency-replayed"] == "true"
+
+
+def test_reused_key_with_different_payload_is_rejected(monkeypatch):
+    calls = patch_upstream(monkeypatch)
+
+    with TestClient(app) as client:
+        post(client, "/createPictureStream", "conflict-key")
+        response = post(client, "/createPictureStream", "conflict-key", data=OTHER_DATA)
+
+    assert response.status_code == 409
+    assert "conflict-key" in response.json()["message"]
+    assert len(calls) == 1
+
+
+def test_failed_run_is_regenerated_on_retry(monkeypatch):
+    calls = patch_upstream(monkeypatch, fail_first=True)
+
+    with TestClient(app) as client:
+        first = post(client, "/createPictureStream", "retry-key")
+        second = post(client, "/createPictureStream", "retry-key")
+
+    assert parse_events(first.text)[-1]["status"] == "failed"
+    assert parse_events(second.text)[-1]["status"] == "completed"
+    assert "idempotency-replayed" not in second.headers
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("store_factory", [MemoryJobStore, lambda tmp_path: SqliteJobStore(str(tmp_path / "jobs.sqlite3"))])
+def test_store_claim_and_swap(store_factory, tmp_path):
+    store = store_factory() if store_factory is MemoryJobStore else store_factory(tmp_path)
+
+    async def run():
+        assert await store.claim_idempotency_key("k", "fp-1", "job-a", 60) == ("job-a", "fp-1")
+        # 已绑定的键不会被后来的请求覆盖
+        assert await store.claim_idempotency_key("k", "fp-2", "job-b", 60) == ("job-a", "fp-1")
+        assert not await store.swap_idempotency_key("k", "job-b", "job-c")
+        assert await store.swap_idempotency_key("k", "job-a", "job-c")
+        # 过期后重新绑定
+        assert await store.claim_idempotency_key("k", "fp-2", "job-d", -1) == ("job-d", "fp-2")
+
+    asyncio.run(run())
@@ -0,0 +1,123 @@
+"""
+测试生成图片的持久化与 /images 静态访问接口
+"""
+import base64
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from fastapi.testclient import TestClient
+
+from core import image_store
+from journey_poster import app
+from service.generation_Image import DoubaoImages
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+
+def make_png_base64() -> str:
+    buffer = BytesIO()
+    Image.new("RGB", (64, 64), (10, 200, 90)).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def use_tmp_saved_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(image_store.settings, "SAVED_DIR", str(tmp_path))
+
+
+def test_save_image_is_content_addressed(monkeypatch, tmp_path):
+    use_tmp_saved_dir(monkeypatch, tmp_path)
+    data_url = make_png_base64()
+
+    first_name = image_store.save_image(data_url)
+    second_name = image_store.save_image(data_url)
+
+    assert first_name == second_name
+    assert first_name.endswith(".png")
+    assert [p.name for p in tmp_path.iterdir()] == [first_name]
+    assert image_store.get_saved_image_path(first_name).read_bytes() == base64.b64decode(data_url.split(",")[1])
+
+
+def test_concurrent_saves_of_same_image_in_one_process(monkeypatch, tmp_path):
+    # 任务存储和同步接口可能在同一进程的不同线程中同时保存同一张图片
+    use_tmp_saved_dir(monkeypatch, tmp_path)
+    data_url = make_png_base64()
+    real_replace = os.replace
+    barrier = threading.Barrier(8)
+
+    def replace_together(src, dst):
+        # 所有线程都写完临时文件后再一起替换，复现临时文件互相覆盖的竞争
+        barrier.wait(timeout=10)
+        real_replace(src, dst)
+
+    monkeypatch.setattr(image_store.os, "replace", replace_together)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        names = list(pool.map(lambda _: image_store.save_image(data_url), range(8)))
+
+    assert len(set(names)) == 1
+    assert [p.name for p in tmp_path.iterdir()] == [names[0]]
+
+
+def test_image_route_caching_and_range(monkeypatch, tmp_path):
+    use_tmp_saved_dir(monkeypatch, tmp_path)
+    image_name = image_store.save_image(make_png_base64())
+    image_bytes = (tmp_path / image_name).read_bytes()
+
+    with TestClient(app) as client:
+        response = client.get(f"/images/{image_name}")
+        assert response.status_code == 200
+        assert response.content == image_bytes
+        assert response.headers["content-type"] == "image/png"
+        assert "immutable" in response.headers["cache-control"]
+        etag = response.headers["etag"]
+        assert etag == f'"{image_name.split(".")[0]}"'
+
+        not_modified = client.get(f"/images/{image_name}", headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+
+        partial = client.get(f"/images/{image_name}", headers={"Range": "bytes=0-9"})
+        assert partial.status_code == 206
+        assert partial.content == image_bytes[:10]
+
+        assert client.get("/images/../setting.py").status_code == 404
+        assert client.get("/images/" + "0" * 64 + ".png").status_code == 404
+
+
+def test_create_picture_with_url_delivery(monkeypatch, tmp_path):
+    use_tmp_saved_dir(monkeypatch, tmp_path)
+    output_image = make_png_base64()
+
+    async def fake_seed_ream(self, input_image_list, prompt):
+        for _ in range(4):
+            yield output_image
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+
+    data = {
+        "city": "Tokyo",
+        "gender": "Male",
+        "mode": "Master",
+        "master_mode_tags": {"style": "FutureTech"},
+        "delivery": "Url"
+    }
+    with TestClient(app) as client:
+        response = client.post(
+            "/createPicture",
+            files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+            data={"data": json.dumps(data)}
+        )
+        images = response.json()["images"]
+        assert [set(image) for image in images] == [{"id", "url"}] * 4
+        assert len({image["url"] for image in images}) == 1
+        assert client.get(images[0]["url"]).status_code == 200
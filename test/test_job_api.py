@@ -0,0 +1,108 @@
+"""
+测试异步生图任务接口（/jobs）与断线续传（Last-Event-ID）
+使用假的上游生成器，不调用真实的豆包接口
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from fastapi.testclient import TestClient
+
+from journey_poster import app
+from service.generation_Image import DoubaoImages
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+REQUEST_DATA = json.dumps({
+    "city": "London",
+    "gender": "Male",
+    "mode": "Master",
+    "master_mode_tags": {"style": "FutureTech"}
+})
+
+OUTPUT_IMAGES = [
+    "data:image/png;base64," + base64.b64encode(os.urandom(1000 + i)).decode("utf-8")
+    for i in range(4)
+]
+
+
+def parse_sse(text: str) -> list:
+    """解析 SSE 文本，返回 (事件ID, 数据) 列表，忽略心跳注释"""
+    events = []
+    for block in text.split("\n\n"):
+        event_id, data = None, None
+        for line in block.split("\n"):
+            if line.startswith("id: "):
+                event_id = int(line[len("id: "):])
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+        if data is not None:
+            events.append((event_id, data))
+    return events
+
+
+def create_job(client: TestClient) -> str:
+    response = client.post(
+        "/jobs",
+        files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+        data={"data": REQUEST_DATA}
+    )
+    assert response.status_code == 202
+    return response.json()["data"]["jobId"]
+
+
+def test_job_events_resume_from_last_event_id(monkeypatch):
+    upstream_calls = []
+
+    async def fake_seed_ream(self, input_image_list, prompt):
+        upstream_calls.append(prompt)
+        for image in OUTPUT_IMAGES:
+            yield image
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+
+    with TestClient(app) as client:
+        job_id = create_job(client)
+
+        events = parse_sse(client.get(f"/jobs/{job_id}/events").text)
+        assert [event_id for event_id, _ in events] == [0, 1, 2, 3, 4]
+        assert [data["status"] for _, data in events] == ["generating"] * 4 + ["completed"]
+        assert events[3][1]["base64"] == OUTPUT_IMAGES[3]
+
+        # 模拟收到事件 1 后断线，重连只回放之后的事件
+        resumed = parse_sse(client.get(f"/jobs/{job_id}/events", headers={"Last-Event-ID": "1"}).text)
+        assert [event_id for event_id, _ in resumed] == [2, 3, 4]
+        assert resumed[0][1]["base64"] == OUTPUT_IMAGES[2]
+
+        info = client.get(f"/jobs/{job_id}").json()["data"]
+        assert info["status"] == "completed"
+        assert info["imageCount"] == 4
+        assert info["eventCount"] == 5
+
+    # 重连回放不会重新调用上游
+    assert len(upstream_calls) == 1
+
+
+def test_delete_running_job(monkeypatch):
+    async def slow_seed_ream(self, input_image_list, prompt):
+        yield OUTPUT_IMAGES[0]
+        await asyncio.sleep(3600)
+        yield OUTPUT_IMAGES[1]
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", slow_seed_ream)
+
+    with TestClient(app) as client:
+        job_id = create_job(client)
+        assert client.get(f"/jobs/{job_id}").json()["data"]["status"] in ("pending", "running")
+
+        assert client.delete(f"/jobs/{job_id}").status_code == 200
+        assert client.get(f"/jobs/{job_id}").status_code == 404
+        assert client.get(f"/jobs/{job_id}/events").status_code == 404
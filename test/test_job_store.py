@@ -0,0 +1,138 @@
+"""
+测试多 worker 共享的异步任务存储（SQLite/WAL）
+两个 JobManager 各自持有独立的 SqliteJobStore（独立连接，不共享进程内唤醒），模拟两个 worker 进程
+使用假的上游生成器，不调用真实的豆包接口
+"""
+import asyncio
+import base64
+import io
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from service.generation_Image import DoubaoImages
+from service.job_manager import JobManager
+from service.job_store import SqliteJobStore
+from setting import settings
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+REQUEST_DATA = json.dumps({
+    "city": "London",
+    "gender": "Male",
+    "mode": "Master",
+    "master_mode_tags": {"style": "FutureTech"}
+})
+
+OUTPUT_IMAGES = [
+    "data:image/png;base64," + base64.b64encode(os.urandom(5000 + i)).decode("utf-8")
+    for i in range(4)
+]
+
+
+def build_upload() -> UploadFile:
+    return UploadFile(
+        file=io.BytesIO(INPUT_IMAGE.read_bytes()),
+        filename=INPUT_IMAGE.name,
+        headers=Headers({"content-type": "image/jpeg"})
+    )
+
+
+async def collect(events) -> list:
+    return [(event_id, event) async for event_id, event in events if event is not None]
+
+
+def test_workers_serve_each_others_jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SAVED_DIR", str(tmp_path / "saved"))
+    gates = {}
+
+    async def gated_seed_ream(self, input_image_list, prompt):
+        yield OUTPUT_IMAGES[0]
+        await gates[prompt].wait()
+        for image in OUTPUT_IMAGES[1:]:
+            yield image
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", gated_seed_ream)
+    monkeypatch.setattr("service.generation_Image.generate_prompt_by_request", lambda request: request.clientId)
+
+    async def run():
+        db_path = tmp_path / "jobs.sqlite3"
+        worker_a = JobManager(SqliteJobStore(db_path, poll_interval=0.05))
+        worker_b = JobManager(SqliteJobStore(db_path, poll_interval=0.05))
+
+        # worker A 执行任务，worker B 在生成过程中订阅（只能通过轮询发现 A 写入的事件）
+        gates["first"] = asyncio.Event()
+        job = await worker_a.create_job(build_upload(), REQUEST_DATA, "first")
+        follower = asyncio.create_task(collect(worker_b.follow_events(job.job_id)))
+        await asyncio.sleep(0.3)
+        assert not follower.done()
+        gates["first"].set()
+        followed = await asyncio.wait_for(follower, 5)
+
+        # 断线重连到 worker B，从 Last-Event-ID 之后续传
+        resumed = await collect(worker_b.follow_events(job.job_id, 1))
+        info = (await worker_b.get_job(job.job_id)).to_info()
+
+        # worker B 删除 worker A 上仍在生成的任务，A 写入下一个事件时发现后停止
+        gates["second"] = asyncio.Event()
+        running = await worker_a.create_job(build_upload(), REQUEST_DATA, "second")
+        running_task = worker_a.tasks[running.job_id]
+        while (await worker_b.get_job(running.job_id)).image_count == 0:
+            await asyncio.sleep(0.05)
+        await worker_b.delete_job(running.job_id)
+        gates["second"].set()
+        await asyncio.wait_for(running_task, 5)
+        deleted = await worker_a.store.get_job(running.job_id)
+
+        return followed, resumed, info, deleted
+
+    followed, resumed, info, deleted = asyncio.run(run())
+
+    assert [event_id for event_id, _ in followed] == [0, 1, 2, 3, 4]
+    assert [event.status.value for _, event in followed] == ["generating"] * 4 + ["completed"]
+    # 图片以文件形式保存，读取时还原为原始的 Base64
+    assert [event.base64 for _, event in followed[:4]] == OUTPUT_IMAGES
+
+    assert [event_id for event_id, _ in resumed] == [2, 3, 4]
+    assert resumed[0][1].base64 == OUTPUT_IMAGES[2]
+
+    assert info.status.value == "completed"
+    assert info.imageCount == 4
+    assert info.eventCount == 5
+
+    assert deleted is None
+
+
+def test_sqlite_store_does_not_use_shared_executor(tmp_path):
+    # 共享线程池被占满（缩略图、保存图片等耗时操作）时，任务存储的读写和订阅方的轮询不受影响
+    from setting import executor
+
+    store = SqliteJobStore(tmp_path / "jobs.sqlite3", poll_interval=0.05)
+    release = threading.Event()
+    blockers = [executor.submit(release.wait, 30) for _ in range(executor._max_workers)]
+
+    async def run():
+        job = await store.create_job("job-1")
+        record = await store.get_job(job.job_id)
+        assert not await store.wait_for_events(job.job_id, 0, timeout=0.2)
+        await store.close()
+        return record
+
+    try:
+        record = asyncio.run(asyncio.wait_for(run(), timeout=5))
+    finally:
+        release.set()
+        for blocker in blockers:
+            blocker.result(timeout=30)
+
+    assert record.job_id == "job-1"
@@ -0,0 +1,159 @@
+"""
+测试服务生命周期：启动预热后才就绪、停机时停止准入并等待进行中的生成、上游共享客户端异步流式读取
+"""
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from fastapi.testclient import TestClient
+
+import core.image_utils as image_utils
+import core.llm as llm
+from core.llm import LLMConf, LLMModel
+from journey_poster import app
+from service.admission import AdmissionController
+from service.batch_manager import BatchManager
+from service.lifecycle import ServiceLifecycle, lifecycle
+from service.scheduler import GenerationScheduler
+from setting import settings
+
+
+def test_ready_after_warm_start(monkeypatch):
+    monkeypatch.setattr(image_utils, "_clothes_image_cache", {})
+
+    with TestClient(app) as client:
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()["data"]["ready"] is True
+        # 服装素材已在启动时缓存，请求内不再读文件
+        assert image_utils.get_clothes_dir() / "male" / "male_clothes.jpg" in image_utils._clothes_image_cache
+
+    assert lifecycle.ready is False
+
+
+def test_drain_stops_admission_and_waits_for_in_flight(monkeypatch):
+    scheduler = GenerationScheduler(max_workers=2, initial_service_seconds=60)
+    monkeypatch.setattr("service.lifecycle.scheduler", scheduler)
+    controller = AdmissionController()
+    service_lifecycle = ServiceLifecycle(controller)
+
+    async def run():
+        async def generate(duration: float):
+            async with scheduler.slot("client"):
+                await asyncio.sleep(duration)
+
+        task = asyncio.create_task(generate(0.3))
+        await asyncio.sleep(0)
+        assert service_lifecycle.in_flight() == 1
+
+        drain = asyncio.create_task(service_lifecycle.drain(5))
+        await asyncio.sleep(0)
+        # 排空期间新的生图请求直接被拒绝
+        assert controller.check("/createPictureStream") == settings.SHUTDOWN_RETRY_AFTER_SECONDS
+
+        start_time = time.monotonic()
+        assert await drain is True
+        assert time.monotonic() - start_time >= 0.2
+        assert task.done()
+
+        # 排空超时：返回 False，由 stop() 取消剩余任务
+        slow_task = asyncio.create_task(generate(3600))
+        await asyncio.sleep(0)
+        assert await service_lifecycle.drain(0.2) is False
+        slow_task.cancel()
+
+    asyncio.run(run())
+
+
+def test_upstream_stream_is_read_with_shared_async_client(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_URL", "http://upstream.test/api/v3")
+    monkeypatch.setattr(settings, "LLM_API_KEY", "key")
+    monkeypatch.setattr(settings, "LLM_SCENE_ID", "model")
+    clients = []
+
+    class FakeImages:
+        async def generate(self, **kwargs):
+            assert kwargs["stream"] is True
+
+            async def events():
+                for index in range(2):
+                    await asyncio.sleep(0)
+                    yield SimpleNamespace(type="image_generation.partial_succeeded", b64_json=f"image-{index}")
+                yield SimpleNamespace(type="image_generation.completed", usage=None)
+
+            return events()
+
+    def fake_get_image_client(base_url, api_key):
+        clients.append((base_url, api_key))
+        return SimpleNamespace(images=FakeImages())
+
+    monkeypatch.setattr(llm, "get_image_client", fake_get_image_client)
+
+    async def run():
+        model = LLMModel(LLMConf())
+        images = [image async for image in model.create_picture_by_seed_ream(["data:image/png;base64,AAAA"], "prompt")]
+        assert images == ["data:image/png;base64,image-0", "data:image/png;base64,image-1"]
+
+    asyncio.run(run())
+    assert clients == [("http://upstream.test/api/v3", "key")]
+
+
+def test_shared_client_is_reused_until_closed(monkeypatch):
+    async def run():
+        first = llm.get_image_client("http://upstream.test/api/v3", "key")
+        assert llm.get_image_client("http://upstream.test/api/v3", "key") is first
+        await llm.close_image_client()
+        assert llm.get_image_client("http://upstream.test/api/v3", "key") is not first
+        await llm.close_image_client()
+
+    asyncio.run(run())
+
+
+def test_drain_skips_batch_rows_and_counts_from_shutdown_start(monkeypatch):
+    scheduler = GenerationScheduler(max_workers=2, initial_service_seconds=60)
+    manager = BatchManager()
+    monkeypatch.setattr("service.lifecycle.scheduler", scheduler)
+    controller = AdmissionController()
+    service_lifecycle = ServiceLifecycle(controller, batches=manager)
+
+    async def run():
+        async def generate(client_id: str, duration: float):
+            async with scheduler.slot(client_id):
+                await asyncio.sleep(duration)
+
+        batch_row = asyncio.create_task(generate("batch:0123", 3600))
+        online = asyncio.create_task(generate("client", 0.2))
+        await asyncio.sleep(0)
+        assert service_lifecycle.in_flight() == 1
+
+        # 收到 SIGTERM：立即未就绪、停止准入、暂停批量任务
+        service_lifecycle.begin_shutdown()
+        assert service_lifecycle.ready is False
+        assert controller.check("/jobs") == settings.SHUTDOWN_RETRY_AFTER_SECONDS
+        assert manager.paused is True
+
+        # 批量任务的行不需要等待：在线请求结束后排空完成
+        start_time = time.monotonic()
+        assert await service_lifecycle.drain(5) is True
+        assert time.monotonic() - start_time < 1
+        assert online.done() and not batch_row.done()
+
+        # 截止时间从收到信号算起，uvicorn 等待连接用掉的时间不再重复等待
+        slow = asyncio.create_task(generate("client", 3600))
+        await asyncio.sleep(0.3)
+        start_time = time.monotonic()
+        assert await service_lifecycle.drain(0.3) is False
+        assert time.monotonic() - start_time < 0.2
+
+        batch_row.cancel()
+        slow.cancel()
+        await asyncio.gather(batch_row, slow, return_exceptions=True)
+
+    asyncio.run(run())
@@ -0,0 +1,106 @@
+"""
+测试日志管线：截断与脱敏、逐事件日志限流、队列满时丢弃不阻塞、JSON 结构化输出、重复初始化
+"""
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import setting  # noqa: F401  初始化日志
+from utils.logger import (
+    MAX_MESSAGE_CHARS,
+    JsonFormatter,
+    NonBlockingQueueHandler,
+    RateLimitFilter,
+    dropped_counter,
+    redact_message,
+    register_secret,
+    setup_logging,
+)
+
+
+def make_record(message: str, **extra) -> logging.LogRecord:
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, message, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_redacts_images_and_secrets_with_bounded_cost():
+    register_secret("sk-live-0123456789")
+    image = "data:image/png;base64," + "A" * 3000
+    message = redact_message(f"upload={image} raw={'B' * 500} key=sk-live-0123456789 Authorization: Bearer abcdefghijkl")
+
+    assert "AAAA" not in message and "BBBB" not in message
+    assert "data:image/png;base64,<3000 字符>" in message
+    assert "<base64 500 字符>" in message
+    assert "sk-live" not in message
+    assert "abcdefghijkl" not in message
+
+    # 多 MB 的图片先截断再处理：输出长度和耗时与图片大小无关
+    huge = "request=" + "data:image/jpeg;base64," + "C" * (8 * 1024 * 1024)
+    start_time = time.perf_counter()
+    message = redact_message(huge)
+    assert time.perf_counter() - start_time < 0.05
+    assert len(message) < MAX_MESSAGE_CHARS
+    assert "已截断" in message
+
+
+def test_rate_limit_per_group():
+    rate_limit = RateLimitFilter(per_window=5, window_seconds=0.2)
+
+    passed = [rate_limit.filter(make_record("event", rate_limit="upstream_event")) for _ in range(20)]
+    assert passed.count(True) == 5
+    # 其他分组和没有分组的日志不受影响
+    assert rate_limit.filter(make_record("image", rate_limit="upstream_image"))
+    assert all(rate_limit.filter(make_record("plain")) for _ in range(20))
+
+    time.sleep(0.25)
+    record = make_record("event", rate_limit="upstream_event")
+    assert rate_limit.filter(record)
+    assert record.suppressed == 15
+
+
+def test_queue_handler_drops_when_full_and_redacts():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    dropped_before = dropped_counter.get()
+
+    handler.handle(make_record("first data:image/png;base64," + "A" * 1000))
+    # 队列已满：直接丢弃，不阻塞调用方
+    start_time = time.perf_counter()
+    handler.handle(make_record("second"))
+    assert time.perf_counter() - start_time < 0.05
+    assert dropped_counter.get() == dropped_before + 1
+
+    queued = handler.queue.get_nowait()
+    assert queued.getMessage() == "first data:image/png;base64,<1000 字符>"
+
+
+def test_json_formatter_includes_extra_fields_and_exception():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("test", logging.ERROR, __file__, 1, "failed %s", ("job",), sys.exc_info())
+    record.rate_limit = "upstream_event"
+
+    payload = json.loads(JsonFormatter().format(handler.prepare(record)))
+    assert payload["message"] == "failed job"
+    assert payload["level"] == "ERROR"
+    assert payload["rate_limit"] == "upstream_event"
+    assert "ValueError: boom" in payload["exception"]
+
+
+def test_setup_logging_is_idempotent():
+    setup_logging("DEBUG")
+    setup_logging("INFO")
+    root_logger = logging.getLogger()
+    # pytest 会在根 logger 上挂自己的捕获 handler，这里只统计日志管线的 handler
+    assert sum(isinstance(handler, NonBlockingQueueHandler) for handler in root_logger.handlers) == 1
+    assert root_logger.level == logging.INFO
@@ -0,0 +1,130 @@
+"""
+测试事件循环监控：调度延迟持续记录为指标、阻塞超过阈值时抓取调用栈、
+各生图接口在假的上游下不阻塞事件循环（严格模式，超过 LOOP_BLOCK_BUDGET_MS 毫秒即失败）
+使用假的上游生成器，不调用真实的豆包接口
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import pytest
+from fastapi.testclient import TestClient
+
+import core.image_utils as image_utils
+from journey_poster import app
+from service.generation_Image import DoubaoImages
+from setting import settings
+from utils.loop_monitor import LoopBlockedError, LoopMonitor, loop_lag_histogram, loop_monitor
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+# CI 中允许的单次阻塞上限（毫秒），较慢的机器上可以通过环境变量放宽
+LOOP_BLOCK_BUDGET_MS = float(os.getenv("LOOP_BLOCK_BUDGET_MS", "100"))
+
+MASTER_DATA = {"city": "Paris", "gender": "Male", "mode": "Master", "master_mode_tags": {"style": "FutureTech"}}
+EASY_DATA = {"city": "Tokyo", "gender": "Male", "mode": "Easy", "clothes": {"upperStyle": "male_upper_01", "lowerStyle": "male_lower_01"}}
+MULTI_CITY_DATA = {**MASTER_DATA, "city": None, "cities": ["Paris", "Tokyo"]}
+DEBUG_HEADERS = {"Authorization": "Bearer debug-secret"}
+
+
+def fake_image(index: int) -> str:
+    return "data:image/png;base64," + base64.b64encode(f"image-{index}".encode("utf-8") * 1000).decode("utf-8")
+
+
+async def fake_seed_ream(self, input_image_list, prompt):
+    for index in range(4):
+        await asyncio.sleep(0.01)
+        yield fake_image(index)
+
+
+def blocking_helper(seconds: float):
+    time.sleep(seconds)
+
+
+def upload() -> dict:
+    return {"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")}
+
+
+def test_blocking_call_is_detected_with_stack():
+    monitor = LoopMonitor()
+    lag_count = loop_lag_histogram.get_count()
+
+    async def run():
+        monitor.start(interval=0.01, threshold_ms=50)
+        await asyncio.sleep(0.1)
+        blocking_helper(0.3)
+        await asyncio.sleep(0.1)
+        monitor.stop()
+
+    asyncio.run(run())
+
+    [block] = monitor.snapshot()
+    assert block["durationMs"] >= 250
+    # 调用栈在阻塞进行中抓取，栈顶是阻塞的同步调用
+    assert "blocking_helper" in "".join(block["stack"])
+    assert "time.sleep" in block["stack"][-1]
+    assert loop_lag_histogram.get_count() > lag_count
+
+
+def test_strict_mode_raises_on_block():
+    monitor = LoopMonitor()
+
+    async def run():
+        monitor.start(interval=0.01, threshold_ms=50, strict=True)
+        await asyncio.sleep(0.05)
+        blocking_helper(0.2)
+        await asyncio.sleep(0.05)
+        monitor.stop()
+
+    with pytest.raises(LoopBlockedError, match="blocking_helper"):
+        asyncio.run(run())
+
+
+def test_request_paths_do_not_block_event_loop(monkeypatch, tmp_path):
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+    monkeypatch.setattr(settings, "PORTRAIT_DIR", str(tmp_path / "portraits"))
+    monkeypatch.setattr(settings, "DEBUG_TOKEN", "debug-secret")
+    monkeypatch.setattr(settings, "LOOP_MONITOR_INTERVAL_SECONDS", 0.01)
+    monkeypatch.setattr(settings, "LOOP_BLOCK_THRESHOLD_MS", LOOP_BLOCK_BUDGET_MS)
+    monkeypatch.setattr(settings, "LOOP_MONITOR_STRICT", True)
+
+    # 服务退出时（TestClient 关闭）发现阻塞记录会抛出 LoopBlockedError，列出阻塞时的调用栈
+    with TestClient(app) as client:
+        assert loop_monitor.running
+
+        response = client.post("/createPicture", files=upload(), data={"data": json.dumps(MASTER_DATA)})
+        assert response.status_code == 200
+        response = client.post("/createPictureStream", files=upload(), data={"data": json.dumps(MASTER_DATA)})
+        assert '"status":"completed"' in response.text.replace(" ", "")
+        response = client.post("/createPictureStreamBinary", files=upload(), data={"data": json.dumps(MASTER_DATA)})
+        assert response.status_code == 200
+        response = client.post("/createPictureStream", files=upload(), data={"data": json.dumps(MULTI_CITY_DATA)})
+        assert '"status":"completed"' in response.text.replace(" ", "")
+
+        # 轻松模式：清空服装素材缓存，服装图片从文件读取
+        monkeypatch.setattr(image_utils, "_clothes_image_cache", {})
+        response = client.post("/createPictureStream", files=upload(), data={"data": json.dumps(EASY_DATA)})
+        assert '"status":"completed"' in response.text.replace(" ", "")
+
+        portrait_id = client.post("/portraits", files=upload()).json()["data"]["portraitId"]
+        response = client.post("/createPictureStream", data={"data": json.dumps({**MASTER_DATA, "portraitId": portrait_id})})
+        assert '"status":"completed"' in response.text.replace(" ", "")
+
+        job_id = client.post("/jobs", files=upload(), data={"data": json.dumps(MASTER_DATA)}).json()["data"]["jobId"]
+        assert '"status":"completed"' in client.get(f"/jobs/{job_id}/events").text.replace(" ", "")
+
+        body = client.get("/debug/loop", headers=DEBUG_HEADERS).json()["data"]
+        assert body["running"] and body["thresholdMs"] == LOOP_BLOCK_BUDGET_MS
+        assert body["blocks"] == [], "\n".join(LoopMonitor.format_block(block) for block in body["blocks"])
+        assert 'journey_event_loop_lag_seconds_bucket{le="0.001"}' in client.get("/metrics").text
+
+    assert not loop_monitor.running
@@ -0,0 +1,156 @@
+"""
+测试内存预算：额度不足时排队/拒绝、请求结束或被回收时归还额度、内存紧张时缓存的生成结果落盘
+使用假的上游生成器，不调用真实的豆包接口
+"""
+import asyncio
+import base64
+import gc
+import json
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from core.exceptions import ServiceBusyException
+from journey_poster import app
+from model.createPictureReq import CreatePictureRequest
+from model.createPictureResp import ImageStreamEvent, StreamStatusEnum
+from service.generation_Image import DoubaoImages
+from service.job_store import MemoryJobStore
+from service.memory_budget import MemoryBudget, memory_budget, rejected_counter
+from setting import settings
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+REQUEST_DATA = json.dumps({"city": "Paris", "gender": "Male", "mode": "Master", "master_mode_tags": {"style": "FutureTech"}})
+
+
+def fake_image(index: int) -> str:
+    return "data:image/png;base64," + base64.b64encode(f"image-{index}".encode("utf-8") * 1000).decode("utf-8")
+
+
+def test_acquire_waits_for_release_then_times_out():
+    budget = MemoryBudget(capacity=100)
+
+    async def run():
+        first = await budget.acquire(80)
+        waiting = asyncio.create_task(budget.acquire(50, timeout=5))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+
+        first.release()
+        second = await asyncio.wait_for(waiting, 1)
+        assert budget.used == 50
+
+        with pytest.raises(ServiceBusyException):
+            await budget.acquire(60, timeout=0.1)
+        second.release()
+        assert budget.used == 0
+
+    asyncio.run(run())
+
+
+def test_lease_is_released_when_request_is_collected():
+    budget = MemoryBudget(capacity=1000)
+
+    async def run():
+        request = CreatePictureRequest(city="Paris", gender="Male", mode="Master", master_mode_tags={"style": "FutureTech"})
+        lease = await budget.reserve_for(request, 300)
+        budget.charge(request, 200)
+        assert lease.nbytes == 500
+        # 副本（如多城市生成）共享同一份额度
+        assert budget.lease_of(request.model_copy(update={"city": "Tokyo"})) is lease
+        return budget.used
+
+    assert asyncio.run(run()) == 500
+    gc.collect()
+    assert budget.used == 0
+
+
+def test_stream_returns_budget_and_exports_metrics(monkeypatch):
+    async def fake_seed_ream(self, input_image_list, prompt):
+        for index in range(4):
+            yield fake_image(index)
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+    baseline = memory_budget.used
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/createPictureStream",
+            files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+            data={"data": REQUEST_DATA}
+        )
+        assert '"status":"completed"' in response.text.replace(" ", "")
+        gc.collect()
+        assert memory_budget.used == baseline
+
+        text = client.get("/metrics").text
+    assert f"journey_memory_budget_bytes {settings.MEMORY_BUDGET_MB * 1024 * 1024}" in text
+    assert "journey_memory_in_use_bytes" in text
+
+
+def test_request_is_rejected_when_budget_is_exhausted(monkeypatch):
+    async def must_not_be_called(self, input_image_list, prompt):
+        raise AssertionError("upstream should not be called")
+        yield
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", must_not_be_called)
+    monkeypatch.setattr(memory_budget, "_capacity", 1024)
+    monkeypatch.setattr(settings, "MEMORY_BUDGET_WAIT_SECONDS", 0.1)
+    rejected_before = rejected_counter.get()
+
+    # 其他请求占满预算
+    memory_budget.charge_bytes(1024)
+    try:
+        with TestClient(app) as client:
+            response = client.post(
+                "/createPicture",
+                files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+                data={"data": REQUEST_DATA}
+            )
+    finally:
+        memory_budget.free_bytes(1024)
+
+    assert response.status_code == 503
+    assert "内存不足" in response.json()["message"]
+    assert rejected_counter.get() == rejected_before + 1
+
+
+def test_memory_job_store_spills_outputs_under_pressure(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SAVED_DIR", str(tmp_path))
+    monkeypatch.setattr(memory_budget, "_capacity", 100)
+    store = MemoryJobStore()
+
+    async def run():
+        job = await store.create_job("job-1")
+        event = ImageStreamEvent(status=StreamStatusEnum.Generating, index=0, base64=fake_image(0), message="success")
+
+        memory_budget.charge_bytes(90)
+        try:
+            await store.append_event(job.job_id, event)
+        finally:
+            memory_budget.free_bytes(90)
+
+        # 内存中只保留事件元数据，图片已落盘
+        assert store._events[job.job_id][0].base64 is None
+        assert len(list(tmp_path.iterdir())) == 1
+        [(event_id, restored)] = await store.read_events(job.job_id, 0)
+        assert restored.base64 == fake_image(0)
+
+        # 内存充足时直接缓存，计入预算，删除任务后归还
+        before = memory_budget.used
+        monkeypatch.setattr(memory_budget, "_capacity", 10 * 1024 * 1024)
+        await store.append_event(job.job_id, event)
+        assert memory_budget.used == before + len(fake_image(0))
+        await store.delete_job(job.job_id)
+        assert memory_budget.used == before
+
+    asyncio.run(run())
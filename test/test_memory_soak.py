@@ -0,0 +1,123 @@
+"""
+测试请求内存统计与内存泄漏长稳测试：
+- 开启 REQUEST_MEMORY_TRACKING 时记录每个请求的内存峰值和结束时未释放的内存（日志、指标、慢请求记录）
+- 对假的上游连续生图，RSS 在预热后应保持稳定；次数通过环境变量 SOAK_ITERATIONS 调整
+  （CI 默认几百次，活动前用 SOAK_ITERATIONS=5000 跑完整的长稳测试）
+使用假的上游生成器，不调用真实的豆包接口
+"""
+import base64
+import gc
+import json
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from journey_poster import app
+from service.generation_Image import DoubaoImages
+from setting import settings
+from utils.flight_recorder import flight_recorder
+from utils.memory_tracker import MB, get_rss_bytes, memory_tracker, peak_alloc_histogram
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+SOAK_ITERATIONS = int(os.getenv("SOAK_ITERATIONS", "300"))
+# 预热后 RSS 允许的增长（MB），以及平均每个请求允许的增长（KB，持续泄漏即使很小也能发现）
+SOAK_RSS_TOLERANCE_MB = float(os.getenv("SOAK_RSS_TOLERANCE_MB", "32"))
+SOAK_GROWTH_PER_REQUEST_KB = float(os.getenv("SOAK_GROWTH_PER_REQUEST_KB", "8"))
+
+REQUEST_DATA = json.dumps({"city": "Paris", "gender": "Male", "mode": "Master", "master_mode_tags": {"style": "FutureTech"}})
+DEBUG_HEADERS = {"Authorization": "Bearer debug-secret"}
+
+# 与线上接近的生成结果：每张约 1.8MB 的 Base64
+OUTPUT_IMAGES = [
+    "data:image/png;base64," + base64.b64encode(os.urandom(1350 * 1024 + index)).decode("utf-8")
+    for index in range(4)
+]
+
+
+async def fake_seed_ream(self, input_image_list, prompt):
+    for image in OUTPUT_IMAGES:
+        yield image
+
+
+def generate(client: TestClient, path: str):
+    response = client.post(
+        path,
+        files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+        data={"data": REQUEST_DATA}
+    )
+    assert response.status_code == 200
+    return response
+
+
+@pytest.fixture
+def memory_tracking():
+    memory_tracker.configure(True)
+    yield
+    memory_tracker.configure(False)
+
+
+@contextmanager
+def without_pytest_log_capture():
+    # pytest 会在内存中保留测试期间的全部日志记录（每个请求约 12KB），长稳测试中看起来像泄漏
+    # 捕获日志的 handler 在测试函数执行时才挂到 root logger 上，所以要在测试函数内移除
+    root_logger = logging.getLogger()
+    capture_handlers = [handler for handler in root_logger.handlers if type(handler).__module__.startswith("_pytest")]
+    for handler in capture_handlers:
+        root_logger.removeHandler(handler)
+    try:
+        yield
+    finally:
+        for handler in capture_handlers:
+            root_logger.addHandler(handler)
+
+
+def test_request_peak_allocation_is_recorded(monkeypatch, memory_tracking):
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+    monkeypatch.setattr(settings, "DEBUG_TOKEN", "debug-secret")
+    flight_recorder.clear()
+    count = peak_alloc_histogram.get_count(path="/createPictureStream")
+
+    with TestClient(app) as client:
+        generate(client, "/createPictureStream")
+        [record] = client.get("/debug/slow", headers=DEBUG_HEADERS).json()["data"]["requests"]
+        text = client.get("/metrics").text
+
+    assert peak_alloc_histogram.get_count(path="/createPictureStream") == count + 1
+    # 峰值至少包含上传人像的 Base64 和一张生成结果的 SSE 事件
+    assert record["sizes"]["peak_alloc_bytes"] >= len(OUTPUT_IMAGES[0])
+    # TestClient 与服务在同一进程，客户端收到的响应体也计入，这里只检查有记录
+    assert 0 <= record["sizes"]["retained_bytes"] <= record["sizes"]["peak_alloc_bytes"]
+    assert 'journey_request_peak_alloc_bytes_bucket{path="/createPictureStream",le="+Inf"}' in text
+    assert "journey_process_rss_bytes" in text
+    flight_recorder.clear()
+
+
+def test_rss_stabilizes_under_soak(monkeypatch):
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+    paths = ("/createPicture", "/createPictureStream", "/createPictureStreamBinary")
+    warm_up = max(SOAK_ITERATIONS // 5, 30)
+    checkpoints = []
+
+    with without_pytest_log_capture(), TestClient(app) as client:
+        for index in range(warm_up + SOAK_ITERATIONS):
+            generate(client, paths[index % len(paths)])
+            if index + 1 == warm_up or (index + 1 - warm_up) % max(SOAK_ITERATIONS // 10, 1) == 0:
+                gc.collect()
+                checkpoints.append(get_rss_bytes())
+
+    baseline = checkpoints[0]
+    growth = [(rss - baseline) / MB for rss in checkpoints]
+    print(f"RSS 相对预热后的增长（MB）: {[round(value, 1) for value in growth]}")
+    assert max(growth) < SOAK_RSS_TOLERANCE_MB, growth
+    assert (checkpoints[-1] - baseline) / 1024 / SOAK_ITERATIONS < SOAK_GROWTH_PER_REQUEST_KB, growth
@@ -0,0 +1,144 @@
+"""
+测试监控指标：直方图导出格式、生图各阶段耗时、按错误码计数、进行中的生成数
+使用假的上游生成器 / 假的上游客户端，不调用真实的豆包接口
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from fastapi.testclient import TestClient
+
+import core.llm as llm
+from core.exceptions import ErrorCode, error_counter
+from core.llm import LLMConf, LLMModel
+from journey_poster import app
+from service.generation_Image import DoubaoImages
+from setting import settings
+from utils.metrics import Histogram, stage_duration
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+REQUEST_DATA = json.dumps({"city": "Paris", "gender": "Male", "mode": "Master", "master_mode_tags": {"style": "FutureTech"}})
+
+
+def fake_image(index: int) -> str:
+    return "data:image/png;base64," + base64.b64encode(f"image-{index}".encode("utf-8") * 100).decode("utf-8")
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_duration_seconds", "测试耗时", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 3):
+        histogram.observe(value, stage="a")
+
+    lines = histogram.render()
+    assert 'test_duration_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'test_duration_seconds_bucket{stage="a",le="1"} 3' in lines
+    assert 'test_duration_seconds_bucket{stage="a",le="+Inf"} 4' in lines
+    assert 'test_duration_seconds_count{stage="a"} 4' in lines
+    assert histogram.get_sum(stage="a") == 4.05
+
+
+def test_observe_overhead_is_small():
+    histogram = Histogram("test_overhead_seconds", "测试开销")
+    start_time = time.perf_counter()
+    for index in range(100000):
+        histogram.observe(index / 100000, stage="a")
+    # 单次记录远小于 10 微秒，常驻开启不影响请求耗时
+    assert time.perf_counter() - start_time < 1.0
+
+
+def test_stream_records_stages_and_in_flight_gauges(monkeypatch):
+    async def fake_seed_ream(self, input_image_list, prompt):
+        for index in range(4):
+            yield fake_image(index)
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+    stages = ("multipart_read", "request_parse", "upload_read", "image_validation", "prompt_build",
+              "queue_wait", "event_serialize", "sse_write")
+    before = {stage: stage_duration.get_count(stage=stage) for stage in stages}
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/createPictureStream",
+            files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+            data={"data": REQUEST_DATA}
+        )
+        assert '"status":"completed"' in response.text.replace(" ", "")
+        text = client.get("/metrics").text
+
+    for stage in stages:
+        assert stage_duration.get_count(stage=stage) > before[stage], stage
+    # queued 之外每个事件记录一次序列化和写出：4 张图片 + completed
+    assert stage_duration.get_count(stage="sse_write") - before["sse_write"] == 5
+
+    assert "# TYPE journey_stage_duration_seconds histogram" in text
+    assert 'journey_stage_duration_seconds_bucket{stage="prompt_build",le="+Inf"}' in text
+    assert "journey_generations_in_flight 0" in text
+    assert "journey_scheduler_running 0" in text
+    assert "journey_scheduler_queued 0" in text
+    assert "journey_jobs_running" in text
+    # 所有错误码都预先导出
+    for error_code in ErrorCode:
+        if error_code is not ErrorCode.SUCCESS:
+            assert f'code="{error_code.code}"' in text
+
+
+def test_errors_are_counted_by_code(monkeypatch):
+    param_errors = error_counter.get(code="20000", name="PARAM_ERROR")
+
+    with TestClient(app) as client:
+        # 既没有上传文件也没有 portraitId
+        response = client.post("/createPicture", data={"data": REQUEST_DATA})
+        assert response.status_code == 400
+        response = client.post("/createPictureStream", data={"data": REQUEST_DATA})
+        assert '"status": "failed"' in response.text
+
+    assert error_counter.get(code="20000", name="PARAM_ERROR") == param_errors + 2
+
+
+def test_upstream_stages_exclude_downstream_time(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_URL", "http://upstream.test/api/v3")
+    monkeypatch.setattr(settings, "LLM_API_KEY", "key")
+    monkeypatch.setattr(settings, "LLM_SCENE_ID", "model")
+
+    class FakeImages:
+        async def generate(self, **kwargs):
+            await asyncio.sleep(0.05)
+
+            async def events():
+                for index in range(3):
+                    await asyncio.sleep(0.1)
+                    yield SimpleNamespace(type="image_generation.partial_succeeded", b64_json=f"image-{index}")
+                yield SimpleNamespace(type="image_generation.completed", usage=None)
+
+            return events()
+
+    monkeypatch.setattr(llm, "get_image_client", lambda base_url, api_key: SimpleNamespace(images=FakeImages()))
+    stages = ("upstream_connect", "upstream_first_image", "upstream_image_gap", "upstream_total")
+    counts = {stage: stage_duration.get_count(stage=stage) for stage in stages}
+    sums = {stage: stage_duration.get_sum(stage=stage) for stage in stages}
+
+    async def run():
+        async for _ in LLMModel(LLMConf()).create_picture_by_seed_ream(["data:image/png;base64,AAAA"], "prompt"):
+            # 下游写出较慢，不应计入上游耗时
+            await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+
+    assert [stage_duration.get_count(stage=stage) - counts[stage] for stage in stages] == [1, 1, 2, 1]
+    assert stage_duration.get_sum(stage="upstream_connect") - sums["upstream_connect"] >= 0.05
+    assert stage_duration.get_sum(stage="upstream_first_image") - sums["upstream_first_image"] >= 0.15
+    gap = (stage_duration.get_sum(stage="upstream_image_gap") - sums["upstream_image_gap"]) / 2
+    assert 0.09 <= gap < 0.2
+    upstream_total = stage_duration.get_sum(stage="upstream_total") - sums["upstream_total"]
+    assert 0.35 <= upstream_total < 0.6
@@ -0,0 +1,117 @@
+"""
+测试多城市生成：一次请求传多个城市，人像只校验一次，各城市并发生成并合并到同一个 SSE 流
+使用假的上游生成器，不调用真实的豆包接口
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from fastapi.testclient import TestClient
+
+from journey_poster import app
+from service.generation_Image import DoubaoImages
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+CITIES = ["Paris", "Tokyo", "London"]
+
+REQUEST_DATA = json.dumps({
+    "cities": CITIES,
+    "gender": "Male",
+    "mode": "Master",
+    "master_mode_tags": {"style": "FutureTech"}
+})
+
+
+def fake_image(city: str, index: int) -> str:
+    return "data:image/png;base64," + base64.b64encode(f"{city}-{index}".encode("utf-8")).decode("utf-8")
+
+
+def city_of(prompt: str) -> str:
+    return next(city for city in CITIES if city in prompt)
+
+
+def post_stream(client: TestClient) -> list:
+    response = client.post(
+        "/createPictureStream",
+        files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+        data={"data": REQUEST_DATA}
+    )
+    return [json.loads(block[len("data: "):]) for block in response.text.split("\n\n") if block.startswith("data: ")]
+
+
+def test_cities_generate_concurrently_on_one_stream(monkeypatch):
+    verify_calls = []
+    original_verify = DoubaoImages.verify_input_image
+
+    def counting_verify(self, input_image_base64):
+        verify_calls.append(1)
+        return original_verify(self, input_image_base64)
+
+    started = []
+    all_started = None
+
+    async def fake_seed_ream(self, input_image_list, prompt):
+        nonlocal all_started
+        if all_started is None:
+            all_started = asyncio.Event()
+        # 全部城市都开始调用上游后才产出图片：串行执行会在这里超时
+        started.append(prompt)
+        if len(started) == len(CITIES):
+            all_started.set()
+        await asyncio.wait_for(all_started.wait(), 5)
+        city = city_of(prompt)
+        for index in range(4):
+            yield fake_image(city, index)
+            await asyncio.sleep(0)
+
+    monkeypatch.setattr(DoubaoImages, "verify_input_image", counting_verify)
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+    monkeypatch.setattr("core.prompt_strategy.PromptStrategy._get_city_scene_description", lambda self, city: city.value)
+
+    with TestClient(app) as client:
+        events = post_stream(client)
+
+    assert len(verify_calls) == 1
+    assert sorted(city_of(prompt) for prompt in started) == sorted(CITIES)
+
+    generating = [event for event in events if event["status"] == "generating"]
+    assert len(generating) == 12
+    for city in CITIES:
+        city_events = [event for event in generating if event["city"] == city]
+        assert [event["index"] for event in city_events] == [0, 1, 2, 3]
+        assert [event["base64"] for event in city_events] == [fake_image(city, i) for i in range(4)]
+
+    # 各城市的图片交错到达，结束事件只有一个且不带城市
+    assert [event["city"] for event in generating[:3]] != [CITIES[0]] * 3
+    assert events[-1]["status"] == "completed"
+    assert "city" not in events[-1]
+    assert "共生成 12 张图片" in events[-1]["message"]
+
+
+def test_one_city_failing_does_not_stop_others(monkeypatch):
+    async def fake_seed_ream(self, input_image_list, prompt):
+        city = city_of(prompt)
+        if city == "Tokyo":
+            raise RuntimeError("Tokyo upstream error")
+        for index in range(4):
+            yield fake_image(city, index)
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+    monkeypatch.setattr("core.prompt_strategy.PromptStrategy._get_city_scene_description", lambda self, city: city.value)
+
+    with TestClient(app) as client:
+        events = post_stream(client)
+
+    failed = [event for event in events[:-1] if event["status"] == "failed"]
+    assert failed == [{"status": "failed", "city": "Tokyo", "message": "Tokyo upstream error"}]
+    assert len([event for event in events if event["status"] == "generating"]) == 8
+    assert events[-1]["status"] == "completed"
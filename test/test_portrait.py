@@ -0,0 +1,165 @@
+"""
+测试人像会话：POST /portraits 上传一次，生成接口通过 portraitId 复用
+使用假的上游生成器，不调用真实的豆包接口
+"""
+import base64
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from fastapi.testclient import TestClient
+
+from core.image_utils import decode_base64_image
+from journey_poster import app
+from service import portrait_store as portrait_store_module
+from service.generation_Image import DoubaoImages
+from service.portrait_store import PortraitStore
+from setting import settings
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+OUTPUT_IMAGES = [
+    "data:image/png;base64," + base64.b64encode(os.urandom(1000 + i)).decode("utf-8")
+    for i in range(4)
+]
+
+
+def build_data(city: str, portrait_id: str) -> str:
+    return json.dumps({
+        "city": city,
+        "gender": "Male",
+        "mode": "Master",
+        "master_mode_tags": {"style": "FutureTech"},
+        "portraitId": portrait_id
+    })
+
+
+def parse_sse(text: str) -> list:
+    return [json.loads(block[len("data: "):]) for block in text.split("\n\n") if block.startswith("data: ")]
+
+
+def test_generate_with_portrait_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PORTRAIT_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "PORTRAIT_MAX_SIZE", 512)
+    upstream_inputs = []
+
+    async def fake_seed_ream(self, input_image_list, prompt):
+        upstream_inputs.append(input_image_list[0])
+        for image in OUTPUT_IMAGES:
+            yield image
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/portraits",
+            files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")}
+        )
+        assert response.status_code == 200
+        portrait = response.json()["data"]
+        assert portrait["expiresIn"] == settings.PORTRAIT_TTL_SECONDS
+
+        # 后续生成不再上传文件，也不再校验人像
+        def must_not_verify(self, input_image_base64):
+            raise AssertionError("portraitId 对应的人像不应重复校验")
+
+        monkeypatch.setattr(DoubaoImages, "verify_input_image", must_not_verify)
+        for city in ("Paris", "Tokyo"):
+            events = parse_sse(client.post(
+                "/createPictureStream", data={"data": build_data(city, portrait["portraitId"])}
+            ).text)
+            assert [event["status"] for event in events] == ["generating"] * 4 + ["completed"]
+
+        unknown = parse_sse(client.post("/createPictureStream", data={"data": build_data("Paris", "0" * 64)}).text)
+        assert unknown[-1]["status"] == "failed"
+        assert "人像不存在或已过期" in unknown[-1]["message"]
+
+    # 两次生成使用同一张标准化后的人像：JPEG，最长边不超过 PORTRAIT_MAX_SIZE
+    assert len(upstream_inputs) == 2
+    assert upstream_inputs[0] == upstream_inputs[1]
+    assert upstream_inputs[0].startswith("data:image/jpeg;base64,")
+    assert max(decode_base64_image(upstream_inputs[0]).size) <= 512
+
+
+def test_expired_portrait_returns_404(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PORTRAIT_DIR", str(tmp_path))
+
+    with TestClient(app) as client:
+        portrait_id = client.post(
+            "/portraits",
+            files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")}
+        ).json()["data"]["portraitId"]
+
+        monkeypatch.setattr(settings, "PORTRAIT_TTL_SECONDS", -1)
+        response = client.post("/createPicture", data={"data": build_data("Paris", portrait_id)})
+
+    assert response.status_code == 404
+    assert response.json()["success"] is False
+
+
+def test_missing_file_and_portrait_id():
+    with TestClient(app) as client:
+        data = json.dumps({"city": "Paris", "gender": "Male", "mode": "Master", "master_mode_tags": {"style": "FutureTech"}})
+        response = client.post("/createPicture", data={"data": data})
+
+    assert response.status_code == 400
+    assert "portraitId" in response.json()["message"]
+
+
+def test_concurrent_saves_of_same_portrait_in_one_process(monkeypatch, tmp_path):
+    # 双击上传或客户端重试：同一进程的多个线程同时保存同一张人像
+    store = PortraitStore(str(tmp_path), ttl_seconds=1800)
+    data_url = "data:image/jpeg;base64," + base64.b64encode(INPUT_IMAGE.read_bytes()[:4096]).decode("utf-8")
+    real_replace = os.replace
+    barrier = threading.Barrier(8)
+
+    def replace_together(src, dst):
+        # 所有线程都写完临时文件后再一起替换，复现临时文件互相覆盖的竞争
+        barrier.wait(timeout=10)
+        real_replace(src, dst)
+
+    monkeypatch.setattr(portrait_store_module.os, "replace", replace_together)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        portrait_ids = list(pool.map(lambda _: store._save(data_url), range(8)))
+
+    assert len(set(portrait_ids)) == 1
+    assert [p.name for p in tmp_path.iterdir()] == [f"{portrait_ids[0]}.txt"]
+    assert store._load(portrait_ids[0]) == data_url
+
+
+def test_reupload_after_concurrent_purge(monkeypatch, tmp_path):
+    store = PortraitStore(str(tmp_path), ttl_seconds=1800)
+    data_url = "data:image/jpeg;base64,AAAA"
+    portrait_id = store._save(data_url)
+    real_utime = os.utime
+
+    def purged_before_utime(path, *args, **kwargs):
+        # 判断存在之后、续期之前，文件被其他线程作为过期文件清理
+        Path(path).unlink(missing_ok=True)
+        real_utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(portrait_store_module.os, "utime", purged_before_utime)
+    assert store._save(data_url) == portrait_id
+    assert store._load(portrait_id) == data_url
+
+
+def test_purge_is_rate_limited(monkeypatch, tmp_path):
+    store = PortraitStore(str(tmp_path), ttl_seconds=1800, purge_interval_seconds=3600)
+    scans = []
+    monkeypatch.setattr(store, "_purge_expired", lambda: scans.append(1))
+
+    for index in range(5):
+        store._save(f"data:image/jpeg;base64,{index:04d}")
+    assert len(scans) == 1
+
+    store._purge_interval_seconds = 0
+    store._save("data:image/jpeg;base64,BBBB")
+    assert len(scans) == 2
@@ -0,0 +1,106 @@
+"""
+测试按需分析接口：CPU 采样输出折叠栈 / 热点函数、tracemalloc 快照与基线对比、调试接口认证
+"""
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from journey_poster import app
+from setting import settings
+from utils.profiler import IDLE_FUNCTIONS, CpuProfiler, ProfilerBusyError, memory_profiler
+
+DEBUG_HEADERS = {"Authorization": "Bearer debug-secret"}
+
+leaked_buffers = []
+
+
+def hot_function(stop: threading.Event):
+    total = 0
+    while not stop.is_set():
+        total += sum(range(1000))
+    return total
+
+
+def leaky_function():
+    for _ in range(50):
+        leaked_buffers.append(bytearray(100 * 1024))
+
+
+@pytest.fixture
+def busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=hot_function, args=(stop,), name="busy-worker")
+    thread.start()
+    yield
+    stop.set()
+    thread.join()
+
+
+def test_cpu_profile_finds_hot_function(busy_thread):
+    profile = CpuProfiler().profile(0.3, interval=0.005)
+
+    assert profile.samples >= 20
+    collapsed = profile.collapsed().splitlines()
+    hot_stacks = [line for line in collapsed if line.startswith("busy-worker;") and "hot_function" in line]
+    assert hot_stacks
+    stack, count = hot_stacks[0].rsplit(" ", 1)
+    assert int(count) > 0
+    # 栈从外到内：线程名、线程入口……热点函数
+    assert stack.split(";")[-1].startswith("hot_function (")
+    # 空闲等待的线程默认不计入
+    top_frames = [line.rsplit(" ", 1)[0].split(";")[-1] for line in collapsed]
+    assert not any(frame.split(" (")[0] in IDLE_FUNCTIONS for frame in top_frames)
+
+
+def test_only_one_cpu_profile_at_a_time():
+    profiler = CpuProfiler()
+    thread = threading.Thread(target=profiler.profile, args=(0.3,))
+    thread.start()
+    time.sleep(0.05)
+    with pytest.raises(ProfilerBusyError):
+        profiler.profile(0.1)
+    thread.join()
+    assert not profiler.running
+
+
+def test_profile_endpoints(monkeypatch, busy_thread):
+    monkeypatch.setattr(settings, "DEBUG_TOKEN", "debug-secret")
+
+    with TestClient(app) as client:
+        assert client.get("/debug/profile/cpu?seconds=0.1").status_code == 401
+
+        response = client.get("/debug/profile/cpu?seconds=0.2&interval_ms=2", headers=DEBUG_HEADERS)
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "hot_function" in response.text
+
+        body = client.get("/debug/profile/cpu?seconds=0.2&format=json&limit=5", headers=DEBUG_HEADERS).json()["data"]
+        assert body["samples"] > 0 and len(body["topFunctions"]) <= 5
+        assert any(item["function"].startswith("hot_function (") for item in body["topFunctions"])
+
+        # 未开启内存追踪
+        assert client.get("/debug/profile/memory/snapshot", headers=DEBUG_HEADERS).status_code == 409
+
+        assert client.post("/debug/profile/memory/start", headers=DEBUG_HEADERS).json()["data"]["tracing"]
+        try:
+            leaky_function()
+            body = client.get("/debug/profile/memory/snapshot?limit=5", headers=DEBUG_HEADERS).json()["data"]
+        finally:
+            assert client.post("/debug/profile/memory/stop", headers=DEBUG_HEADERS).status_code == 200
+            leaked_buffers.clear()
+
+    assert not memory_profiler.tracing
+    top = body["top"][0]
+    assert top["sizeDiff"] >= 50 * 100 * 1024
+    assert top["countDiff"] >= 50
+    # 按代码行分组：指向分配内存的那一行
+    assert "test_profiler.py" in top["traceback"][0]
+    assert "bytearray(100 * 1024)" in top["traceback"][1]
@@ -0,0 +1,162 @@
+"""
+测试生图调度器：优先级通道、同通道内按客户端轮转、排队事件推送
+使用假的上游生成器，不调用真实的豆包接口
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from core.enum import PriorityEnum
+from core.llm import LLMConf
+from model.createPictureReq import CreatePictureRequest
+from model.createPictureResp import StreamStatusEnum
+from service import generation_Image
+from service.generation_Image import DoubaoImages
+from service.scheduler import GenerationScheduler
+from setting import settings
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+OUTPUT_IMAGES = [
+    "data:image/png;base64," + base64.b64encode(os.urandom(1000 + i)).decode("utf-8")
+    for i in range(4)
+]
+
+
+def test_dispatch_order_priority_and_round_robin():
+    async def run():
+        scheduler = GenerationScheduler(max_workers=1, initial_service_seconds=10)
+        running = scheduler.submit("busy")
+        assert running.granted
+
+        # 客户端 a 连续提交 3 次，b、c 各提交 1 次，之后来了重试和 VIP 请求
+        a1 = scheduler.submit("a")
+        a2 = scheduler.submit("a")
+        a3 = scheduler.submit("a")
+        b1 = scheduler.submit("b")
+        c1 = scheduler.submit("c")
+        retry = scheduler.submit("d", PriorityEnum.Retry)
+        vip = scheduler.submit("e", PriorityEnum.VIP)
+
+        expected = [vip, retry, a1, b1, c1, a2, a3]
+        assert [scheduler.position(ticket) for ticket in expected] == list(range(1, 8))
+        assert scheduler.estimated_wait(a1) == 30.0
+
+        dispatched = []
+        current = running
+        for _ in expected:
+            scheduler.release(current)
+            current = next(ticket for ticket in expected if ticket.granted and ticket not in dispatched)
+            dispatched.append(current)
+        assert dispatched == expected
+
+        # 取消排队不占用名额
+        waiting = scheduler.submit("f")
+        scheduler.release(waiting)
+        assert scheduler.queue_length == 0
+        assert scheduler.running == 1
+
+    asyncio.run(run())
+
+
+def test_stream_emits_queued_events_when_full(monkeypatch):
+    release_upstream = None
+
+    async def fake_seed_ream(self, input_image_list, prompt):
+        await release_upstream.wait()
+        for image in OUTPUT_IMAGES:
+            yield image
+
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+    monkeypatch.setattr(settings, "SCHEDULER_QUEUE_EVENT_INTERVAL", 0.05)
+
+    async def run():
+        nonlocal release_upstream
+        release_upstream = asyncio.Event()
+        scheduler = GenerationScheduler(max_workers=1, initial_service_seconds=20)
+        monkeypatch.setattr(generation_Image, "scheduler", scheduler)
+
+        request = CreatePictureRequest(
+            city="London",
+            gender="Male",
+            mode="Master",
+            master_mode_tags={"style": "FutureTech"},
+            originPicBase64="data:image/jpeg;base64," + base64.b64encode(INPUT_IMAGE.read_bytes()).decode("utf-8")
+        )
+
+        async def collect(client_id: str):
+            picture_request = request.model_copy(update={"clientId": client_id})
+            return [event async for event in DoubaoImages(LLMConf()).generate_events_for_request(picture_request)]
+
+        first = asyncio.create_task(collect("first"))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(collect("second"))
+        await asyncio.sleep(0.2)
+        release_upstream.set()
+        return await first, await second
+
+    first_events, second_events = asyncio.run(run())
+
+    assert [event.status for event in first_events] == [StreamStatusEnum.Generating] * 4 + [StreamStatusEnum.Completed]
+
+    queued = [event for event in second_events if event.status == StreamStatusEnum.Queued]
+    assert len(queued) >= 2
+    assert queued[0].position == 1
+    assert queued[0].estimatedWait == 20.0
+    assert json.loads(queued[0].to_event_data()[len("data: "):]) == {
+        "status": "queued", "position": 1, "estimatedWait": 20.0, "message": "排队中，前面还有 0 人"
+    }
+    assert second_events[-1].status == StreamStatusEnum.Completed
+
+
+def test_priority_and_client_id_are_decided_by_server(monkeypatch):
+    from fastapi.testclient import TestClient
+    from journey_poster import app
+
+    submitted = []
+
+    class RecordingScheduler(GenerationScheduler):
+        def submit(self, client_id, priority=PriorityEnum.Normal):
+            submitted.append((client_id, priority))
+            return super().submit(client_id, priority)
+
+    async def fake_seed_ream(self, input_image_list, prompt):
+        for image in OUTPUT_IMAGES:
+            yield image
+
+    monkeypatch.setattr(generation_Image, "scheduler", RecordingScheduler(max_workers=4))
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+    monkeypatch.setattr(settings, "VIP_TOKEN", "vip-secret")
+
+    # 入参中的 priority / clientId（包括批量清单的行）被忽略
+    request = CreatePictureRequest(
+        city="London", gender="Male", mode="Master", master_mode_tags={"style": "FutureTech"},
+        priority="VIP", clientId="someone-else"
+    )
+    assert request.priority == PriorityEnum.Normal and request.clientId is None
+
+    data = json.dumps({
+        "city": "Paris", "gender": "Male", "mode": "Master", "master_mode_tags": {"style": "FutureTech"},
+        "priority": "VIP", "clientId": "rotating-1"
+    })
+    files = {"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")}
+    with TestClient(app) as client:
+        for headers in ({"X-Client-ID": "rotating-2"}, {"X-VIP-Token": "wrong"}, {"X-VIP-Token": "vip-secret"}):
+            response = client.post("/createPictureStream", files=files, data={"data": data}, headers=headers)
+            assert response.status_code == 200
+            assert '"completed"' in response.text
+
+    # 轮转按客户端IP，只有携带正确的 X-VIP-Token 才进入贵宾通道
+    assert submitted == [
+        ("testclient", PriorityEnum.Normal),
+        ("testclient", PriorityEnum.Normal),
+        ("testclient", PriorityEnum.VIP),
+    ]
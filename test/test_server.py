@@ -0,0 +1,121 @@
+"""
+测试多 worker 启动入口 server.py：
+- 主进程预加载并冻结对象后 fork 出 worker，共享同一个监听端口
+- worker 处理的请求数达到上限（或常驻内存超过阈值）后优雅退出，主进程重新拉起
+- 主进程收到 SIGTERM 后等待 worker 排空，全部退出后以 0 退出
+"""
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import httpx
+import uvicorn
+
+from journey_poster import app
+from server import WorkerServer
+from service.admission import admission
+from service.batch_manager import batch_manager
+from service.lifecycle import lifecycle
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_log(log_path: Path, text: str, timeout: float = 30.0) -> str:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        content = log_path.read_text(encoding="utf-8") if log_path.exists() else ""
+        if text in content:
+            return content
+        time.sleep(0.2)
+    raise AssertionError(f"{timeout}s 内未输出日志: {text}\n{content}")
+
+
+def test_worker_exits_when_rss_exceeds_limit():
+    server = WorkerServer(uvicorn.Config(app), max_rss_bytes=1, rss_check_seconds=0.1)
+    assert asyncio.run(server.on_tick(1))
+
+    server = WorkerServer(uvicorn.Config(app), max_rss_bytes=0, rss_check_seconds=0.1)
+    assert not asyncio.run(server.on_tick(1))
+
+
+def test_worker_flips_readiness_on_sigterm(monkeypatch):
+    # 收到 SIGTERM 时（uvicorn 停止接收连接之前）立即未就绪并停止准入
+    monkeypatch.setattr(lifecycle, "ready", True)
+    monkeypatch.setattr(admission, "accepting", True)
+    monkeypatch.setattr(batch_manager, "paused", False)
+    monkeypatch.setattr(lifecycle, "shutdown_started_at", None)
+    server = WorkerServer(uvicorn.Config(app))
+    server.handle_exit(signal.SIGTERM, None)
+
+    assert server.should_exit
+    assert lifecycle.ready is False
+    assert admission.accepting is False
+    assert batch_manager.paused is True
+
+
+def test_prefork_workers_recycle_and_drain(tmp_path):
+    port = free_port()
+    log_path = tmp_path / "server.log"
+    env = dict(
+        os.environ,
+        PYTHONPATH=str(PROJECT_ROOT),
+        LLM_URL="",
+        LLM_API_KEY="",
+        SERVER_HOST="127.0.0.1",
+        SERVER_PORT=str(port),
+        SERVER_WORKERS="2",
+        WORKER_MAX_REQUESTS="3",
+        WORKER_MAX_REQUESTS_JITTER="0",
+        SHUTDOWN_DRAIN_SECONDS="1",
+    )
+    with open(log_path, "w") as log_file:
+        process = subprocess.Popen(
+            [sys.executable, str(PROJECT_ROOT / "server.py")],
+            cwd=tmp_path, env=env, stdout=log_file, stderr=subprocess.STDOUT
+        )
+    try:
+        startup_log = wait_for_log(log_path, "已启动 worker 1")
+        assert "冻结对象" in startup_log
+
+        # 长连接：worker 退出时连接断开，换一个连接重试（由另一个 worker 或重新拉起的 worker 处理）
+        served = 0
+        deadline = time.monotonic() + 30
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5.0) as client:
+            while served < 20 and time.monotonic() < deadline:
+                try:
+                    if client.get("/ready").status_code == 200:
+                        served += 1
+                except httpx.HTTPError:
+                    time.sleep(0.1)
+        assert served == 20
+
+        log = wait_for_log(log_path, "重新拉起")
+        assert "Maximum request limit of 3 exceeded" in log
+    finally:
+        process.send_signal(signal.SIGTERM)
+        exit_code = process.wait(timeout=30)
+
+    log = log_path.read_text(encoding="utf-8")
+    assert exit_code == 0, log
+    assert "全部 worker 已退出" in log
+    assert "停机超时" not in log
+    # 主进程和每个 worker 各写自己的日志文件
+    log_files = sorted(path.name for path in (tmp_path / "logs").glob("app*.log"))
+    assert log_files == ["app.log", "app.worker-0.log", "app.worker-1.log"]
+    assert "worker 0 启动" in (tmp_path / "logs" / "app.worker-0.log").read_text(encoding="utf-8")
+    assert "worker 0 启动" not in (tmp_path / "logs" / "app.log").read_text(encoding="utf-8")
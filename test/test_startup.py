@@ -0,0 +1,117 @@
+"""
+测试冷启动：导入无副作用、重型依赖延迟加载、启动耗时预算
+- 导入 setting 不创建 logs/ 目录、不启动线程、不配置日志，由 init_runtime 显式初始化且可重复调用
+- 导入 journey_poster 不加载 openai / PIL / uvicorn，预热时在线程池中加载
+- 导入耗时和到就绪（GET /ready 返回 200）的耗时不超过预算，预算通过环境变量
+  STARTUP_IMPORT_BUDGET_SECONDS / STARTUP_READY_BUDGET_SECONDS 调整（CI 机器较慢时放宽）
+每项检查在独立的子进程中执行，不受其他测试已导入模块的影响
+"""
+import json
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+STARTUP_IMPORT_BUDGET_SECONDS = float(os.getenv("STARTUP_IMPORT_BUDGET_SECONDS", "1.0"))
+STARTUP_READY_BUDGET_SECONDS = float(os.getenv("STARTUP_READY_BUDGET_SECONDS", "3.0"))
+
+HEAVY_MODULES = ("openai", "PIL", "uvicorn", "httpx")
+RESULT_FILE = "startup_result.json"
+
+
+def run_python(code: str, cwd: Path) -> dict:
+    """
+    在新的解释器中执行代码，代码通过 report 把结果写到工作目录下的 JSON 文件（stdout 上有控制台日志）
+    """
+    code = f"import json\ndef report(value): open({RESULT_FILE!r}, 'w').write(json.dumps(value))\n" + textwrap.dedent(code)
+    env = dict(os.environ, PYTHONPATH=str(PROJECT_ROOT), LLM_URL="", LLM_API_KEY="")
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=cwd, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads((cwd / RESULT_FILE).read_text())
+
+
+def test_importing_setting_has_no_side_effects(tmp_path):
+    result = run_python("""
+        import logging, threading
+        handlers = len(logging.getLogger().handlers)
+        threads = threading.active_count()
+        import setting
+        before = {
+            "logs": (__import__("pathlib").Path("logs")).exists(),
+            "handlers": len(logging.getLogger().handlers) - handlers,
+            "threads": threading.active_count() - threads,
+        }
+        first = setting.init_runtime()
+        second = setting.init_runtime()
+        report({
+            "before": before,
+            "first": first,
+            "second": second,
+            "logs": (__import__("pathlib").Path("logs")).exists(),
+            "handlers": len(logging.getLogger().handlers) - handlers,
+        })
+    """, tmp_path)
+
+    assert result["before"] == {"logs": False, "handlers": 0, "threads": 0}
+    assert result["first"] is True and result["second"] is False
+    # 初始化后才创建日志目录，重复调用不会重复挂 handler
+    assert result["logs"] is True
+    assert result["handlers"] == 1
+
+
+def test_heavy_modules_are_loaded_lazily(tmp_path):
+    result = run_python(f"""
+        import sys
+        import journey_poster
+        from service.lifecycle import preload_modules
+        loaded_on_import = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+        preload_modules()
+        report({{
+            "import": loaded_on_import,
+            "preloaded": [name for name in ("openai", "PIL") if name in sys.modules],
+        }})
+    """, tmp_path)
+
+    assert result["import"] == []
+    assert result["preloaded"] == ["openai", "PIL"]
+
+
+def test_startup_within_budget(tmp_path):
+    result = run_python("""
+        import time
+        started = time.perf_counter()
+        from journey_poster import app
+        imported = time.perf_counter()
+        from fastapi.testclient import TestClient
+        from service.lifecycle import lifecycle
+        ready_started = time.perf_counter()
+        with TestClient(app) as client:
+            status = client.get("/ready").status_code
+            ready = time.perf_counter()
+            metrics = client.get("/metrics").text
+        report({
+            "import": imported - started,
+            "ready": ready - ready_started,
+            "status": status,
+            "recorded_import": lifecycle.import_seconds,
+            "metrics": [line for line in metrics.splitlines() if line.startswith("journey_startup_seconds")],
+        })
+    """, tmp_path)
+
+    print(f"冷启动耗时: 导入 {result['import']:.2f}s, 到就绪 {result['ready']:.2f}s")
+    assert result["status"] == 200
+    assert result["import"] < STARTUP_IMPORT_BUDGET_SECONDS, result
+    assert result["ready"] < STARTUP_READY_BUDGET_SECONDS, result
+    assert 0 < result["recorded_import"] <= result["import"]
+    assert any('phase="import"' in line for line in result["metrics"])
+    assert any('phase="warm_up"' in line for line in result["metrics"])
@@ -0,0 +1,66 @@
+"""
+测试二进制帧流式传输格式
+"""
+import base64
+import json
+import os
+import struct
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from model.createPictureResp import ImageStreamEvent, StreamStatusEnum
+
+
+def parse_frames(stream: bytes) -> list:
+    """按 [元数据长度][元数据][图片长度][图片] 格式解析帧，返回 (meta, payload) 列表"""
+    frames = []
+    offset = 0
+    while offset < len(stream):
+        (meta_length,) = struct.unpack_from(">I", stream, offset)
+        offset += 4
+        meta = json.loads(stream[offset:offset + meta_length].decode("utf-8"))
+        offset += meta_length
+        (payload_length,) = struct.unpack_from(">I", stream, offset)
+        offset += 4
+        frames.append((meta, stream[offset:offset + payload_length]))
+        offset += payload_length
+    return frames
+
+
+def test_binary_frames_round_trip():
+    image_bytes = os.urandom(50_000)
+    events = [
+        ImageStreamEvent(
+            status=StreamStatusEnum.Generating,
+            index=0,
+            base64="data:image/png;base64," + base64.b64encode(image_bytes).decode("utf-8"),
+            message="success"
+        ),
+        ImageStreamEvent(status=StreamStatusEnum.Completed, message="生成流程结束，共生成 1 张图片"),
+    ]
+    stream = b"".join(event.to_binary_frame() for event in events)
+
+    frames = parse_frames(stream)
+    assert frames[0] == (
+        {"status": "generating", "index": 0, "message": "success", "contentType": "image/png"},
+        image_bytes
+    )
+    assert frames[1] == ({"status": "completed", "message": "生成流程结束，共生成 1 张图片"}, b"")
+
+
+def test_binary_frame_is_smaller_than_sse_event():
+    image_base64 = "data:image/png;base64," + base64.b64encode(os.urandom(300_000)).decode("utf-8")
+    event = ImageStreamEvent(status=StreamStatusEnum.Generating, index=0, base64=image_base64, message="success")
+
+    sse_size = len(event.to_event_data().encode("utf-8"))
+    binary_size = len(event.to_binary_frame())
+    assert binary_size < sse_size * 0.76
+
+
+if __name__ == "__main__":
+    test_binary_frames_round_trip()
+    test_binary_frame_is_smaller_than_sse_event()
+    print("✓ 测试成功完成")
@@ -0,0 +1,82 @@
+"""
+测试 SSE 事件的分片写出（ImageStreamEvent.iter_event_chunks）
+验证输出与 to_event_data 逐字节一致，且单个大图事件的峰值内存约为 1 倍图片大小
+"""
+import base64
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from model.createPictureResp import ImageStreamEvent, StreamStatusEnum
+
+# 豆包 2K 输出的图片 Base64 后约 1.8MB
+PAYLOAD_RAW_SIZE = 1_350_000
+
+
+def make_image_event(raw_size: int = PAYLOAD_RAW_SIZE) -> ImageStreamEvent:
+    return ImageStreamEvent(
+        status=StreamStatusEnum.Generating,
+        index=2,
+        base64="data:image/png;base64," + base64.b64encode(os.urandom(raw_size)).decode("utf-8"),
+        message="success"
+    )
+
+
+def measure_peak(write) -> int:
+    """返回执行 write() 期间新增内存的峰值（字节）"""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        write()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - baseline
+
+
+def test_chunks_match_event_data():
+    events = [
+        make_image_event(10_000),
+        ImageStreamEvent(status=StreamStatusEnum.Preview, index=0, base64="data:image/jpeg;base64,/9j/AA==", message="preview"),
+        ImageStreamEvent(status=StreamStatusEnum.Completed, message="生成流程结束，共生成 4 张图片"),
+        ImageStreamEvent(status=StreamStatusEnum.Failed, message='含有 "引号" 的错误'),
+        # 需要转义的数据回退到普通序列化
+        ImageStreamEvent(status=StreamStatusEnum.Generating, index=1, base64='abc"\n', message="success"),
+    ]
+    for event in events:
+        chunks = list(event.iter_event_chunks(chunk_size=4096))
+        assert b"".join(bytes(chunk) for chunk in chunks) == event.to_event_data().encode("utf-8")
+
+
+def test_chunked_event_peak_memory_is_about_one_payload():
+    event = make_image_event()
+    payload_size = len(event.base64)
+
+    def write_chunks():
+        # 模拟 StreamingResponse 逐个分片写入 socket
+        written = 0
+        for chunk in event.iter_event_chunks():
+            written += len(chunk)
+        assert written > payload_size
+
+    def write_event_data():
+        written = len(event.to_event_data().encode("utf-8"))
+        assert written > payload_size
+
+    chunked_peak = measure_peak(write_chunks)
+    legacy_peak = measure_peak(write_event_data)
+    print(f"payload={payload_size}, chunked_peak={chunked_peak}, legacy_peak={legacy_peak}")
+
+    assert chunked_peak < payload_size * 1.2
+    assert legacy_peak > payload_size * 2
+
+
+if __name__ == "__main__":
+    test_chunks_match_event_data()
+    test_chunked_event_peak_memory_is_about_one_payload()
+    print("✓ 测试成功完成")
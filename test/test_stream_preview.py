@@ -0,0 +1,108 @@
+"""
+测试流式接口的缩略图预览推送
+使用假的上游生成器，不调用真实的豆包接口
+"""
+import asyncio
+import base64
+import json
+import sys
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from core.image_utils import create_thumbnail_base64, decode_base64_image
+from core.llm import LLMConf
+from service.generation_Image import DoubaoImages
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+REQUEST_DATA = {
+    "city": "Tokyo",
+    "gender": "Female",
+    "mode": "Master",
+    "master_mode_tags": {"style": "FrenchElegant", "material": "Silk", "color": "Neutral", "type": "Suit"}
+}
+
+
+def make_png_base64(width: int = 1200, height: int = 1600) -> str:
+    """构造一张 PNG 图片，模拟上游返回的原图"""
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def make_upload_file() -> UploadFile:
+    return UploadFile(
+        file=BytesIO(INPUT_IMAGE.read_bytes()),
+        filename=INPUT_IMAGE.name,
+        headers=Headers({"content-type": "image/jpeg"})
+    )
+
+
+async def collect_events(preview: bool, output_images: list) -> list:
+    async def fake_seed_ream(self, input_image_list, prompt):
+        for image in output_images:
+            yield image
+
+    service = DoubaoImages(LLMConf(api_key="test-key"))
+    service.create_picture_by_seed_ream = fake_seed_ream.__get__(service)
+    data = json.dumps(dict(REQUEST_DATA, preview=preview))
+
+    stream = b""
+    async for chunk in service.create_picture_stream(make_upload_file(), data):
+        stream += bytes(chunk)
+
+    events = []
+    for frame in stream.decode("utf-8").split("\n\n"):
+        if frame:
+            assert frame.startswith("data: ")
+            events.append(json.loads(frame[len("data: "):]))
+    return events
+
+
+def test_create_thumbnail_base64():
+    thumbnail = create_thumbnail_base64(make_png_base64(), max_size=256)
+    assert thumbnail.startswith("data:image/jpeg;base64,")
+
+    image = decode_base64_image(thumbnail)
+    assert max(image.size) == 256
+    assert image.format == "JPEG"
+
+
+def test_stream_with_preview():
+    output_images = [make_png_base64(), make_png_base64(800, 600)]
+    events = asyncio.run(collect_events(True, output_images))
+
+    statuses = [(event["status"], event.get("index")) for event in events]
+    assert statuses == [
+        ("preview", 0), ("generating", 0),
+        ("preview", 1), ("generating", 1),
+        ("completed", None)
+    ]
+    # 预览为小尺寸 JPEG，原图保持不变
+    assert events[0]["base64"].startswith("data:image/jpeg;base64,")
+    assert len(events[0]["base64"]) < len(output_images[0])
+    assert events[1]["base64"] == output_images[0]
+
+
+def test_stream_without_preview_keeps_original_events():
+    output_images = [make_png_base64()]
+    events = asyncio.run(collect_events(False, output_images))
+
+    assert [event["status"] for event in events] == ["generating", "completed"]
+    assert events[0]["base64"] == output_images[0]
+
+
+if __name__ == "__main__":
+    test_create_thumbnail_base64()
+    test_stream_with_preview()
+    test_stream_without_preview_keeps_original_events()
+    print("✓ 测试成功完成")
@@ -0,0 +1,168 @@
+"""
+测试请求ID 与链路追踪：请求ID 沿用/生成并写入响应头和日志、调用上游时携带请求ID 和 traceparent、
+各阶段 span 以 OTLP JSON 格式导出到本地文件
+使用假的上游生成器 / 假的上游客户端，不调用真实的豆包接口
+"""
+import asyncio
+import base64
+import json
+import logging
+import os
+import queue
+import re
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from fastapi.testclient import TestClient
+
+import core.llm as llm
+from core.llm import LLMConf, LLMModel
+from journey_poster import app
+from service.generation_Image import DoubaoImages
+from setting import settings
+from utils.logger import NonBlockingQueueHandler
+from utils.tracing import OtlpJsonFileExporter, request_id_var, tracer
+
+PROJECT_ROOT = Path(__file__).parent.parent
+INPUT_IMAGE = PROJECT_ROOT / "utils" / "pictures" / "input_demo.jpeg"
+
+REQUEST_DATA = json.dumps({"city": "Paris", "gender": "Male", "mode": "Master", "master_mode_tags": {"style": "FutureTech"}})
+
+
+def fake_image(index: int) -> str:
+    return "data:image/png;base64," + base64.b64encode(f"image-{index}".encode("utf-8") * 100).decode("utf-8")
+
+
+async def fake_seed_ream(self, input_image_list, prompt):
+    for index in range(4):
+        yield fake_image(index)
+
+
+def read_spans(path: Path) -> list:
+    spans = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        for resource_spans in json.loads(line)["resourceSpans"]:
+            for scope_spans in resource_spans["scopeSpans"]:
+                spans.extend(scope_spans["spans"])
+    return spans
+
+
+def test_request_id_is_propagated_or_generated():
+    with TestClient(app) as client:
+        response = client.get("/health", headers={"X-Request-ID": "req-from-gateway"})
+        assert response.headers["X-Request-ID"] == "req-from-gateway"
+        assert float(response.headers["X-Process-Time"]) >= 0
+
+        # 没有传入或格式不合法时生成新的请求ID
+        for headers in ({}, {"X-Request-ID": "bad id\nwith newline"}):
+            response = client.get("/health", headers=headers)
+            assert re.fullmatch(r"[0-9a-f]{32}", response.headers["X-Request-ID"])
+
+
+def test_log_records_carry_request_id(monkeypatch):
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+    handler = NonBlockingQueueHandler(queue.Queue())
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    try:
+        with TestClient(app) as client:
+            response = client.post(
+                "/createPictureStream",
+                files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+                data={"data": REQUEST_DATA},
+                headers={"X-Request-ID": "req-log-1"}
+            )
+            assert response.headers["X-Request-ID"] == "req-log-1"
+    finally:
+        root_logger.removeHandler(handler)
+
+    records = []
+    while not handler.queue.empty():
+        records.append(handler.queue.get_nowait())
+    service_records = [record for record in records if record.name == "service.generation_Image"]
+    assert service_records
+    assert all(record.request_id == "req-log-1" for record in service_records)
+    # 请求之外（如启动时）的日志没有请求ID
+    assert any(record.request_id == "-" for record in records)
+
+
+def test_upstream_call_carries_request_id_and_traceparent(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "LLM_URL", "http://upstream.test/api/v3")
+    monkeypatch.setattr(settings, "LLM_API_KEY", "key")
+    monkeypatch.setattr(settings, "LLM_SCENE_ID", "model")
+    monkeypatch.setattr(tracer, "exporter", OtlpJsonFileExporter(str(tmp_path / "traces.jsonl")))
+    calls = []
+
+    class FakeImages:
+        async def generate(self, **kwargs):
+            calls.append(kwargs["extra_headers"])
+
+            async def events():
+                yield SimpleNamespace(type="image_generation.partial_succeeded", b64_json="image-0")
+
+            return events()
+
+    monkeypatch.setattr(llm, "get_image_client", lambda base_url, api_key: SimpleNamespace(images=FakeImages()))
+
+    async def run():
+        request_id_var.set("req-upstream-1")
+        with tracer.span("request") as root:
+            async for _ in LLMModel(LLMConf()).create_picture_by_seed_ream(["data:image/png;base64,AAAA"], "prompt"):
+                pass
+        return root
+
+    root = asyncio.run(run())
+    [headers] = calls
+    assert headers["X-Request-ID"] == "req-upstream-1"
+    version, trace_id, span_id, flags = headers["traceparent"].split("-")
+    assert trace_id == root.trace_id
+
+    tracer.exporter.flush()
+    spans = {span["name"]: span for span in read_spans(tmp_path / "traces.jsonl")}
+    # traceparent 中的 span 即上游调用的 span
+    assert spans["upstream_connect"]["spanId"] == span_id
+    assert spans["upstream_connect"]["parentSpanId"] == root.span_id
+
+
+def test_request_timeline_is_exported_as_otlp_json(monkeypatch, tmp_path):
+    monkeypatch.setattr(DoubaoImages, "create_picture_by_seed_ream", fake_seed_ream)
+    trace_path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracer, "exporter", OtlpJsonFileExporter(str(trace_path)))
+    parent_trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/createPictureStream",
+            files={"file": (INPUT_IMAGE.name, INPUT_IMAGE.read_bytes(), "image/jpeg")},
+            data={"data": REQUEST_DATA},
+            headers={"X-Request-ID": "req-trace-1", "traceparent": f"00-{parent_trace_id}-00f067aa0ba902b7-01"}
+        )
+        assert '"status":"completed"' in response.text.replace(" ", "")
+        # 探活接口不记录 span
+        client.get("/health")
+    tracer.exporter.flush()
+
+    spans = [span for span in read_spans(trace_path) if span["traceId"] == parent_trace_id]
+    [root] = [span for span in spans if span["name"] == "POST /createPictureStream"]
+    assert root["kind"] == 2
+    assert root["parentSpanId"] == "00f067aa0ba902b7"
+    attributes = {item["key"]: item["value"] for item in root["attributes"]}
+    assert attributes["request.id"] == {"stringValue": "req-trace-1"}
+    assert attributes["http.status_code"] == {"intValue": "200"}
+
+    names = [span["name"] for span in spans]
+    for stage in ("multipart_read", "request_parse", "upload_read", "image_validation", "prompt_build", "queue_wait"):
+        assert stage in names, stage
+    assert names.count("sse_write") == 5
+    # 所有阶段都挂在根 span 下，且在根 span 的时间范围内
+    for span in spans:
+        if span is root:
+            continue
+        assert span["parentSpanId"] == root["spanId"]
+        assert int(root["startTimeUnixNano"]) <= int(span["startTimeUnixNano"]) <= int(span["endTimeUnixNano"]) <= int(root["endTimeUnixNano"])
+    assert not any(span["name"] == "GET /health" for span in read_spans(trace_path))
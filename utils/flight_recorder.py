@@ -0,0 +1,200 @@
+import heapq
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# 慢请求记录器：保留最近一段时间内最慢的 N 个请求的完整时间线（各阶段耗时、数据大小、
+# 上游事件序列、重试和最终状态），通过 GET /debug/slow 查看，不需要打开 DEBUG 日志
+# 记录挂在 contextvar 上，各处只做一次 contextvar 读取和列表追加；请求结束时才决定是否保留
+
+
+# 单个请求最多保留的阶段和上游事件条数，超出的只计数
+MAX_ENTRIES_PER_RECORD = 200
+
+_current_record: ContextVar[Optional["FlightRecord"]] = ContextVar("flight_record", default=None)
+
+
+def offset_ms(start: float, moment: float) -> float:
+    return round((moment - start) * 1000, 1)
+
+
+class FlightRecord:
+    """
+    单个请求的时间线，时间均为相对请求开始的毫秒数
+    """
+
+    __slots__ = (
+        "request_id", "method", "path", "started_at", "_start", "duration", "status_code",
+        "stages", "upstream_events", "sizes", "attempts", "errors", "final_event", "dropped", "finished"
+    )
+
+    def __init__(self, request_id: str, method: str, path: str):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration: float = 0.0
+        self.status_code: Optional[int] = None
+        self.stages: List[Tuple[str, float, float]] = []
+        self.upstream_events: List[Tuple[str, float, Optional[int]]] = []
+        self.sizes: Dict[str, int] = {}
+        self.attempts: List[Dict[str, Any]] = []
+        self.errors: List[Dict[str, Any]] = []
+        self.final_event: Optional[str] = None
+        self.dropped = 0
+        self.finished = False
+
+    def _append(self, entries: list, entry):
+        if len(entries) < MAX_ENTRIES_PER_RECORD:
+            entries.append(entry)
+        else:
+            self.dropped += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requestId": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "startedAt": datetime.fromtimestamp(self.started_at).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            "durationMs": round(self.duration * 1000, 1),
+            "statusCode": self.status_code,
+            "finalEvent": self.final_event,
+            "stages": [{"stage": name, "startMs": start, "durationMs": duration} for name, start, duration in self.stages],
+            "upstreamEvents": [
+                {"type": event_type, "atMs": at, **({"size": size} if size is not None else {})}
+                for event_type, at, size in self.upstream_events
+            ],
+            "sizes": dict(self.sizes),
+            "attempts": list(self.attempts),
+            "errors": list(self.errors),
+            "droppedEntries": self.dropped,
+        }
+
+
+def current_record() -> Optional[FlightRecord]:
+    record = _current_record.get()
+    # 请求已经结束（如请求内创建的后台任务还在执行），不再修改已保存的记录
+    if record is None or record.finished:
+        return None
+    return record
+
+
+def note_stage(stage: str, duration_seconds: float):
+    record = current_record()
+    if record is not None:
+        now = time.perf_counter()
+        record._append(record.stages, (stage, offset_ms(record._start, now - duration_seconds), round(duration_seconds * 1000, 1)))
+
+
+def note_upstream_event(event_type: Optional[str], size: Optional[int] = None):
+    record = current_record()
+    if record is not None:
+        record._append(record.upstream_events, (str(event_type), offset_ms(record._start, time.perf_counter()), size))
+
+
+def note_size(key: str, nbytes: int):
+    """
+    累加数据大小（字节），如上传人像、发送给上游的输入图片、生成结果
+    """
+    record = current_record()
+    if record is not None:
+        record.sizes[key] = record.sizes.get(key, 0) + nbytes
+
+
+def note_attempt(attempt: int, error: Optional[BaseException] = None):
+    record = current_record()
+    if record is not None:
+        entry = {"attempt": attempt, "atMs": offset_ms(record._start, time.perf_counter())}
+        if error is not None:
+            entry["error"] = f"{type(error).__name__}: {error}"[:500]
+        record._append(record.attempts, entry)
+
+
+def note_error(code: int, name: str, message: Optional[str] = None):
+    record = current_record()
+    if record is not None:
+        entry = {"code": code, "name": name, "atMs": offset_ms(record._start, time.perf_counter())}
+        if message:
+            entry["message"] = message[:500]
+        record._append(record.errors, entry)
+
+
+def note_final_event(status: str):
+    record = current_record()
+    if record is not None:
+        record.final_event = status
+
+
+class FlightRecorder:
+    """
+    保留时间窗口内最慢的 capacity 个请求（最小堆，新请求比堆顶慢时替换堆顶）
+    """
+
+    def __init__(self, capacity: int = 50, window_seconds: float = 3600):
+        self.capacity = capacity
+        self.window_seconds = window_seconds
+        self._heap: List[Tuple[float, int, FlightRecord]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def configure(self, capacity: int, window_seconds: float):
+        with self._lock:
+            self.capacity = capacity
+            self.window_seconds = window_seconds
+            self._prune()
+
+    def start(self, request_id: str, method: str, path: str):
+        """
+        开始记录当前请求，返回 contextvar token（finish 时传回）
+        """
+        record = FlightRecord(request_id, method, path)
+        return record, _current_record.set(record)
+
+    def finish(self, record: FlightRecord, token, status_code: Optional[int], error: Optional[BaseException] = None):
+        _current_record.reset(token)
+        record.finished = True
+        record.duration = time.perf_counter() - record._start
+        record.status_code = status_code
+        if error is not None and not record.errors:
+            record.errors.append({"name": type(error).__name__, "message": str(error)[:500]})
+        self.offer(record)
+
+    def offer(self, record: FlightRecord):
+        if self.capacity <= 0 or record.started_at < time.time() - self.window_seconds:
+            return
+        entry = (record.duration, next(self._sequence), record)
+        with self._lock:
+            self._prune()
+            if len(self._heap) < self.capacity:
+                heapq.heappush(self._heap, entry)
+            elif record.duration > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def snapshot(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        按耗时从高到低返回
+        """
+        with self._lock:
+            self._prune()
+            records = [record for _, _, record in sorted(self._heap, key=lambda entry: entry[0], reverse=True)]
+        return [record.to_dict() for record in records[:limit]]
+
+    def clear(self):
+        with self._lock:
+            self._heap.clear()
+
+    def _prune(self):
+        expire_before = time.time() - self.window_seconds
+        if any(record.started_at < expire_before for _, _, record in self._heap):
+            self._heap = [entry for entry in self._heap if entry[2].started_at >= expire_before]
+            heapq.heapify(self._heap)
+        while len(self._heap) > self.capacity:
+            heapq.heappop(self._heap)
+
+
+# 全局慢请求记录器，进程内只需要一个
+flight_recorder = FlightRecorder()
@@ -1,57 +1,242 @@
+import atexit
+import copy
+import json
 import logging
+import queue
+import re
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+from utils.metrics import metrics
+from utils.tracing import request_id_var
+
+# 日志管线：业务代码只把记录放进有界队列（截断 + 脱敏后），格式化和写文件在后台线程中完成，
+# 不占用事件循环时间；单条日志的处理开销与图片大小无关
+
+
+# 单条日志最多保留的字符数：先截断再做正则脱敏
+MAX_MESSAGE_CHARS = 4000
+
+# Base64 图片（data URL）和较长的 Base64 片段
+DATA_URL_PATTERN = re.compile(r'(data:image/[A-Za-z0-9.+-]+;base64,)[A-Za-z0-9+/=]+')
+BASE64_RUN_PATTERN = re.compile(r'[A-Za-z0-9+/]{200,}={0,2}')
+# api_key=xxx、Authorization: Bearer xxx 等形式的密钥
+SECRET_PATTERN = re.compile(
+    r'((?:api[_-]?key|authorization|bearer|secret|password)["\']?(?:\s*[:=]\s*|\s+)["\']?)([A-Za-z0-9._\-/+=]{8,})',
+    re.IGNORECASE
+)
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)-8s] [%(request_id)s] [%(filename)s:%(lineno)d] %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# LogRecord 自带的属性，其余属性视为 extra 传入的结构化字段
+STANDARD_RECORD_FIELDS = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime"}
+
+dropped_counter = metrics.counter("journey_log_dropped_total", "日志队列已满被丢弃的日志条数")
+
+# 需要从日志中抹掉的密钥原文（如 LLM_API_KEY）
+_secrets: Set[str] = set()
+_listener: Optional[QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def register_secret(value: Optional[str]):
+    """
+    登记密钥原文，之后的日志中出现时替换为 ***
+    """
+    if value and len(value) >= 6:
+        _secrets.add(value)
+
+
+def redact_message(message: str, max_chars: int = MAX_MESSAGE_CHARS) -> str:
+    """
+    截断过长的日志，并脱敏 Base64 图片和密钥
+    """
+    if len(message) > max_chars:
+        message = f"{message[:max_chars]}...（已截断，原长度 {len(message)} 字符）"
+    message = DATA_URL_PATTERN.sub(lambda m: f"{m.group(1)}<{len(m.group(0)) - len(m.group(1))} 字符>", message)
+    message = BASE64_RUN_PATTERN.sub(lambda m: f"<base64 {len(m.group(0))} 字符>", message)
+    for secret in _secrets:
+        message = message.replace(secret, "***")
+    return SECRET_PATTERN.sub(r"\1***", message)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    按 extra={"rate_limit": "<分组>"} 限流：每个分组每个时间窗口最多输出 per_window 条，
+    超出的丢弃并计数，下一个窗口的第一条日志带上省略条数（suppressed 字段）
+    没有 rate_limit 字段的日志不受影响
+    """
+
+    def __init__(self, per_window: int = 5, window_seconds: float = 1.0):
+        super().__init__()
+        self.per_window = per_window
+        self.window_seconds = window_seconds
+        # 分组 -> (窗口开始时间, 已输出条数, 已省略条数)
+        self._windows: Dict[str, Tuple[float, int, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "rate_limit", None)
+        if key is None or self.per_window <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            window_start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - window_start >= self.window_seconds:
+                if suppressed:
+                    record.suppressed = suppressed
+                window_start, count, suppressed = now, 0, 0
+            if count >= self.per_window:
+                self._windows[key] = (window_start, count, suppressed + 1)
+                return False
+            self._windows[key] = (window_start, count + 1, suppressed)
+            return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    在调用线程中只做截断和脱敏，然后放入有界队列；队列已满时丢弃并计数，不阻塞调用方
+    请求ID 在调用线程中从 contextvar 读取，后台线程中已经拿不到
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_chars: int = MAX_MESSAGE_CHARS):
+        super().__init__(log_queue)
+        self.max_chars = max_chars
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        try:
+            message = record.getMessage()
+        except Exception:
+            message = f"{record.msg} {record.args}"
+        message = redact_message(message, self.max_chars)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            message += f"（已省略 {suppressed} 条同类日志）"
+
+        record = copy.copy(record)
+        record.msg = message
+        record.message = message
+        record.args = None
+        record.request_id = request_id_var.get() or "-"
+        if record.exc_info:
+            record.exc_text = redact_message(self._exception_formatter.formatException(record.exc_info), self.max_chars)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_counter.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    结构化 JSON 日志，一行一条；extra 传入的字段（如 rate_limit、suppressed）原样输出
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": self.formatTime(record, DATE_FORMAT) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "file": f"{record.filename}:{record.lineno}",
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_RECORD_FIELDS:
+                payload[key] = value if isinstance(value, (str, int, float, bool)) or value is None else str(value)
+        if record.exc_text:
+            payload["exception"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def build_formatter(log_format: str) -> logging.Formatter:
+    if log_format == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+
 
 # Configure root logger
-def setup_logging(log_level="DEBUG"):
-    # Create logs directory if it doesn't exist
-    log_dir = Path("logs")
-    log_dir.mkdir(exist_ok=True)
-    
-    # Set up root logger
-    root_logger = logging.getLogger()
-    root_logger.setLevel(log_level)
-    
-    # Console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(log_level)
-    
-    # File handler
-    file_handler = RotatingFileHandler(
-        log_dir / "app.log",
-        maxBytes=10*1024*1024,  # 10MB
-        backupCount=5,
-        encoding='utf-8'
-    )
-    file_handler.setLevel(log_level)
-    
-    # Formatter
-    formatter = logging.Formatter(
-        '%(asctime)s [%(levelname)-8s] [%(filename)s:%(lineno)d] %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    
-    console_handler.setFormatter(formatter)
-    file_handler.setFormatter(formatter)
-    
-    # Remove any existing handlers
-    for handler in root_logger.handlers[:]:
-        root_logger.removeHandler(handler)
-        handler.close()
-    
-    # Add handlers
-    root_logger.addHandler(console_handler)
-    root_logger.addHandler(file_handler)
-    
-    # Set up uvicorn logger
-    uvicorn_logger = logging.getLogger("uvicorn")
-    uvicorn_logger.handlers = []
-    uvicorn_logger.propagate = True
-
-
-# 初始化日志配置
-setup_logging()
+def setup_logging(
+    log_level: str = "INFO",
+    log_format: str = "text",
+    queue_size: int = 10000,
+    rate_limit_per_second: int = 5,
+    log_dir: str = "logs",
+    log_file: str = "app.log"
+):
+    """
+    配置根日志：根 logger 上只挂一个非阻塞的队列 handler，控制台和文件 handler 在后台线程中输出
+    - 控制台按 log_format（text/json）输出，文件 logs/<log_file>（默认 app.log）固定为 JSON，便于采集
+    - 文件按大小轮转，轮转不跨进程加锁：多进程部署时每个进程使用不同的 log_file
+    - 可重复调用：已经配置过时只更新日志级别
+    """
+    global _listener
+    with _setup_lock:
+        root_logger = logging.getLogger()
+        root_logger.setLevel(log_level)
+        if _listener is not None:
+            for handler in _listener.handlers:
+                handler.setLevel(log_level)
+            return
+
+        # Create logs directory if it doesn't exist
+        Path(log_dir).mkdir(exist_ok=True)
+
+        # Console handler
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setLevel(log_level)
+        console_handler.setFormatter(build_formatter(log_format))
+
+        # File handler（在后台线程中写入，轮转不会阻塞请求）
+        file_handler = RotatingFileHandler(
+            Path(log_dir) / log_file,
+            maxBytes=10*1024*1024,  # 10MB
+            backupCount=5,
+            encoding='utf-8'
+        )
+        file_handler.setLevel(log_level)
+        file_handler.setFormatter(JsonFormatter())
+
+        queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+        queue_handler.addFilter(RateLimitFilter(per_window=rate_limit_per_second))
+
+        # Remove any existing handlers
+        for handler in root_logger.handlers[:]:
+            root_logger.removeHandler(handler)
+            handler.close()
+        root_logger.addHandler(queue_handler)
+
+        _listener = QueueListener(queue_handler.queue, console_handler, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+        # Set up uvicorn logger
+        uvicorn_logger = logging.getLogger("uvicorn")
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+
+def shutdown_logging():
+    """
+    停止后台日志线程，输出队列中剩余的日志
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
 
 # 导出 logger 实例供其他模块使用
 logger = logging.getLogger(__name__)
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+from utils.metrics import metrics
+
+# 事件循环延迟监控与阻塞调用检测
+# - 事件循环中的定时回调（call_later）每 interval 秒执行一次，实际执行时间与预期的差值即调度延迟，持续记录到直方图
+# - 看门狗线程检查定时回调的心跳，超过阈值没有更新说明事件循环被同步调用阻塞，
+#   此时抓取事件循环线程的调用栈（阻塞仍在进行，栈顶就是阻塞的代码）
+# - 事件循环恢复后记录本次阻塞的时长和调用栈，通过 GET /debug/loop 查看
+
+logger = logging.getLogger(__name__)
+
+# 最多保留的阻塞记录条数
+MAX_BLOCK_RECORDS = 20
+# 调用栈最多保留的帧数（从栈顶算起）
+MAX_STACK_FRAMES = 30
+
+loop_lag_histogram = metrics.histogram(
+    "journey_event_loop_lag_seconds",
+    "事件循环调度延迟（秒）",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+loop_blocked_counter = metrics.counter("journey_event_loop_blocked_total", "事件循环被阻塞超过阈值的次数")
+
+
+class LoopBlockedError(RuntimeError):
+    """
+    严格模式下事件循环被阻塞超过阈值（用于 CI 中让测试失败）
+    """
+
+
+class LoopMonitor:
+    """
+    事件循环延迟监控：start/stop 需要在被监控的事件循环中调用
+    """
+
+    def __init__(self, interval: float = 0.05, threshold_ms: float = 100, strict: bool = False):
+        self.interval = interval
+        self.threshold_ms = threshold_ms
+        self.strict = strict
+        self.blocks: Deque[Dict[str, Any]] = deque(maxlen=MAX_BLOCK_RECORDS)
+        self.max_lag = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._expected = 0.0
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = 0.0
+        # 看门狗抓到的调用栈：(心跳时间, 调用栈)，心跳时间用于对应到同一次阻塞
+        self._pending_stack: Optional[tuple] = None
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    def start(self, interval: Optional[float] = None, threshold_ms: Optional[float] = None, strict: Optional[bool] = None):
+        """
+        开始监控当前事件循环，重复调用时先停止上一次的监控
+        """
+        self.stop(check=False)
+        if interval is not None:
+            self.interval = interval
+        if threshold_ms is not None:
+            self.threshold_ms = threshold_ms
+        if strict is not None:
+            self.strict = strict
+        self.clear()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._stop_event = threading.Event()
+        self._loop = asyncio.get_running_loop()
+        self._schedule()
+        self._watchdog = threading.Thread(target=self._watch, args=(self._stop_event,), name="journey-loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self, check: bool = True):
+        """
+        停止监控；严格模式下监控期间发生过阻塞时抛出 LoopBlockedError
+        """
+        handle, self._handle = self._handle, None
+        self._loop = None
+        watchdog, self._watchdog = self._watchdog, None
+        if handle is not None:
+            handle.cancel()
+        if watchdog is not None:
+            self._stop_event.set()
+            watchdog.join(timeout=1)
+        if check and self.strict and self.blocks:
+            raise LoopBlockedError(
+                f"事件循环被阻塞 {len(self.blocks)} 次（阈值 {self.threshold_ms:.0f}ms）:\n"
+                + "\n".join(self.format_block(block) for block in self.blocks)
+            )
+
+    def clear(self):
+        with self._lock:
+            self.blocks.clear()
+            self._pending_stack = None
+        self.max_lag = 0.0
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """
+        最近的阻塞记录，按时间从新到旧
+        """
+        with self._lock:
+            return list(reversed(self.blocks))
+
+    @staticmethod
+    def format_block(block: Dict[str, Any]) -> str:
+        stack = "".join(block["stack"]) if block["stack"] else "  （未捕获到调用栈）\n"
+        return f"- {block['at']} 阻塞 {block['durationMs']}ms\n{stack}"
+
+    def _schedule(self):
+        self._expected = time.perf_counter() + self.interval
+        self._handle = self._loop.call_later(self.interval, self._tick)
+
+    def _tick(self):
+        if self._loop is None:
+            return
+        now = time.perf_counter()
+        lag = max(0.0, now - self._expected)
+        previous_heartbeat = self._heartbeat
+        self._heartbeat = now
+        loop_lag_histogram.observe(lag)
+        if lag > self.max_lag:
+            self.max_lag = lag
+        if lag * 1000 >= self.threshold_ms:
+            self._record_block(lag, previous_heartbeat)
+        self._schedule()
+
+    def _record_block(self, lag: float, heartbeat: float):
+        with self._lock:
+            pending, self._pending_stack = self._pending_stack, None
+            stack = pending[1] if pending is not None and pending[0] == heartbeat else None
+            block = {
+                "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+                "durationMs": round(lag * 1000, 1),
+                "stack": stack,
+            }
+            self.blocks.append(block)
+        loop_blocked_counter.inc()
+        location = stack[-1].strip().splitlines()[0] if stack else "未捕获到调用栈"
+        logger.warning(
+            f"事件循环被阻塞 {block['durationMs']}ms（阈值 {self.threshold_ms:.0f}ms）: {location}",
+            extra={"rate_limit": "loop_block"}
+        )
+
+    def _watch(self, stop_event: threading.Event):
+        # 检查间隔取阈值的 1/4：阻塞时长略超过阈值时也有机会抓到调用栈
+        check_interval = max(self.threshold_ms / 4000, 0.005)
+        block_after = self.interval + self.threshold_ms / 1000
+        while not stop_event.wait(check_interval):
+            heartbeat = self._heartbeat
+            if time.perf_counter() - heartbeat < block_after:
+                continue
+            with self._lock:
+                # 同一次阻塞只抓取一次
+                if self._pending_stack is not None and self._pending_stack[0] == heartbeat:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)[-MAX_STACK_FRAMES:]
+            with self._lock:
+                self._pending_stack = (heartbeat, stack)
+
+
+# 全局事件循环监控，进程内只需要一个（多 worker 时每个进程各自监控）
+loop_monitor = LoopMonitor()
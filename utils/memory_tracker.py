@@ -0,0 +1,132 @@
+import logging
+import os
+import resource
+import sys
+import threading
+import tracemalloc
+from contextvars import ContextVar
+from typing import Optional, Tuple
+from utils.flight_recorder import note_size
+from utils.metrics import metrics
+
+# 单个请求的内存占用统计（可选，REQUEST_MEMORY_TRACKING 开启时生效）
+# - 依赖 tracemalloc（只记录 1 层调用栈，开销约 10%~20% CPU），统计 Python 对象分配的字节数
+# - 请求开始时记录当前已分配字节数，各阶段结束时采样一次（trace_stage / record_stage），
+#   取最大值作为请求期间的峰值，请求结束时的差值即请求结束后仍未释放的内存
+# - 分配器是进程共享的：并发请求时峰值包含同一时段其他请求的分配，只能作为上限参考；
+#   串行压测（如 test/test_memory_soak.py）时是精确值
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+_current_usage: ContextVar[Optional["RequestMemoryUsage"]] = ContextVar("request_memory_usage", default=None)
+
+# 请求内存的直方图分桶（字节）：64KB ~ 500MB
+MEMORY_BUCKETS = (64 * 1024, 256 * 1024, 1 * MB, 2 * MB, 5 * MB, 10 * MB, 20 * MB, 50 * MB, 100 * MB, 200 * MB, 500 * MB)
+
+
+def get_rss_bytes() -> int:
+    """
+    当前进程的常驻内存（RSS），Linux 读取 /proc/self/statm，其他系统返回历史峰值
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 单位为字节，Linux 为 KB
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def get_traced_bytes() -> int:
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+
+peak_alloc_histogram = metrics.histogram("journey_request_peak_alloc_bytes", "请求期间新分配内存的峰值（字节）", buckets=MEMORY_BUCKETS)
+retained_histogram = metrics.histogram("journey_request_retained_bytes", "请求结束时仍未释放的内存（字节）", buckets=MEMORY_BUCKETS)
+metrics.gauge("journey_process_rss_bytes", "进程常驻内存 RSS（字节）", callback=get_rss_bytes)
+metrics.gauge("journey_traced_memory_bytes", "tracemalloc 统计的已分配内存（字节），未开启追踪时为 0", callback=get_traced_bytes)
+
+
+class RequestMemoryUsage:
+    """
+    单个请求的内存占用（相对请求开始时的字节数）
+    """
+
+    __slots__ = ("start_bytes", "peak_bytes", "finished")
+
+    def __init__(self):
+        self.start_bytes = tracemalloc.get_traced_memory()[0]
+        self.peak_bytes = self.start_bytes
+        self.finished = False
+
+    def sample(self) -> int:
+        current = tracemalloc.get_traced_memory()[0]
+        if current > self.peak_bytes:
+            self.peak_bytes = current
+        return current
+
+
+def sample_request_memory():
+    """
+    采样当前请求的内存占用，未开启统计时只有一次 contextvar 读取
+    """
+    usage = _current_usage.get()
+    if usage is not None and not usage.finished:
+        usage.sample()
+
+
+class RequestMemoryTracker:
+    """
+    请求内存统计：configure 开启后，每个请求 start/finish 一次
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._enabled = False
+        self._started_tracing = False
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled and tracemalloc.is_tracing()
+
+    def configure(self, enabled: bool, frames: int = 1):
+        """
+        开启或关闭统计；只停止由本统计开启的 tracemalloc（/debug/profile/memory 开启的不受影响）
+        """
+        with self._lock:
+            self._enabled = enabled
+            if enabled and not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self._started_tracing = True
+            elif not enabled and self._started_tracing:
+                self._started_tracing = False
+                if tracemalloc.is_tracing():
+                    tracemalloc.stop()
+
+    def start(self) -> Tuple[Optional[RequestMemoryUsage], object]:
+        if not self.enabled:
+            return None, None
+        usage = RequestMemoryUsage()
+        return usage, _current_usage.set(usage)
+
+    def finish(self, usage: Optional[RequestMemoryUsage], token, path: str):
+        if usage is None:
+            return
+        _current_usage.reset(token)
+        usage.finished = True
+        if not tracemalloc.is_tracing():
+            return
+        end_bytes = usage.sample()
+        peak = usage.peak_bytes - usage.start_bytes
+        retained = max(end_bytes - usage.start_bytes, 0)
+        peak_alloc_histogram.observe(peak, path=path)
+        retained_histogram.observe(retained, path=path)
+        note_size("peak_alloc_bytes", peak)
+        note_size("retained_bytes", retained)
+        logger.info(f"请求内存: {path} 峰值 +{peak / MB:.1f}MB, 结束时 +{retained / MB:.1f}MB")
+
+
+# 全局请求内存统计，进程内只需要一个
+memory_tracker = RequestMemoryTracker()
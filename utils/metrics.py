@@ -0,0 +1,185 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+# 进程内监控指标，通过 GET /metrics 以 Prometheus 文本格式导出
+# 不依赖 prometheus_client，够用即可
+
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+
+def format_labels(labels: LabelValues) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def format_value(value: float) -> str:
+    # 整数按整数输出，避免大数值（如字节数）被科学计数法截断精度
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """
+    单调递增计数器，支持标签
+    """
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{format_labels(labels)} {format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    瞬时值，可增可减，支持标签；传入 callback 时在导出时读取当前值（无标签）
+    """
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, description: str, callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, description)
+        self.callback = callback
+
+    def set(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        if self.callback is not None:
+            self.set(self.callback())
+        return super().render()
+
+
+class Histogram:
+    """
+    直方图（累计分桶 + 总和 + 次数），支持标签
+    observe 只做一次二分查找和一次加锁累加，常驻开启的开销可以忽略
+    """
+
+    metric_type = "histogram"
+
+    # 覆盖毫秒级的本地处理到分钟级的上游生成
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+    def __init__(self, name: str, description: str, buckets: Optional[Sequence[float]] = None):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets or self.DEFAULT_BUCKETS))
+        # 标签 -> [各分桶计数（最后一个为 +Inf）, 总和, 次数]
+        self._values: Dict[LabelValues, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str):
+        """
+        记录代码块的耗时（秒），代码块抛出异常时同样记录
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def get_count(self, **labels: str) -> int:
+        state = self._values.get(tuple(sorted(labels.items())))
+        return state[2] if state else 0
+
+    def get_sum(self, **labels: str) -> float:
+        state = self._values.get(tuple(sorted(labels.items())))
+        return state[1] if state else 0.0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = sorted((labels, (list(state[0]), state[1], state[2])) for labels, state in self._values.items())
+        for labels, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else format_value(bound)
+                lines.append(f"{self.name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    指标注册表，同名指标只注册一次
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Union[Counter, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, description: str) -> Counter:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, description)
+            return self._metrics[name]
+
+    def gauge(self, name: str, description: str, callback: Optional[Callable[[], float]] = None) -> Gauge:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Gauge(name, description, callback)
+            return self._metrics[name]
+
+    def histogram(self, name: str, description: str, buckets: Optional[Sequence[float]] = None) -> Histogram:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, description, buckets)
+            return self._metrics[name]
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标注册表，进程内只需要一个
+metrics = MetricsRegistry()
+
+# 生图请求各阶段耗时，stage 取值见接口文档「监控指标」一节
+stage_duration = metrics.histogram("journey_stage_duration_seconds", "生图请求各阶段耗时（秒）")
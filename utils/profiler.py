@@ -0,0 +1,220 @@
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+# 线上按需分析：不需要重新部署、不需要安装额外工具
+# - CPU 采样：后台线程定时读取所有线程的调用栈（sys._current_frames），按折叠栈格式计数，
+#   输出可直接交给 flamegraph.pl / speedscope / inferno 生成火焰图
+# - 内存快照：tracemalloc 记录分配位置，与基线快照对比找出增长最多的代码行
+# 采样和快照都只在调用调试接口时进行，平时没有开销
+
+
+# 栈顶（最内层的 Python 帧）为这些函数时线程处于空闲等待：事件循环 select、条件变量 wait、线程池等任务
+IDLE_FUNCTIONS = frozenset({"select", "poll", "wait", "_wait_for_tstate_lock", "accept", "_worker"})
+
+
+class ProfilerBusyError(RuntimeError):
+    """
+    同一时间只允许一个 CPU 采样
+    """
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    # 只保留项目内的相对路径 / 第三方库的包路径，火焰图上更易读
+    for marker in ("site-packages/", "lib/python"):
+        index = filename.find(marker)
+        if index >= 0:
+            filename = filename[index + len(marker):]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class CpuProfile:
+    """
+    一次 CPU 采样的结果：折叠栈 -> 采样次数
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = 0
+        self.duration = 0.0
+        self.stacks: Counter = Counter()
+
+    def collapsed(self) -> str:
+        """
+        折叠栈格式：每行 "线程;外层函数;...;栈顶函数 次数"
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit: int = 30) -> List[Dict[str, Any]]:
+        """
+        按自身耗时（位于栈顶的采样数）排序的函数
+        """
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            self_counts[frames[-1]] += count
+            for frame in set(frames):
+                total_counts[frame] += count
+        return [
+            {
+                "function": function,
+                "selfSamples": count,
+                "totalSamples": total_counts[function],
+                "selfPercent": round(count * 100 / max(self.samples, 1), 1),
+            }
+            for function, count in self_counts.most_common(limit)
+        ]
+
+    def to_dict(self, limit: int = 30) -> Dict[str, Any]:
+        return {
+            "durationSeconds": round(self.duration, 3),
+            "intervalMs": round(self.interval * 1000, 3),
+            "samples": self.samples,
+            "topFunctions": self.top_functions(limit),
+        }
+
+
+class CpuProfiler:
+    """
+    采样式 CPU 分析：每隔 interval 秒读取一次所有线程的调用栈
+    采样线程本身不计入
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def profile(self, seconds: float, interval: float = 0.005, include_idle: bool = False) -> CpuProfile:
+        """
+        阻塞采样 seconds 秒（在线程中调用，不要在事件循环中直接调用）
+        include_idle 为 False 时忽略栈顶为等待函数（见 IDLE_FUNCTIONS）的样本
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("已有 CPU 采样在进行中")
+        try:
+            return self._sample(seconds, interval, include_idle)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float, include_idle: bool) -> CpuProfile:
+        profile = CpuProfile(interval)
+        own_thread_id = threading.get_ident()
+        start_time = time.perf_counter()
+        deadline = start_time + seconds
+        while True:
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                if not include_idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(frame_label(frame))
+                    frame = frame.f_back
+                frames.append(thread_names.get(thread_id, str(thread_id)))
+                profile.stacks[";".join(reversed(frames))] += 1
+            profile.samples += 1
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            time.sleep(min(interval, deadline - now))
+        profile.duration = time.perf_counter() - start_time
+        return profile
+
+
+class MemoryProfiler:
+    """
+    tracemalloc 快照：start 时开始追踪并记录基线，snapshot 与基线对比
+    追踪期间所有内存分配都有额外开销（约 10%~30% CPU、每个分配块额外几十字节），用完应 stop
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._started_tracing = False
+        self.started_at: Optional[float] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 25):
+        """
+        开始追踪并记录基线快照；已经在追踪时只重新记录基线（调用栈深度沿用已开启时的设置）
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self._started_tracing = True
+            if self.started_at is None:
+                self.started_at = time.time()
+            self._baseline = self._take_snapshot()
+
+    def stop(self):
+        """
+        停止追踪；tracemalloc 由请求内存统计（REQUEST_MEMORY_TRACKING）开启时保持开启
+        """
+        with self._lock:
+            self._baseline = None
+            self.started_at = None
+            if self._started_tracing and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self._started_tracing = False
+
+    def snapshot(self, limit: int = 30, key_type: str = "lineno", rebase: bool = False) -> Dict[str, Any]:
+        """
+        当前快照与基线对比，按增长的字节数排序
+        key_type: "lineno"（按代码行）| "filename"（按文件）| "traceback"（按完整调用栈）
+        rebase 为 True 时以本次快照作为新的基线
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing() or self._baseline is None:
+                raise RuntimeError("内存追踪未开启")
+            snapshot = self._take_snapshot()
+            stats = snapshot.compare_to(self._baseline, key_type)
+            if rebase:
+                self._baseline = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracingSeconds": round(time.time() - self.started_at, 1) if self.started_at else None,
+            "tracedBytes": current,
+            "peakTracedBytes": peak,
+            "sizeDiffBytes": sum(stat.size_diff for stat in stats),
+            "top": [
+                {
+                    "size": stat.size,
+                    "sizeDiff": stat.size_diff,
+                    "count": stat.count,
+                    "countDiff": stat.count_diff,
+                    "traceback": stat.traceback.format(),
+                }
+                for stat in stats[:limit]
+            ],
+        }
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+
+# 全局分析器，进程内只需要一个（多 worker 时只分析处理该调试请求的 worker）
+cpu_profiler = CpuProfiler()
+memory_profiler = MemoryProfiler()
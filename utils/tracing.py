@@ -0,0 +1,348 @@
+import atexit
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from utils.flight_recorder import note_stage
+from utils.memory_tracker import sample_request_memory
+from utils.metrics import metrics, stage_duration
+
+# 请求ID 和轻量级链路追踪
+# - 请求ID 通过 contextvar 传递，写入每条日志和上游请求头
+# - span 记录生图管线各阶段的起止时间，结束时放入队列，由后台线程按 OTLP JSON 格式
+#   （每行一个 ExportTraceServiceRequest）追加写入本地文件，可以直接导入 Jaeger / OTel Collector
+
+
+# 外部传入的请求ID 只接受常见字符，避免日志注入
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:\-]{1,128}$')
+# W3C traceparent: 00-<trace_id>-<parent_id>-<flags>
+TRACEPARENT_PATTERN = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+# OTLP SpanKind
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+# OTLP StatusCode
+STATUS_CODE_ERROR = 2
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+dropped_span_counter = metrics.counter("journey_trace_dropped_spans_total", "导出队列已满被丢弃的 span 数")
+
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """
+    沿用客户端/网关传入的请求ID（格式合法时），否则生成新的
+    """
+    if incoming and REQUEST_ID_PATTERN.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+def get_request_id() -> Optional[str]:
+    return request_id_var.get()
+
+
+def propagation_headers(span: Optional["Span"] = None) -> Dict[str, str]:
+    """
+    调用上游时携带的请求头：X-Request-ID 和 W3C traceparent（上游支持时可以串联链路）
+    """
+    headers = {}
+    request_id = request_id_var.get()
+    if request_id is not None:
+        headers["X-Request-ID"] = request_id
+    span = span or _current_span.get()
+    if span is not None:
+        headers["traceparent"] = span.traceparent
+    return headers
+
+
+class Span:
+    """
+    一段有起止时间的操作，时间为 Unix 纳秒
+    """
+
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str] = None,
+                 kind: int = SPAN_KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None, start_ns: Optional[int] = None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in self.attributes.items()],
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        if self.error is not None:
+            span["status"] = {"code": STATUS_CODE_ERROR, "message": self.error}
+        return span
+
+
+def otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpJsonFileExporter:
+    """
+    span 导出：调用方只做一次 put_nowait，队列已满时丢弃并计数；后台线程批量写文件
+    """
+
+    def __init__(self, path: str, service_name: str = "journey-poster", queue_size: int = 10000, batch_size: int = 512):
+        self.path = Path(path)
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            dropped_span_counter.inc()
+
+    def flush(self):
+        """
+        等待队列中的 span 全部写入文件
+        """
+        if self._thread is not None:
+            self._queue.join()
+
+    def shutdown(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout=5)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="journey-trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            spans: List[Span] = []
+            stop = False
+            item = self._queue.get()
+            taken = 1
+            while True:
+                if item is None:
+                    stop = True
+                else:
+                    spans.append(item)
+                if stop or len(spans) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                    taken += 1
+                except queue.Empty:
+                    break
+            try:
+                if spans:
+                    self._write(spans)
+            except Exception:
+                # 导出失败不影响服务，也不能写日志（日志中可能再次产生 span）
+                pass
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, spans: List[Span]):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": "journey"}, "spans": [span.to_otlp() for span in spans]}],
+            }]
+        }
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+
+
+class Tracer:
+    """
+    最小化的 span 追踪器：当前 span 保存在 contextvar 中，子 span 自动挂到当前 span 下
+    未启用或没有导出器时不创建 span，开销只有一次 contextvar 读取
+    """
+
+    def __init__(self):
+        self.exporter: Optional[OtlpJsonFileExporter] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    @staticmethod
+    def current_span() -> Optional[Span]:
+        return _current_span.get()
+
+    def start_span(self, name: str, kind: int = SPAN_KIND_INTERNAL, traceparent: Optional[str] = None,
+                   attributes: Optional[Dict[str, Any]] = None, start_ns: Optional[int] = None) -> Optional[Span]:
+        """
+        创建 span（不设为当前 span）：有当前 span 时作为其子 span，否则沿用 traceparent 或新建链路
+        """
+        if not self.enabled:
+            return None
+        parent = _current_span.get()
+        if parent is not None:
+            return Span(name, parent.trace_id, parent.span_id, kind, attributes, start_ns)
+        match = TRACEPARENT_PATTERN.match(traceparent or "")
+        if match:
+            return Span(name, match.group(1), match.group(2), kind, attributes, start_ns)
+        return Span(name, os.urandom(16).hex(), None, kind, attributes, start_ns)
+
+    def end_span(self, span: Optional[Span], error: Optional[BaseException] = None):
+        if span is None:
+            return
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        request_id = request_id_var.get()
+        if request_id is not None:
+            span.attributes.setdefault("request.id", request_id)
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    @contextmanager
+    def activate(self, span: Optional[Span]):
+        """
+        将已创建的 span 设为当前 span（不负责结束）
+        """
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+
+    @contextmanager
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes: Any):
+        """
+        记录代码块为一个 span，代码块内创建的 span 都是它的子 span
+        注意：不要跨越异步生成器的 yield 使用（恢复执行时可能处于不同的上下文）
+        """
+        span = self.start_span(name, kind, attributes=attributes)
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, e)
+            raise
+        else:
+            self.end_span(span)
+        finally:
+            _current_span.reset(token)
+
+    def record_span(self, name: str, duration_seconds: float, start_ns: Optional[int] = None, **attributes: Any):
+        """
+        记录一个已经结束的 span（结束时间为当前时间），用于耗时分段统计、不方便包成代码块的阶段
+        """
+        if not self.enabled:
+            return
+        end_ns = time.time_ns()
+        if start_ns is None:
+            start_ns = end_ns - int(duration_seconds * 1e9)
+        span = self.start_span(name, attributes=attributes, start_ns=start_ns)
+        self.end_span(span)
+
+
+@contextmanager
+def trace_stage(stage: str, **attributes: Any):
+    """
+    生图管线的一个阶段：同时记录耗时直方图（journey_stage_duration_seconds）、span 和慢请求时间线，
+    开启请求内存统计时在阶段结束时采样一次内存
+    """
+    start_time = time.perf_counter()
+    try:
+        with tracer.span(stage, **attributes) as span:
+            yield span
+    finally:
+        duration_seconds = time.perf_counter() - start_time
+        stage_duration.observe(duration_seconds, stage=stage)
+        note_stage(stage, duration_seconds)
+        sample_request_memory()
+
+
+def record_stage(stage: str, duration_seconds: float, start_ns: Optional[int] = None, **attributes: Any):
+    """
+    记录已经结束的阶段：耗时直方图 + span + 慢请求时间线
+    start_ns 不为空时 span 从该时间开始（span 覆盖实际的起止时间，直方图记录 duration_seconds）
+    """
+    stage_duration.observe(duration_seconds, stage=stage)
+    note_stage(stage, duration_seconds)
+    sample_request_memory()
+    tracer.record_span(stage, duration_seconds, start_ns, **attributes)
+
+
+def setup_tracing(enabled: bool = True, export_path: str = "logs/traces.jsonl", queue_size: int = 10000):
+    """
+    配置链路追踪：可重复调用，导出路径变化时重新创建导出器
+    """
+    exporter = tracer.exporter
+    if not enabled or not export_path:
+        tracer.exporter = None
+    elif exporter is None or exporter.path != Path(export_path):
+        tracer.exporter = OtlpJsonFileExporter(export_path, queue_size=queue_size)
+    else:
+        return
+    if exporter is not None and exporter is not tracer.exporter:
+        exporter.shutdown()
+
+
+def shutdown_tracing():
+    """
+    写出剩余的 span 并停止导出线程
+    """
+    if tracer.exporter is not None:
+        tracer.exporter.shutdown()
+
+
+# 全局追踪器，进程内只需要一个
+tracer = Tracer()
+atexit.register(shutdown_tracing)